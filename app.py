@@ -8,10 +8,13 @@
 flask应用主文件
 """
 import os
+import json
+import base64
+import binascii
 
-import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 
 from dotenv import load_dotenv
 
@@ -20,7 +23,7 @@ from backend.errors.exceptions import MissingParameterError, InvalidAPIRequest,
 load_dotenv()
 
 from backend.utils.logger import logger
-from backend.services import chat_service, character_manager, tts_service, database_manager
+from backend.services import chat_service, character_manager, tts_service, database_manager, voice_service, job_queue, response_cache, rag_service
 from backend.errors.error_handlers import api_error_handler, register_error_handlers
 
 # 初始化Flask应用
@@ -31,7 +34,8 @@ CORS(app, resources={
     r"/api/*": {
         "origins": "*",  # 生产环境应限制为具体域名
         "methods": ["GET", "POST", "DELETE"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "allow_headers": ["Content-Type", "Authorization", "Range", "If-None-Match"],
+        "expose_headers": ["ETag", "Content-Range", "Accept-Ranges", "Content-Location"]
     }
 })
 
@@ -56,10 +60,14 @@ def validate_environment():
     if not os.getenv("API_KEY") or not os.getenv("API_BASE"):
         logger.warning("TTS服务配置未完整，/api/voices 端点可能无法正常工作")
 
-# 初始化数据库
+# 初始化数据库与后台任务队列
 with app.app_context():
     database_manager.initialize_database()
     validate_environment()
+    job_queue.register_handler("summarize_conversation", chat_service.run_summarize_job)
+    job_queue.start()
+    # 嵌入模型与向量库在后台加载，服务可以立即开始响应请求
+    rag_service.start_background_init()
 
 
 # --- API 路由 ---
@@ -70,9 +78,27 @@ def get_characters_list():
     获取所有可用角色的列表。
     """
     logger.info("收到获取角色列表请求")
-    characters = character_manager.get_all_characters()
-    logger.info(f"成功返回 {len(characters)} 个角色")
-    return jsonify(characters)
+    payload = character_manager.get_characters_payload()
+    use_gzip = request.accept_encodings["gzip"] > 0
+    # gzip与未压缩是两种不同的表示，强ETag必须不同
+    etag = f'{payload["etag"]}-gzip' if use_gzip else payload["etag"]
+
+    # 列表未变化时直接返回304
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(
+            payload["gzip_body"] if use_gzip else payload["body"],
+            mimetype='application/json'
+        )
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        logger.info(f"成功返回 {payload['count']} 个角色")
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 @app.route('/api/characters', methods=['POST'])
@@ -98,79 +124,203 @@ def create_new_character():
 @app.route('/api/voices', methods=['GET'])
 @api_error_handler
 def get_voice_list():
-    """从TTS服务获取音色列表"""
-    logger.info("收到获取音色列表请求")
-    
-    qiniu_api_key = os.getenv("API_KEY")
-    qiniu_base_url = os.getenv("API_BASE")
-    if not qiniu_api_key or not qiniu_base_url:
-        raise FulingException("TTS服务未在后端配置。", 500)
+    """
+    获取TTS服务的音色列表（带缓存）。
+    查询参数 refresh=1 可强制从上游重新拉取。
+    """
+    force_refresh = request.args.get("refresh", "").lower() in ("1", "true")
+    logger.info(f"收到获取音色列表请求 - 强制刷新: {force_refresh}")
+    voices = voice_service.get_voice_list(force_refresh=force_refresh)
+    return jsonify(voices)
 
-    url = f"{qiniu_base_url}/voice/list"
-    headers = {"Authorization": f"Bearer {qiniu_api_key}"}
 
-    try:
-        # 添加超时设置，避免长时间等待
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # 确保请求成功
-        logger.info("成功获取音色列表")
-        return jsonify(response.json())
-    except requests.exceptions.Timeout:
-        logger.error("获取音色列表请求超时")
-        raise FulingException("获取音色列表请求超时，请稍后重试。", 504)
-    except requests.exceptions.RequestException as e:
-        logger.error(f"获取音色列表时发生网络错误: {e}")
-        raise FulingException("无法连接到TTS服务。", 503)
+def _parse_chat_request():
+    """解析当前Flask请求中的聊天请求体"""
+    return _parse_chat_payload(request.get_json())
 
 
-@app.route('/api/chat', methods=['POST'])
-@api_error_handler
-def chat():
+def _parse_chat_payload(data: dict | None):
     """
-    核心聊天接口，处理用户的对话请求。
+    解析并校验聊天请求体，必要时创建新对话。
+    客户端可以只发送 conversationId 与新消息，此时从服务端存储中恢复历史记录。
     """
-    data = request.get_json()
     if not data:
         raise InvalidAPIRequest("请求体不能为空")
-    
+
     character_id = data.get("characterId")
     user_message = data.get("message")
-    history = data.get("history", [])
+    history = data.get("history")
     conversation_id = data.get('conversationId')
-    
+
     if not character_id or not user_message:
         raise MissingParameterError("请求缺少 'characterId' 或 'message' 参数")
-    
+
     if not conversation_id:
         conversation_id = database_manager.create_conversation(character_id)
-    
+        history = history or []
+    elif history is None:
+        history = database_manager.get_history(conversation_id)
+
+    return character_id, user_message, history, conversation_id
+
+
+def _save_turn(conversation_id: str, user_message: str, reply: dict):
+    """保存一轮对话；保存失败不影响本次回复"""
+    try:
+        database_manager.append_messages(conversation_id, [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": reply["text"], "emotion": reply.get("emotion")},
+        ])
+    except Exception as e:
+        logger.error(f"保存对话 {conversation_id} 的消息失败: {e}", exc_info=True)
+
+
+def _ndjson_line(payload: dict) -> str:
+    """将事件序列化为一行NDJSON"""
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+
+def _ndjson_response(events, on_close=None):
+    """
+    将事件生成器包装为NDJSON流式响应。
+    响应头发送后的异常无法再走错误处理器，改为以 error 事件通知前端。
+    """
+    def generate():
+        try:
+            yield from events
+        except FulingException as e:
+            logger.error(f"流式响应中断 - {e.__class__.__name__}: {e.message}")
+            yield _ndjson_line({"type": "error", **e.to_dict()})
+        except Exception as e:
+            logger.critical(f"流式响应中发生未处理的异常: {str(e)}", exc_info=True)
+            yield _ndjson_line({"type": "error", "error": "服务器发生了一个意外的错误。"})
+        finally:
+            if on_close:
+                on_close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route('/api/chat', methods=['POST'])
+@api_error_handler
+def chat():
+    """
+    核心聊天接口，处理用户的对话请求。
+    """
+    character_id, user_message, history, conversation_id = _parse_chat_request()
     logger.info(f"收到聊天请求 - 角色: {character_id}, 对话ID: {conversation_id}")
 
     response_data = chat_service.process_chat_interaction(
         character_id, user_message, history
     )
+    _save_turn(conversation_id, user_message, response_data)
     response_data['conversationId'] = conversation_id
     logger.info(f"成功生成回复 - 角色: {character_id}, 对话ID: {conversation_id}")
     return jsonify(response_data)
 
 
-@app.route('/api/speech', methods=['POST'])
+@app.route('/api/chat/stream', methods=['POST'])
 @api_error_handler
-def generate_audio():
-    """TTS接口，根据文本和音色类型生成语音。"""
-    data = request.get_json()
+def chat_stream():
+    """
+    流式聊天接口，以NDJSON格式逐行返回事件：
+    meta(对话ID) -> delta(增量文本)/emotion(情绪) -> done(完整回复) 或 error。
+    如果请求体带有 'voiceType'，回复会在生成过程中逐句合成语音，并穿插返回 audio 事件。
+    """
+    character_id, user_message, history, conversation_id = _parse_chat_request()
+    voice_type = request.get_json().get("voiceType")
+    logger.info(f"收到流式聊天请求 - 角色: {character_id}, 对话ID: {conversation_id}")
+
+    # 在开始响应之前完成角色加载与LLM请求，这一阶段的错误仍按普通JSON错误返回
+    events = chat_service.stream_chat_interaction(character_id, user_message, history)
+    pipeline = tts_service.SpeechPipeline(voice_type) if voice_type else None
+
+    def generate():
+        yield _ndjson_line({"type": "meta", "conversationId": conversation_id})
+        for event in events:
+            yield _ndjson_line(event)
+            if event["type"] == "done":
+                _save_turn(conversation_id, user_message, event)
+            if pipeline is None:
+                continue
+            if event["type"] == "delta":
+                pipeline.feed(event["text"])
+            elif event["type"] == "emotion":
+                pipeline.set_emotion(event["emotion"])
+            for segment in pipeline.ready_segments():
+                yield _ndjson_line(segment)
+        if pipeline is not None:
+            for segment in pipeline.finish():
+                yield _ndjson_line(segment)
+        logger.info(f"成功完成流式回复 - 角色: {character_id}, 对话ID: {conversation_id}")
+
+    return _ndjson_response(generate(), on_close=pipeline.cancel if pipeline else None)
+
+
+def _audio_response(cache_key: str, audio: bytes, environ: dict | None = None):
+    """
+    以 audio/mpeg 原始字节返回音频。
+    音频按内容寻址，缓存键即强ETag；支持 If-None-Match(304) 与 Range(206)，POST 请求的二进制响应同样适用。
+    environ 默认取当前Flask请求，asgi.py 传入由ASGI请求头构造的 environ。
+    """
+    environ = request.environ if environ is None else environ
+    response = Response(audio, mimetype='audio/mpeg')
+    response.set_etag(cache_key)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.headers['Content-Location'] = f"/api/speech/{cache_key}"
+    # make_conditional 只处理GET/HEAD请求
+    if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+        environ = dict(environ, REQUEST_METHOD='GET')
+    try:
+        return response.make_conditional(environ, accept_ranges=True, complete_length=len(audio))
+    except RequestedRangeNotSatisfiable:
+        response = Response(status=416)
+        response.headers['Content-Range'] = f"bytes */{len(audio)}"
+        return response
+
+
+def _wants_binary_audio(data: dict, accept_mimetypes) -> bool:
+    """判断客户端是否希望直接获取音频字节而不是base64 JSON"""
+    if data.get("format") == "binary":
+        return True
+    return accept_mimetypes.best_match(['application/json', 'audio/mpeg']) == 'audio/mpeg'
+
+
+def _parse_speech_payload(data: dict | None) -> tuple[str, str, str]:
+    """解析并校验语音合成请求体，返回 (文本, 音色, 情绪)"""
     if not data:
         raise InvalidAPIRequest("请求体不能为空")
-    
+
     text = data.get("text")
     voice_type = data.get("voiceType")
     emotion = data.get("emotion", "default")
 
     if not text or not voice_type:
         raise MissingParameterError("请求缺少 'text' 或 'voiceType' 参数。")
+    return text, voice_type, emotion
+
+
+@app.route('/api/speech', methods=['POST'])
+@api_error_handler
+def generate_audio():
+    """
+    TTS接口，根据文本和音色类型生成语音。
+    默认返回 {"audioData": base64}；请求体 format=binary 或 Accept: audio/mpeg 时直接返回MP3字节。
+    """
+    data = request.get_json()
+    text, voice_type, emotion = _parse_speech_payload(data)
 
     logger.info(f"收到语音生成请求 - 音色: {voice_type}, 情绪: {emotion}")
 
+    if _wants_binary_audio(data, request.accept_mimetypes):
+        cache_key, audio = tts_service.synthesize_audio(text, voice_type, emotion)
+        logger.info("成功生成音频数据（二进制）")
+        return _audio_response(cache_key, audio)
+
     # 调用TTS服务
     base64_audio = tts_service.generate_speech(text, voice_type, emotion)
 
@@ -178,14 +328,130 @@ def generate_audio():
     return jsonify({"audioData": base64_audio})
 
 
+@app.route('/api/speech', methods=['GET'])
+@api_error_handler
+def get_audio():
+    """
+    以查询参数生成并返回MP3字节，可直接作为 <audio> 的 src 使用，支持Range与ETag。
+    """
+    text = request.args.get("text")
+    voice_type = request.args.get("voiceType")
+    emotion = request.args.get("emotion", "default")
+
+    if not text or not voice_type:
+        raise MissingParameterError("请求缺少 'text' 或 'voiceType' 参数。")
+
+    # 客户端已持有相同内容时无需读取缓存或合成
+    cache_key = tts_service.get_audio_cache_key(text, voice_type, emotion)
+    if cache_key in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(cache_key)
+        return response
+
+    cache_key, audio = tts_service.synthesize_audio(text, voice_type, emotion)
+    return _audio_response(cache_key, audio)
+
+
+@app.route('/api/speech/<audio_key>', methods=['GET'])
+@api_error_handler
+def get_cached_audio(audio_key):
+    """按缓存键获取已合成的音频，用于回放和断点续传"""
+    audio = tts_service.get_cached_audio(audio_key)
+    if audio is None:
+        raise FulingException("请求的音频不存在或已过期。", 404)
+    return _audio_response(audio_key, audio)
+
+
+@app.route('/api/speech/stream', methods=['POST'])
+@api_error_handler
+def generate_audio_stream():
+    """分句TTS接口，将文本切分为句子并发合成，以NDJSON格式按顺序逐段返回音频。"""
+    text, voice_type, emotion = _parse_speech_payload(request.get_json())
+
+    logger.info(f"收到分句语音生成请求 - 音色: {voice_type}, 情绪: {emotion}")
+
+    segments = tts_service.generate_speech_segments(text, voice_type, emotion)
+    return _ndjson_response((_ndjson_line(segment) for segment in segments), on_close=segments.close)
+
+
+# 历史对话分页的默认与最大每页条数
+CONVERSATION_PAGE_SIZE = 20
+CONVERSATION_PAGE_MAX = 100
+# 获取对话消息时 limit 参数的上限
+CONVERSATION_MESSAGES_MAX = 500
+
+
+def _encode_cursor(position: tuple) -> str:
+    """将分页位置编码为不透明的游标字符串"""
+    raw = json.dumps(list(position), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        updated_at, conversation_id = json.loads(raw)
+        return str(updated_at), str(conversation_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidAPIRequest("分页游标 'cursor' 无效。")
+
+
+def _stream_json_array(items):
+    """逐条序列化并输出JSON数组"""
+    yield "["
+    for index, item in enumerate(items):
+        yield ("," if index else "") + json.dumps(item, ensure_ascii=False, default=str)
+    yield "]"
+
+
 @app.route('/api/conversations/<character_id>', methods=['GET'])
 @api_error_handler
 def get_character_conversations(character_id):
-    """获取与特定角色的历史对话列表"""
-    logger.info(f"收到获取对话历史请求 - 角色: {character_id}")
-    conversations = database_manager.get_conversations_by_character(character_id)
-    logger.info(f"成功返回 {len(conversations)} 条对话记录")
-    return jsonify(conversations)
+    """
+    获取与特定角色的历史对话列表。
+    - 带 limit 或 cursor 参数时按键集分页，返回 {"items", "nextCursor"}，withCount=1 时附带总数。
+    - 不带分页参数时保持原有行为，返回全部记录组成的JSON数组（逐条序列化输出）。
+    """
+    args = request.args
+    if "limit" not in args and "cursor" not in args:
+        logger.info(f"收到获取对话历史请求 - 角色: {character_id}")
+        # 先读出全部记录再开始响应：数据库连接不随客户端的读取速度长时间占用，查询出错时也能返回正常的错误响应
+        conversations = database_manager.get_conversations_by_character(character_id)
+        return Response(_stream_json_array(conversations), mimetype='application/json')
+
+    try:
+        limit = int(args.get("limit", CONVERSATION_PAGE_SIZE))
+    except ValueError:
+        raise InvalidAPIRequest("参数 'limit' 必须是整数。")
+    limit = max(1, min(limit, CONVERSATION_PAGE_MAX))
+    after = _decode_cursor(args["cursor"]) if args.get("cursor") else None
+
+    logger.info(f"收到分页获取对话历史请求 - 角色: {character_id}, 每页: {limit}")
+    items, next_position = database_manager.get_conversations_page(character_id, limit=limit, after=after)
+    page = {
+        "items": items,
+        "nextCursor": _encode_cursor(next_position) if next_position else None,
+    }
+    if args.get("withCount", "").lower() in ("1", "true"):
+        page["total"] = database_manager.count_conversations_by_character(character_id)
+    logger.info(f"成功返回 {len(items)} 条对话记录")
+    return jsonify(page)
+
+
+@app.route('/api/conversations/<conversation_id>/messages', methods=['GET'])
+@api_error_handler
+def get_conversation_messages(conversation_id):
+    """获取对话中保存的消息，可用 limit 参数只取最近的若干条（1 ~ CONVERSATION_MESSAGES_MAX）"""
+    limit = request.args.get("limit")
+    try:
+        limit = int(limit) if limit else None
+    except ValueError:
+        raise InvalidAPIRequest("参数 'limit' 必须是整数。")
+    if limit is not None:
+        limit = max(1, min(limit, CONVERSATION_MESSAGES_MAX))
+    messages = database_manager.get_messages(conversation_id, limit=limit)
+    logger.info(f"成功返回对话 {conversation_id} 的 {len(messages)} 条消息")
+    return jsonify(messages)
 
 
 @app.route('/api/conversations/<conversation_id>', methods=['DELETE'])
@@ -201,32 +467,68 @@ def delete_conversation_by_id(conversation_id):
 @app.route('/api/conversations/<conversation_id>/summarize', methods=['POST'])
 @api_error_handler
 def summarize_and_end_conversation(conversation_id):
-    """为对话生成并保存摘要"""
-    data = request.get_json()
-    if not data:
-        raise InvalidAPIRequest("请求体不能为空")
-    
-    history = data.get("history", [])
-
-    if not history:
+    """
+    提交生成对话摘要的后台任务，立即返回202和任务ID，可通过 /api/jobs/<job_id> 查询进度。
+    """
+    data = request.get_json(silent=True) or {}
+    history = data.get("history")
+    if history is None and not database_manager.get_messages(conversation_id, limit=1):
+        raise InvalidAPIRequest("请求缺少'history'字段")
+    if history is not None and not history:
         raise InvalidAPIRequest("请求缺少'history'字段")
 
     logger.info(f"收到生成对话摘要请求 - 对话ID: {conversation_id}")
-    summary = chat_service.summarize_conversation(history)
-    first_message = history[0].get('content', '') if history else ''
+    # 未提供历史记录时，由任务在执行时读取服务端保存的消息
+    job_id = job_queue.enqueue("summarize_conversation", {"conversationId": conversation_id, "history": history})
+    return jsonify({"status": "accepted", "jobId": job_id, "statusUrl": f"/api/jobs/{job_id}"}), 202
 
-    database_manager.update_conversation_summary(conversation_id, summary, first_message)
-    logger.info(f"成功生成并保存对话摘要 - 对话ID: {conversation_id}")
-    return jsonify({"status": "success", "summary": summary})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@api_error_handler
+def get_job_status(job_id):
+    """查询后台任务的状态与结果"""
+    job = job_queue.get_job_status(job_id)
+    if job is None:
+        raise FulingException("指定的任务不存在。", 404)
+    return jsonify(job)
 
 
 # --- 健康检查端点 ---
+@app.route('/api/health/live', methods=['GET'])
+def liveness_check():
+    """存活检查：进程能够响应请求即视为存活"""
+    return jsonify({"status": "alive"})
+
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_check():
+    """
+    就绪检查：数据库可用，且RAG子系统已结束加载时返回200，否则返回503。
+    RAG加载失败时仍视为就绪（知识型问题会回退到通用知识回答），状态中会注明。
+    """
+    rag_status = rag_service.get_status()
+    database_ok = database_manager.check_database()
+    ready = database_ok and rag_status["status"] not in ("pending", "loading")
+    return jsonify({
+        "status": "ready" if ready else "not_ready",
+        "database": "ok" if database_ok else "unavailable",
+        "rag": rag_status
+    }), 200 if ready else 503
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查端点，用于监控服务状态"""
     return jsonify({
         "status": "healthy",
-        "service": "Fuling API"
+        "service": "Fuling API",
+        "rag": rag_service.get_status(),
+        "ttsCache": tts_service.get_cache_stats(),
+        "responseCache": response_cache.RESPONSE_CACHE.stats(),
+        "upstream": {
+            "llm": chat_service.get_upstream_stats(),
+            "tts": tts_service.get_upstream_stats()
+        }
     })
 
 
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/16 10:20
+# @Author : Ray
+# @File : asgi.py
+# @Software: PyCharm
+"""
+异步服务入口（ASGI）
+聊天与TTS这类主要时间花在等待上游的接口由原生协程处理，单个进程即可同时保持大量进行中的请求；
+其余接口原样交给Flask应用（在线程池中运行）。两种模式的路由、请求格式与错误格式完全一致。
+启动: uvicorn asgi:app --host 0.0.0.0 --port 5123
+"""
+import json
+import asyncio
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from app import (
+    app as flask_app, _parse_chat_payload, _parse_speech_payload, _wants_binary_audio, _save_turn, _ndjson_line,
+    _audio_response,
+)
+from backend.services import chat_service, tts_service, http_client
+from backend.errors.exceptions import FulingException
+from backend.errors.error_handlers import async_api_error_handler
+from backend.utils.logger import logger
+
+_wsgi_app = WsgiToAsgi(flask_app)
+
+# 与Flask应用的CORS配置保持一致（预检请求仍由Flask处理）
+_CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-expose-headers", b"ETag, Content-Range, Accept-Ranges, Content-Location"),
+]
+
+
+class AsyncRequest:
+    """原生异步路由使用的请求对象，只提供这些路由需要的部分"""
+
+    def __init__(self, scope: dict, receive):
+        self._receive = receive
+        self.method = scope["method"]
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope["headers"]}
+
+    @property
+    def environ(self) -> dict:
+        """只含请求方法与请求头的WSGI environ，供复用基于werkzeug的条件请求处理"""
+        environ = {"REQUEST_METHOD": self.method}
+        for key, value in self.headers.items():
+            environ["HTTP_" + key.upper().replace("-", "_")] = value
+        return environ
+
+    @property
+    def accept_mimetypes(self) -> MIMEAccept:
+        return parse_accept_header(self.headers.get("accept"), MIMEAccept)
+
+    async def get_json(self) -> dict | None:
+        """读取并解析JSON请求体，请求体为空或不是合法JSON时返回None"""
+        max_length = flask_app.config['MAX_CONTENT_LENGTH']
+        body = bytearray()
+        while True:
+            message = await self._receive()
+            body.extend(message.get("body", b""))
+            if len(body) > max_length:
+                raise FulingException("请求体过大。", 413)
+            if not message.get("more_body"):
+                break
+        try:
+            return json.loads(body) if body else None
+        except ValueError:
+            return None
+
+
+class AsyncResponse:
+    """原生异步路由的响应：body 为完整字节，或 stream 为逐块产出字符串的异步生成器"""
+
+    def __init__(self, body: bytes = b"", status: int = 200, mimetype: str = "application/json",
+                 headers: dict | None = None, stream=None):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.headers = headers or {}
+        self.stream = stream
+
+
+def _json_response(payload: dict, status: int = 200) -> AsyncResponse:
+    return AsyncResponse(json.dumps(payload, ensure_ascii=False).encode('utf-8'), status=status)
+
+
+def _from_wsgi_response(response, environ: dict) -> AsyncResponse:
+    """将werkzeug响应（如 app._audio_response 的304/206/416结果）转换为 AsyncResponse"""
+    headers = {
+        key: value for key, value in response.get_wsgi_headers(environ).items()
+        if key.lower() not in ("content-type", "content-length")
+    }
+    return AsyncResponse(b"".join(response.get_app_iter(environ)), status=response.status_code,
+                         mimetype=response.content_type or "application/octet-stream", headers=headers)
+
+
+def _ndjson_response(events, on_close=None) -> AsyncResponse:
+    """
+    app._ndjson_response 的异步版本。
+    响应头发送后的异常无法再走错误处理器，改为以 error 事件通知前端。
+    """
+    async def generate():
+        try:
+            async for line in events:
+                yield line
+        except FulingException as e:
+            logger.error(f"流式响应中断 - {e.__class__.__name__}: {e.message}")
+            yield _ndjson_line({"type": "error", **e.to_dict()})
+        except Exception as e:
+            logger.critical(f"流式响应中发生未处理的异常: {str(e)}", exc_info=True)
+            yield _ndjson_line({"type": "error", "error": "服务器发生了一个意外的错误。"})
+        finally:
+            await events.aclose()
+            if on_close:
+                on_close()
+
+    return AsyncResponse(
+        mimetype='application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        stream=generate(),
+    )
+
+
+# --- 原生异步路由 ---
+@async_api_error_handler
+async def chat(request: AsyncRequest):
+    """核心聊天接口，与 app.chat 相同"""
+    data = await request.get_json()
+    character_id, user_message, history, conversation_id = await asyncio.to_thread(_parse_chat_payload, data)
+    logger.info(f"收到聊天请求 - 角色: {character_id}, 对话ID: {conversation_id}")
+
+    response_data = await chat_service.aprocess_chat_interaction(character_id, user_message, history)
+    await asyncio.to_thread(_save_turn, conversation_id, user_message, response_data)
+    response_data['conversationId'] = conversation_id
+    logger.info(f"成功生成回复 - 角色: {character_id}, 对话ID: {conversation_id}")
+    return response_data
+
+
+@async_api_error_handler
+async def chat_stream(request: AsyncRequest):
+    """流式聊天接口，与 app.chat_stream 相同"""
+    data = await request.get_json()
+    character_id, user_message, history, conversation_id = await asyncio.to_thread(_parse_chat_payload, data)
+    voice_type = data.get("voiceType")
+    logger.info(f"收到流式聊天请求 - 角色: {character_id}, 对话ID: {conversation_id}")
+
+    events = await chat_service.astream_chat_interaction(character_id, user_message, history)
+    pipeline = tts_service.AsyncSpeechPipeline(voice_type) if voice_type else None
+
+    async def generate():
+        yield _ndjson_line({"type": "meta", "conversationId": conversation_id})
+        async for event in events:
+            yield _ndjson_line(event)
+            if event["type"] == "done":
+                await asyncio.to_thread(_save_turn, conversation_id, user_message, event)
+            if pipeline is None:
+                continue
+            if event["type"] == "delta":
+                pipeline.feed(event["text"])
+            elif event["type"] == "emotion":
+                pipeline.set_emotion(event["emotion"])
+            for segment in pipeline.ready_segments():
+                yield _ndjson_line(segment)
+        if pipeline is not None:
+            async for segment in pipeline.finish():
+                yield _ndjson_line(segment)
+        logger.info(f"成功完成流式回复 - 角色: {character_id}, 对话ID: {conversation_id}")
+
+    return _ndjson_response(generate(), on_close=pipeline.cancel if pipeline else None)
+
+
+@async_api_error_handler
+async def generate_audio(request: AsyncRequest):
+    """TTS接口，与 app.generate_audio 相同"""
+    data = await request.get_json()
+    text, voice_type, emotion = _parse_speech_payload(data)
+    logger.info(f"收到语音生成请求 - 音色: {voice_type}, 情绪: {emotion}")
+
+    if _wants_binary_audio(data, request.accept_mimetypes):
+        cache_key, audio = await tts_service.asynthesize_audio(text, voice_type, emotion)
+        logger.info("成功生成音频数据（二进制）")
+        return _from_wsgi_response(_audio_response(cache_key, audio, request.environ), request.environ)
+
+    base64_audio = await tts_service.agenerate_speech(text, voice_type, emotion)
+    logger.info("成功生成音频数据")
+    return {"audioData": base64_audio}
+
+
+@async_api_error_handler
+async def generate_audio_stream(request: AsyncRequest):
+    """分句TTS接口，与 app.generate_audio_stream 相同"""
+    text, voice_type, emotion = _parse_speech_payload(await request.get_json())
+    logger.info(f"收到分句语音生成请求 - 音色: {voice_type}, 情绪: {emotion}")
+
+    segments = tts_service.agenerate_speech_segments(text, voice_type, emotion)
+
+    async def generate():
+        try:
+            async for segment in segments:
+                yield _ndjson_line(segment)
+        finally:
+            await segments.aclose()
+
+    return _ndjson_response(generate())
+
+
+_ASYNC_ROUTES = {
+    ("POST", "/api/chat"): chat,
+    ("POST", "/api/chat/stream"): chat_stream,
+    ("POST", "/api/speech"): generate_audio,
+    ("POST", "/api/speech/stream"): generate_audio_stream,
+}
+
+
+# --- ASGI 协议处理 ---
+def _to_response(result) -> AsyncResponse:
+    """将路由返回值（响应对象、字典或 (字典, 状态码)）统一为 AsyncResponse"""
+    if isinstance(result, AsyncResponse):
+        return result
+    if isinstance(result, tuple):
+        return _json_response(*result)
+    return _json_response(result)
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _pump(stream, send):
+    try:
+        async for chunk in stream:
+            await send({"type": "http.response.body", "body": chunk.encode('utf-8'), "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        await stream.aclose()
+
+
+async def _send_response(response: AsyncResponse, receive, send):
+    headers = [(b"content-type", response.mimetype.encode('latin-1'))] + _CORS_HEADERS
+    headers += [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in response.headers.items()]
+
+    if response.stream is None:
+        headers.append((b"content-length", str(len(response.body)).encode('latin-1')))
+        await send({"type": "http.response.start", "status": response.status, "headers": headers})
+        await send({"type": "http.response.body", "body": response.body})
+        return
+
+    await send({"type": "http.response.start", "status": response.status, "headers": headers})
+    # 客户端断开连接时立即取消流式响应，连带关闭与LLM/TTS的上游请求
+    pump = asyncio.create_task(_pump(response.stream, send))
+    watcher = asyncio.create_task(_wait_for_disconnect(receive))
+    try:
+        done, _ = await asyncio.wait({pump, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if pump in done:
+            pump.result()
+        else:
+            logger.info("客户端已断开连接，停止流式响应。")
+    finally:
+        pump.cancel()
+        watcher.cancel()
+        await asyncio.gather(pump, watcher, return_exceptions=True)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            logger.info("Fuling应用（ASGI）启动...")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await http_client.close_async_client()
+            await chat_service.async_client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI应用：命中原生异步路由的请求直接处理，其余交给Flask"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+
+    handler = _ASYNC_ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler is None:
+        await _wsgi_app(scope, receive, send)
+        return
+
+    result = await handler(AsyncRequest(scope, receive))
+    await _send_response(_to_response(result), receive, send)
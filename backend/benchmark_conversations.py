@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/13 16:05
+# @Author : Ray
+# @File : benchmark_conversations.py
+# @Software: PyCharm
+"""
+对话查询基准测试
+- 在临时数据库中生成指定规模的对话记录，对比有无索引时的查询计划与延迟
+- 用法（在项目根目录下）: python -m backend.benchmark_conversations --rows 10000 100000 1000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+from backend.utils.logger import logger
+from backend.services import database_manager
+
+# 直接使用 get_latest_summary 与 get_conversations_page 执行的语句，每页20条（多取一条判断是否有下一页）
+PAGE_LIMIT = 21
+# 后续页的游标取时间范围的中点，id 取最小值之前的字符串，即从该时刻之前的记录开始
+BASE_TIME = datetime(2025, 1, 1)
+TIME_SPAN_SECONDS = 300 * 86400
+CURSOR = (str(BASE_TIME + timedelta(seconds=TIME_SPAN_SECONDS // 2)), "")
+
+
+def populate(conn, rows: int, characters: int, users: int):
+    """批量写入对话记录，约三成对话没有摘要"""
+    def generate():
+        for i in range(rows):
+            has_summary = random.random() > 0.3
+            yield (
+                f"conv-{i}",
+                f"character_{random.randrange(characters)}",
+                f"user_{random.randrange(users)}",
+                f"摘要 {i}" if has_summary else None,
+                str(BASE_TIME + timedelta(seconds=random.randrange(TIME_SPAN_SECONDS))),
+                f"首条消息 {i}" if has_summary else None,
+            )
+
+    conn.executemany(
+        "INSERT INTO conversations (id, character_id, user_id, summary, updated_at, first_message) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        generate()
+    )
+    conn.commit()
+
+
+def benchmark_queries() -> list:
+    """(名称, SQL, 角色与用户之后的参数)"""
+    return [
+        ("最近摘要", database_manager.LATEST_SUMMARY_SQL, ()),
+        ("对话列表首页", database_manager.CONVERSATION_PAGE_SQL, (PAGE_LIMIT,)),
+        ("对话列表后续页", database_manager.CONVERSATION_CURSOR_PAGE_SQL, (*CURSOR, PAGE_LIMIT)),
+    ]
+
+
+def measure(conn, sql: str, extra_params: tuple, characters: int, users: int, repeat: int) -> tuple[float, float]:
+    """返回 (p50, p95) 查询延迟，单位毫秒"""
+    samples = []
+    for _ in range(repeat):
+        params = (f"character_{random.randrange(characters)}", f"user_{random.randrange(users)}", *extra_params)
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def query_plan(conn, sql: str, extra_params: tuple) -> str:
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", ("character_0", "user_0", *extra_params)).fetchall()
+    return "; ".join(row[3] for row in rows)
+
+
+def run(rows: int, characters: int, users: int, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_manager.DB_PATH = os.path.join(tmp_dir, "benchmark.db")
+        database_manager.initialize_database()
+
+        with database_manager.get_db_connection() as conn:
+            populate(conn, rows, characters, users)
+            results = {}
+            for label in ("无索引", "有索引"):
+                if label == "无索引":
+                    conn.execute("DROP INDEX idx_conversations_summarized")
+                else:
+                    # 只重建迁移1创建的部分索引，不改动数据库的迁移版本
+                    for statement in database_manager.MIGRATIONS[0]:
+                        conn.execute(statement)
+                conn.execute("ANALYZE")
+                results[label] = {
+                    name: (measure(conn, sql, extra, characters, users, repeat), query_plan(conn, sql, extra))
+                    for name, sql, extra in benchmark_queries()
+                }
+
+        database_manager._get_pool().close_all()
+
+    print(f"\n=== {rows:,} 条对话 ({characters} 个角色, {users} 个用户) ===")
+    for label, queries in results.items():
+        for name, ((p50, p95), plan) in queries.items():
+            print(f"[{label}] {name:<10} p50={p50:8.3f}ms  p95={p95:8.3f}ms  计划: {plan}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对话查询索引基准测试")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--characters", type=int, default=20)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    # 基准测试期间只输出警告以上的日志，避免日志I/O干扰计时
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    random.seed(42)
+    for rows in args.rows:
+        run(rows, args.characters, args.users, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,26 @@ def api_error_handler(f):
             return jsonify(error_response), 500
     return decorated_function
 
+def async_api_error_handler(f):
+    """
+    api_error_handler 的协程版本，供 asgi.py 中的原生异步路由使用。
+    出错时返回 (错误字典, 状态码)，错误格式与同步路由完全一致。
+    """
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        try:
+            return await f(*args, **kwargs)
+        except FulingException as e:
+            logger.error(f"API Error - {e.__class__.__name__}: {e.message}", exc_info=True)
+            return e.to_dict(), e.status_code
+        except Exception as e:
+            logger.critical(f"Unhandled Exception: {str(e)}", exc_info=True)
+            error_response = {
+                "error": "服务器发生了一个意外的错误。"
+            }
+            return error_response, 500
+    return decorated_function
+
 def register_error_handlers(app):
     """
     一个函数，用于在Flask app上注册通用的错误处理器。
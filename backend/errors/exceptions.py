@@ -58,6 +58,13 @@ class TTSServiceError(FulingException):
         super().__init__(message, status_code=502)
 
 
+class UpstreamBusyError(FulingException):
+    """当等待上游服务（LLM/TTS）的调用额度超时时引发"""
+
+    def __init__(self, message="服务繁忙，请稍后重试。"):
+        super().__init__(message, status_code=503)
+
+
 class MissingParameterError(FulingException):
     """当API请求缺少必要参数时引发"""
 
@@ -7,12 +7,34 @@
 """
 知识库索引
 - 替换为国内可访问的m3e-small模型（ModelScope）
+- 同时导出NumPy检索后端（RAG_BACKEND=numpy）使用的向量矩阵，以及混合检索使用的BM25倒排索引
+- 文件名中第一个 . 之前的部分为角色ID，同一角色可以分为多个文件（如 li_bai.part1.txt、li_bai.part2.txt），
+  角色的全部文件一起导出为一份索引
+- 增量索引：段落ID由内容哈希得出，只为新增或修改过的段落生成向量，删除已移除的段落；
+  索引清单（manifest.json）记录每个文件的状态，知识库没有变化时无需加载模型即可结束
+- 分段：--- 为硬边界，超长段落按句子切分为不超过 CHUNK_MAX_TOKENS 的段落（见 utils/chunker.py）
+- 批量处理：文件按块读取并逐段切分，段落按批次去重、比对并交给编码进程池，向量按批次写入ChromaDB，
+  导出的段落与向量也按批次追加到临时文件，支持单个角色数十MB的知识库（如整部小说）。
+  内存中只保留段落ID与BM25倒排表，不保留整个文件的段落与向量
 """
 import os
-import chromadb
-from sentence_transformers import SentenceTransformer
-from modelscope import snapshot_download
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dotenv import load_dotenv
 from utils.logger import logger
+from utils.bm25 import BM25Index
+from utils.chunker import SECTION_SEPARATOR, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, chunk_sections
+from utils.text_splitter import last_sentence_end
+
+# 与服务一样从 .env 读取配置，保证两边使用同一个索引目录
+load_dotenv()
 
 # --- 配置 ---
 KNOWLEDGE_BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'knowledge_base'))
@@ -20,83 +42,492 @@ CHROMA_DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'chroma
 MODEL_ID = "AI-ModelScope/m3e-small"  # ModelScope模型ID
 COLLECTION_NAME = "fuling_rag"
 MODEL_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'model_cache'))  # 模型本地保存目录
+# NumPy检索后端的索引目录，与 rag_service 一样可由 RAG_INDEX_DIR 指定（索引脚本与服务的工作目录不同，应使用绝对路径）
+VECTOR_INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), 'vector_index')))
+MANIFEST_PATH = os.path.join(VECTOR_INDEX_DIR, 'manifest.json')  # 增量索引清单
+
+# 编码进程数（1为在当前进程中编码）、每批交给模型编码的段落数、每次写入ChromaDB的段落数
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "1"))
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+INDEX_WRITE_BATCH = int(os.getenv("INDEX_WRITE_BATCH", "1000"))
+# 读取知识库文件时每次读入的字符数
+READ_BLOCK_CHARS = 1 << 20
+# 没有 --- 分隔符的长文本，每累积到该字符数就在最后一个句末处切开，避免整个文件成为一个段落
+MAX_SECTION_CHARS = 1 << 16
+
+# 嵌入模型与ChromaDB集合在第一次需要时才加载
+_model = None
+_collection = None
+
+
+def get_model():
+    """从ModelScope下载（或复用本地缓存的）嵌入模型并加载，只加载一次"""
+    global _model
+    if _model is not None:
+        return _model
+
+    from sentence_transformers import SentenceTransformer
+    from modelscope import snapshot_download
 
+    # 创建模型缓存目录
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
 
-def main():
+    # 先从ModelScope下载模型到本地
+    logger.info(f"正在从ModelScope下载模型: {MODEL_ID}...")
+    local_model_dir = snapshot_download(
+        model_id=MODEL_ID,
+        cache_dir=MODEL_CACHE_DIR,  # 保存到指定目录
+        revision='master',  # 模型版本
+        ignore_file_pattern=["*.bin.index.json"]
+    )
+    logger.info(f"模型下载完成，本地路径: {local_model_dir}")
+
+    # 加载本地模型
+    logger.info("正在初始化本地嵌入模型...")
+    _model = SentenceTransformer(
+        model_name_or_path=local_model_dir,  # 传入本地模型路径
+        trust_remote_code=True,  # 国内模型需要此参数
+        cache_folder=MODEL_CACHE_DIR  # 缓存目录保持一致
+    )
+    logger.info("模型加载完毕。")
+    return _model
+
+
+def get_collection():
+    """连接ChromaDB并获取（或创建）知识库集合，只连接一次"""
+    global _collection
+    if _collection is None:
+        import chromadb
+
+        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        _collection = client.get_or_create_collection(name=COLLECTION_NAME)
+        logger.info(f"已连接到ChromaDB集合: '{COLLECTION_NAME}'")
+    return _collection
+
+
+def iter_sections(filepath: str):
     """
-    读取知识库文件，使用国内模型生成向量，存入ChromaDB
-    知识库更新后运行一次即可
+    逐块读取文件并按 --- 分隔符逐段产出，不需要一次读入整个文件。
+    尚未结束的段落超过 MAX_SECTION_CHARS 时，在其中最后一个句末处切开（没有句末标点时直接按长度切开）。
     """
-    logger.info("--- 开始索引知识库 ---")
+    rest = ""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        while block := f.read(READ_BLOCK_CHARS):
+            parts = (rest + block).split(SECTION_SEPARATOR)
+            rest = parts.pop()  # 最后一段可能尚未结束，与下一块拼接后再切分
+            for section in parts:
+                if section.strip():
+                    yield section.strip()
+            while len(rest) > MAX_SECTION_CHARS:
+                cut = last_sentence_end(rest[:MAX_SECTION_CHARS]) or MAX_SECTION_CHARS
+                section, rest = rest[:cut].strip(), rest[cut:]
+                if section:
+                    yield section
+    if rest.strip():
+        yield rest.strip()
+
+
+def iter_batches(items, size: int):
+    """将可迭代对象按 size 个一组依次产出列表"""
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
+
+
+def current_chunking() -> dict:
+    """当前的分段参数，记录在索引清单中；参数变化后所有文件都需要重新分段"""
+    return {"max_tokens": CHUNK_MAX_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS}
+
+
+def file_sha256(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        while block := f.read(READ_BLOCK_CHARS):
+            digest.update(block)
+    return digest.hexdigest()
 
+
+def _encode_batch(chunks: list) -> np.ndarray:
+    """编码一批段落；在编码进程中运行时，每个进程只加载一次模型"""
+    return np.asarray(get_model().encode(chunks, convert_to_numpy=True), dtype=np.float32)
+
+
+class ChunkEncoder:
+    """
+    批量编码段落。workers > 1 时由进程池并行编码，同时在途的批次数不超过 workers 的两倍；
+    结果按提交顺序产出，并每隔 report_seconds 秒输出累计进度与吞吐量。
+    调用方（index_character）每次只传入一个写入批次的新段落。
+    """
+
+    def __init__(self, workers: int = INDEX_WORKERS, batch_size: int = INDEX_BATCH_SIZE, report_seconds: float = 5):
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.report_seconds = report_seconds
+        self._executor = None
+        self._last_report = time.monotonic()
+        self.encoded = 0
+        self.seconds = 0.0
+
+    def encode(self, chunks: list):
+        """按顺序逐批产出 (该批段落, 向量矩阵)"""
+        batches = (chunks[i:i + self.batch_size] for i in range(0, len(chunks), self.batch_size))
+        start = time.monotonic()
+        for batch, embeddings in self._run(batches):
+            now = time.monotonic()
+            self.encoded += len(batch)
+            self.seconds += now - start
+            start = now
+            if now - self._last_report >= self.report_seconds:
+                self._last_report = now
+                logger.info(f"已编码 {self.encoded} 个段落，{self.encoded / max(self.seconds, 1e-9):.1f} 段/秒")
+            yield batch, embeddings
+
+    def _run(self, batches):
+        if self.workers == 1:
+            for batch in batches:
+                yield batch, _encode_batch(batch)
+            return
+
+        if self._executor is None:
+            logger.info(f"启动 {self.workers} 个编码进程...")
+            # 使用spawn：fork会复制父进程中已加载的模型与ChromaDB连接（及其线程和锁），子进程可能因此卡死
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, self._executor.submit(_encode_batch, batch)))
+            if len(pending) >= self.workers * 2:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def chunk_id(character_id: str, chunk: str) -> str:
+    """由段落内容得出的稳定ID：内容不变ID就不变，与段落在文件中的位置无关"""
+    return f"{character_id}_{hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:16]}"
+
+
+def load_manifest() -> dict:
+    """
+    读取索引清单，格式: {"model_id": ..., "chunking": ..., "files": {文件名: {character_id, size, mtime_ns, sha256, chunk_ids}}}
+    chunk_ids 为该文件首次引入的段落ID（同一角色中排在前面的文件已有的段落不再记录）
+    """
     try:
-        # 1. 创建模型缓存目录
-        os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
-
-        # 2. 先从ModelScope下载模型到本地
-        logger.info(f"正在从ModelScope下载模型: {MODEL_ID}...")
-        # 下载模型到MODEL_CACHE_DIR，返回本地实际保存路径
-        local_model_dir = snapshot_download(
-            model_id=MODEL_ID,
-            cache_dir=MODEL_CACHE_DIR,  # 保存到指定目录
-            revision='master',  # 模型版本
-            ignore_file_pattern=["*.bin.index.json"]
-        )
-        logger.info(f"模型下载完成，本地路径: {local_model_dir}")
-
-        # 3. 加载本地模型
-        logger.info("正在初始化本地嵌入模型...")
-        model = SentenceTransformer(
-            model_name_or_path=local_model_dir,  # 传入本地模型路径
-            trust_remote_code=True,  # 国内模型需要此参数
-            cache_folder=MODEL_CACHE_DIR  # 缓存目录保持一致
-        )
-        logger.info("模型加载完毕。")
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"model_id": MODEL_ID, "files": {}}
 
-        # 4. 初始化ChromaDB客户端
-        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        collection = client.get_or_create_collection(name=COLLECTION_NAME)
-        logger.info(f"已连接到ChromaDB集合: '{COLLECTION_NAME}'")
 
-        # 5. 遍历处理知识库文件
-        for filename in os.listdir(KNOWLEDGE_BASE_DIR):
-            if filename.endswith(".txt"):
-                character_id = filename.split('.')[0]
-                filepath = os.path.join(KNOWLEDGE_BASE_DIR, filename)
+def save_manifest(manifest: dict):
+    os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+    with open(MANIFEST_PATH + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(MANIFEST_PATH + ".tmp", MANIFEST_PATH)
+
+
+def load_numpy_rows(character_id: str, row_ids: list) -> tuple[dict, np.ndarray | None]:
+    """
+    以内存映射方式打开已导出的向量矩阵，row_ids 为清单中记录的各行段落ID。
+    返回 ({段落ID: 行号}, 矩阵)；矩阵不存在或与清单对不上时返回 ({}, None)，此时所有段落重新生成向量。
+    """
+    try:
+        matrix = np.load(os.path.join(VECTOR_INDEX_DIR, f"{character_id}.npy"), mmap_mode='r')
+    except (OSError, ValueError):
+        return {}, None
+    if len(row_ids) != len(matrix):
+        return {}, None
+    return {doc_id: row for row, doc_id in enumerate(row_ids)}, matrix
+
+
+class IndexExport:
+    """
+    逐批写出一个角色的导出索引：
+    - <character_id>.npy 为 float32 向量矩阵，<character_id>.json 为按行对应的段落，供 RAG_BACKEND=numpy 使用；
+    - <character_id>.bm25.json 为混合检索使用的BM25倒排索引。
+    向量与段落先逐批追加到临时文件，finish() 时再组装为最终文件并原子替换，内存中只保留段落ID。
+    先写矩阵再写json，服务端以json的修改时间判断是否需要重新加载。
+    """
 
-                logger.info(f"正在处理文件: {filename}，角色ID: {character_id}")
+    def __init__(self, character_id: str):
+        os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+        self.prefix = os.path.join(VECTOR_INDEX_DIR, character_id)
+        self.ids = []
+        self.dimension = None
+        self._vectors = open(self.prefix + ".vectors.part", 'wb')
+        self._documents = open(self.prefix + ".documents.part", 'w', encoding='utf-8')
 
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
+    def append(self, ids: list, chunks: list, embeddings: np.ndarray):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.dimension = embeddings.shape[1]
+        self._vectors.write(embeddings.tobytes())
+        for chunk in chunks:
+            self._documents.write(json.dumps(chunk, ensure_ascii=False) + "\n")  # 每行一个段落
+        self.ids.extend(ids)
 
-                    chunks = [chunk.strip() for chunk in content.split('---') if chunk.strip()]
-                    if not chunks:
-                        logger.warning(f"文件 {filename} 为空或格式不正确，已跳过。")
-                        continue
+    def _iter_documents(self):
+        with open(self.prefix + ".documents.part", 'r', encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip("\n")
 
-                    logger.info(f"正在为 {len(chunks)} 个段落生成向量...")
-                    embeddings = model.encode(chunks).tolist()
+    def finish(self):
+        self._vectors.close()
+        self._documents.close()
+        try:
+            matrix = np.memmap(self.prefix + ".vectors.part", dtype=np.float32, mode='r',
+                               shape=(len(self.ids), self.dimension))
+            with open(self.prefix + ".npy.tmp", 'wb') as f:
+                np.save(f, matrix)
+            del matrix
+            os.replace(self.prefix + ".npy.tmp", self.prefix + ".npy")
 
-                    ids = [f"{character_id}_{i}" for i in range(len(chunks))]
-                    metadatas = [{"character_id": character_id, "filename": filename} for _ in range(len(chunks))]
+            with open(self.prefix + ".json.tmp", 'w', encoding='utf-8') as f:
+                f.write('{"ids": ')
+                json.dump(self.ids, f)
+                f.write(', "documents": [')
+                for row, document in enumerate(self._iter_documents()):
+                    f.write((", " if row else "") + document)
+                f.write(']}')
+            os.replace(self.prefix + ".json.tmp", self.prefix + ".json")
 
-                    collection.add(
-                        embeddings=embeddings,
-                        documents=chunks,
-                        metadatas=metadatas,
-                        ids=ids
+            documents = (json.loads(document) for document in self._iter_documents())
+            BM25Index.build(self.ids, documents).save(self.prefix + ".bm25.json")
+        finally:
+            self.discard()
+
+    def discard(self):
+        """删除临时文件（出错或没有段落时调用）"""
+        self._vectors.close()
+        self._documents.close()
+        for suffix in (".vectors.part", ".documents.part"):
+            try:
+                os.remove(self.prefix + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def remove_character(character_id: str):
+    """删除角色在ChromaDB中的全部向量及其导出的索引文件"""
+    get_collection().delete(where={"character_id": character_id})
+    for suffix in (".npy", ".json", ".bm25.json"):
+        try:
+            os.remove(os.path.join(VECTOR_INDEX_DIR, f"{character_id}{suffix}"))
+        except FileNotFoundError:
+            pass
+
+
+def character_of(filename: str) -> str:
+    """文件名中第一个 . 之前的部分为角色ID"""
+    return filename.split('.')[0]
+
+
+def _unchanged_entry(filepath: str, entry: dict | None, file_hash: str | None) -> dict | None:
+    """文件内容与清单条目一致时返回（更新了大小与修改时间的）条目，否则返回None"""
+    if not entry:
+        return None
+    stat = os.stat(filepath)
+    # 1. 大小与修改时间都没变：不读文件
+    if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry
+    # 2. 只是修改时间变了（例如重新保存），内容相同
+    if entry["sha256"] == (file_hash or file_sha256(filepath)):
+        return {**entry, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return None
+
+
+def index_character(character_id: str, filenames: list, entries: dict, encoder: ChunkEncoder,
+                    rechunk: bool = False) -> tuple[dict, dict]:
+    """
+    增量索引一个角色的全部知识库文件（按文件名顺序），所有文件的段落一起导出为该角色的索引。
+    entries 为清单中该角色各文件的条目 {文件名: 条目}；rechunk=True 时即使文件未变化也重新分段（分段参数变化时），
+    内容相同的段落仍复用向量。
+    返回 (新的条目, 统计)；文件都未变化时原样返回旧条目，角色没有有效段落时条目为空。
+    """
+    stats = {"added": 0, "removed": 0, "unchanged": 0}
+    old_filenames = sorted(entries)
+    if not rechunk and old_filenames == filenames:
+        unchanged = {
+            filename: _unchanged_entry(os.path.join(KNOWLEDGE_BASE_DIR, filename), entries[filename], None)
+            for filename in filenames
+        }
+        if all(unchanged.values()):
+            stats["unchanged"] = sum(len(entry["chunk_ids"]) for entry in unchanged.values())
+            return unchanged, stats
+
+    logger.info(f"正在处理角色 '{character_id}' 的 {len(filenames)} 个文件: {', '.join(filenames)}")
+    # 导出矩阵的各行依次为各文件首次出现的段落（按文件名顺序），与清单中的 chunk_ids 一一对应
+    old_row_ids = [doc_id for filename in old_filenames for doc_id in entries[filename]["chunk_ids"]]
+    old_ids = set(old_row_ids)
+    # 未变化的段落从已导出的矩阵中复用向量，只为新段落生成向量
+    rows, stored = load_numpy_rows(character_id, old_row_ids)
+
+    collection = get_collection()
+    if not entries:
+        # 清单中没有记录（首次增量索引或清单丢失），清掉旧的按位置编号的向量，避免重复
+        collection.delete(where={"character_id": character_id})
+
+    export = IndexExport(character_id)
+    seen = set()
+    new_entries = {}
+    try:
+        for filename in filenames:
+            filepath = os.path.join(KNOWLEDGE_BASE_DIR, filename)
+            stat = os.stat(filepath)
+            file_ids = []
+            for batch in iter_batches(chunk_sections(iter_sections(filepath)), INDEX_WRITE_BATCH):
+                ids, chunks = [], []
+                for chunk in batch:
+                    doc_id = chunk_id(character_id, chunk)
+                    if doc_id not in seen:  # 完全相同的段落只保留一份
+                        seen.add(doc_id)
+                        ids.append(doc_id)
+                        chunks.append(chunk)
+                if not ids:
+                    continue
+
+                reused = [doc_id for doc_id in ids if doc_id in rows]
+                # 按行号一次取出并复制，不保留对旧矩阵的引用
+                vectors = dict(zip(reused, np.array(stored[[rows[doc_id] for doc_id in reused]]))) if reused else {}
+                new_chunks = {doc_id: chunk for doc_id, chunk in zip(ids, chunks) if doc_id not in vectors}
+                if new_chunks:
+                    new_ids = list(new_chunks)
+                    embeddings = np.concatenate([e for _, e in encoder.encode(list(new_chunks.values()))])
+                    collection.upsert(
+                        embeddings=embeddings.tolist(),
+                        documents=list(new_chunks.values()),
+                        metadatas=[{"character_id": character_id, "filename": filename} for _ in new_ids],
+                        ids=new_ids
                     )
-                    logger.info(f"成功为角色 '{character_id}' 添加了 {len(chunks)} 个向量文档。")
+                    vectors.update(zip(new_ids, embeddings))
+                export.append(ids, chunks, np.stack([vectors[doc_id] for doc_id in ids]))
+                file_ids.extend(ids)
+                stats["added"] += len(new_chunks)
+                stats["unchanged"] += len(ids) - len(new_chunks)
+
+            if not file_ids:
+                logger.warning(f"文件 {filename} 为空或格式不正确，已跳过。")
+            new_entries[filename] = {
+                "character_id": character_id,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_sha256(filepath),
+                "chunk_ids": file_ids,
+            }
+    except BaseException:
+        export.discard()
+        raise
+    # 导出文件替换前释放对旧矩阵的内存映射
+    del stored
+
+    removed_ids = sorted(old_ids - seen)
+    stats["removed"] = len(removed_ids)
+    if entries and removed_ids:
+        collection.delete(ids=removed_ids)
+
+    if not export.ids:
+        export.discard()
+        if entries:
+            remove_character(character_id)
+        return {}, stats
+
+    export.finish()
+    logger.info(
+        f"角色 '{character_id}' 索引完成: 新增 {stats['added']} 个段落, 删除 {stats['removed']} 个, "
+        f"未变化 {stats['unchanged']} 个。"
+    )
+    return new_entries, stats
 
-                except Exception as e:
-                    logger.error(f"处理文件 {filename} 时出错: {str(e)}", exc_info=True)
 
-        logger.info("--- 知识库索引完成 ---")
+def main(full: bool = False, workers: int = INDEX_WORKERS, batch_size: int = INDEX_BATCH_SIZE):
+    """
+    增量索引知识库：有文件新增、修改或删除的角色重新切分其全部文件，只为变化的段落生成向量；
+    文件全部删除的角色从索引中移除。full=True 时忽略索引清单，全部重建。
+    """
+    logger.info("--- 开始索引知识库 ---")
+    start = time.monotonic()
+    manifest = load_manifest()
+    files = manifest["files"]
+    # 模型变更或要求全部重建时，已有向量都不能复用（已删除文件的清理仍依据旧清单）
+    reuse = not full and manifest.get("model_id") == MODEL_ID
+    if not full and not reuse:
+        logger.info(f"嵌入模型已由 {manifest.get('model_id')} 变更为 {MODEL_ID}，将重新索引全部文件。")
+    manifest["model_id"] = MODEL_ID
+    rechunk = manifest.get("chunking") != current_chunking()
+    if rechunk and files:
+        logger.info(f"分段参数已变更为 {current_chunking()}，将重新分段全部文件。")
+    manifest["chunking"] = current_chunking()
+    totals = {"added": 0, "removed": 0, "unchanged": 0}
+    changed = not reuse or rechunk
+    encoder = ChunkEncoder(workers, batch_size)
+
+    try:
+        characters = {}
+        for filename in sorted(os.listdir(KNOWLEDGE_BASE_DIR)):
+            if filename.endswith(".txt"):
+                characters.setdefault(character_of(filename), []).append(filename)
+        indexed = {}
+        for filename, entry in files.items():
+            indexed.setdefault(entry["character_id"], {})[filename] = entry
+
+        # 1. 移除文件已全部删除的角色
+        for character_id in sorted(set(indexed) - set(characters)):
+            entries = indexed.pop(character_id)
+            logger.info(f"文件 {', '.join(sorted(entries))} 已删除，移除角色 '{character_id}' 的索引。")
+            remove_character(character_id)
+            for filename, entry in entries.items():
+                files.pop(filename)
+                totals["removed"] += len(entry["chunk_ids"])
+            changed = True
+
+        # 2. 逐个角色增量索引
+        for character_id, filenames in sorted(characters.items()):
+            entries = indexed.get(character_id, {}) if reuse else {}
+            try:
+                new_entries, stats = index_character(character_id, filenames, entries, encoder, rechunk)
+            except Exception as e:
+                logger.error(f"处理角色 '{character_id}' 的文件时出错: {str(e)}", exc_info=True)
+                continue
+            for key, value in stats.items():
+                totals[key] += value
+            if new_entries != indexed.get(character_id, {}):
+                changed = True
+                for filename in indexed.get(character_id, {}):
+                    files.pop(filename, None)
+                files.update(new_entries)
+
+        if changed:
+            save_manifest(manifest)
+        logger.info(
+            f"--- 知识库索引完成: 新增 {totals['added']} 个段落, 删除 {totals['removed']} 个, "
+            f"未变化 {totals['unchanged']} 个, 耗时 {time.monotonic() - start:.2f} 秒 ---"
+        )
+        if encoder.encoded:
+            logger.info(f"编码吞吐量: {encoder.encoded / max(encoder.seconds, 1e-9):.1f} 段/秒")
 
     except Exception as e:
         logger.critical(f"索引过程发生致命错误: {str(e)}", exc_info=True)
+    finally:
+        encoder.close()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="增量索引知识库")
+    parser.add_argument("--full", action="store_true", help="忽略索引清单，重新生成全部向量")
+    parser.add_argument("--workers", type=int, default=INDEX_WORKERS, help="编码进程数")
+    parser.add_argument("--batch-size", type=int, default=INDEX_BATCH_SIZE, help="每批编码的段落数")
+    args = parser.parse_args()
+    main(full=args.full, workers=args.workers, batch_size=args.batch_size)
@@ -8,7 +8,11 @@
 角色管理服务
 """
 import os
+import gzip
 import json
+import time
+import hashlib
+import threading
 
 from backend.utils.chinese_to_pinyin import chinese_to_pinyin
 from backend.utils.logger import logger
@@ -18,71 +22,198 @@ _SERVICE_DIR = os.path.dirname(__file__)
 CHARACTERS_DIR = os.path.abspath(os.path.join(_SERVICE_DIR, '..', 'characters'))
 KNOWLEDGE_BASE_DIR = os.path.abspath(os.path.join(_SERVICE_DIR, '..', 'knowledge_base'))
 
-def get_character_prompt(character_id: str) -> str:
+# 两次检查角色目录变更之间的最小间隔（秒）
+CHARACTER_RELOAD_INTERVAL = float(os.getenv("CHARACTER_RELOAD_INTERVAL", "2"))
+
+REQUIRED_KEYS = ["id", "name", "description", "imageUrl", "voiceType"]
+
+_INVALID = object()  # 标记无法解析的角色文件
+
+
+class CharacterRegistry:
     """
-    根据角色ID从JSON文件中加载系统提示。
-    如果找不到文件或加载失败，则引发CharacterNotFound异常。
+    进程内的角色注册表。
+    角色文件只在首次加载或发生变更时解析一次，之后按角色ID直接从内存读取。
+    通过轮询文件的 mtime/大小 发现新增、修改和删除，只重新加载变化的文件。
     """
-    filepath = os.path.join(CHARACTERS_DIR, f"{character_id}.json")
 
-    if not os.path.exists(filepath):
-        logger.warning(f"尝试加载一个不存在的角色文件: {filepath}")
-        raise CharacterNotFound(f"角色 '{character_id}' 的配置文件未找到。")
+    def __init__(self, directory: str, reload_interval: float):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.version = 0  # 每次角色数据发生变化时递增
+        self._characters = {}  # 角色ID -> 角色数据 或 _INVALID
+        self._stats = {}  # 角色ID -> (mtime_ns, size)
+        self._lock = threading.Lock()
+        self._last_scan = None
+
+    def current_version(self) -> int:
+        self._refresh_if_due()
+        return self.version
+
+    def get(self, character_id: str):
+        """返回角色数据；不存在时返回None，文件损坏时返回 _INVALID"""
+        self._refresh_if_due()
+        return self._characters.get(character_id)
+
+    def list(self) -> list:
+        """按文件名顺序返回所有字段完整的角色"""
+        self._refresh_if_due()
+        characters = self._characters
+        return [
+            data for _, data in sorted(characters.items())
+            if data is not _INVALID and all(k in data for k in REQUIRED_KEYS)
+        ]
+
+    def put(self, character_id: str, data: dict):
+        """角色文件写入后直接更新注册表，无需等待下一次轮询"""
+        filepath = os.path.join(self.directory, f"{character_id}.json")
+        with self._lock:
+            self._characters = {**self._characters, character_id: data}
+            self._stats[character_id] = self._stat(filepath)
+            self.version += 1
+
+    def reload(self):
+        """立即检查目录变更"""
+        with self._lock:
+            self._scan()
+
+    def _refresh_if_due(self):
+        now = time.monotonic()
+        if self._last_scan is not None and now - self._last_scan < self.reload_interval:
+            return
+        with self._lock:
+            if self._last_scan is None or now - self._last_scan >= self.reload_interval:
+                self._scan()
+
+    @staticmethod
+    def _stat(filepath: str):
+        stat = os.stat(filepath)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _scan(self):
+        """对比文件状态，重新加载有变化的角色文件（调用方需持有锁）"""
+        self._last_scan = time.monotonic()
+        if not os.path.exists(self.directory):
+            logger.warning(f"角色目录 '{self.directory}' 不存在。")
+            return
+
+        current = {}
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                try:
+                    current[filename[:-5]] = self._stat(os.path.join(self.directory, filename))
+                except OSError:
+                    continue
+
+        changed = [cid for cid, stat in current.items() if self._stats.get(cid) != stat]
+        removed = [cid for cid in self._stats if cid not in current]
+        if not changed and not removed:
+            return
 
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            character_data = json.load(f)
-            prompt = character_data.get("system_prompt")
-            if not prompt:
-                raise ValueError("JSON文件中缺少 'system_prompt' 键。")
-            return prompt
-    except (json.JSONDecodeError, ValueError) as e:
-        logger.error(f"加载或解析角色文件 {filepath} 时出错: {e}")
+        # 先在副本上修改再整体替换，读线程无需加锁
+        characters = dict(self._characters)
+        for character_id in removed:
+            characters.pop(character_id, None)
+            self._stats.pop(character_id, None)
+            logger.info(f"角色 '{character_id}' 的配置文件已删除，已从注册表移除。")
+        for character_id in changed:
+            characters[character_id] = self._load_file(character_id)
+            self._stats[character_id] = current[character_id]
+
+        self._characters = characters
+        self.version += 1
+        logger.info(f"角色注册表已更新: 重新加载 {len(changed)} 个, 移除 {len(removed)} 个。")
+
+    def _load_file(self, character_id: str):
+        filename = f"{character_id}.json"
+        filepath = os.path.join(self.directory, filename)
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"加载或读取角色文件 {filename} 时出错: {e}，已跳过。")
+            return _INVALID
+        except Exception as e:
+            logger.critical(f"处理角色文件 {filename} 时发生未知严重错误: {e}，已跳过。", exc_info=True)
+            return _INVALID
+
+        if not isinstance(data, dict):
+            logger.error(f"角色文件 {filename} 的内容不是JSON对象，已跳过。")
+            return _INVALID
+        missing_keys = [k for k in REQUIRED_KEYS if k not in data]
+        if missing_keys:
+            logger.warning(f"角色文件 {filename} 缺少必要字段: {missing_keys}，不会出现在角色列表中。")
+        return data
+
+
+_registry = CharacterRegistry(CHARACTERS_DIR, CHARACTER_RELOAD_INTERVAL)
+
+
+def get_registry_version() -> int:
+    """返回角色注册表的当前版本号，角色数据发生任何变化时都会改变"""
+    return _registry.current_version()
+
+
+def get_character_prompt(character_id: str) -> str:
+    """
+    根据角色ID加载系统提示。
+    如果找不到角色或角色配置无效，则引发CharacterNotFound异常。
+    """
+    character_data = get_character_data(character_id)
+    prompt = character_data.get("system_prompt")
+    if not prompt:
+        logger.error(f"角色 '{character_id}' 的配置中缺少 'system_prompt' 键。")
         raise CharacterNotFound(f"角色 '{character_id}' 的配置文件无效或已损坏。")
+    return prompt
 
 
 def get_all_characters() -> list:
     """
-    加载并返回所有角色的基本信息列表。
+    返回所有角色的基本信息列表。
     """
-    characters = []
-    if not os.path.exists(CHARACTERS_DIR):
-        logger.warning(f"角色目录 '{CHARACTERS_DIR}' 不存在。")
-        return []
+    return [dict(data) for data in _registry.list()]
 
-    required_keys = ["id", "name", "description", "imageUrl", "voiceType"]
-    for filename in os.listdir(CHARACTERS_DIR):
-        if filename.endswith(".json"):
-            filepath = os.path.join(CHARACTERS_DIR, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
 
-                    if all(k in data for k in required_keys):
-                        characters.append(data)
-                    else:
-                        missing_keys = [k for k in required_keys if k not in data]
-                        logger.warning(f"角色文件 {filename} 缺少必要字段: {missing_keys}，已跳过。")
+_payload_cache = {"version": None, "payload": None}
+_payload_lock = threading.Lock()
+
+
+def get_characters_payload() -> dict:
+    """
+    返回角色列表接口的预计算响应：只包含公开字段的JSON字节、gzip压缩后的字节和强ETag。
+    每个注册表版本只序列化和压缩一次。
+    """
+    version = _registry.current_version()
+    cached = _payload_cache
+    if cached["version"] == version:
+        return cached["payload"]
 
-            except (json.JSONDecodeError, IOError) as e:
-                logger.error(f"加载或读取角色文件 {filename} 时出错: {e}，已跳过。")
-            except Exception as e:
-                logger.critical(f"处理角色文件 {filename} 时发生未知严重错误: {e}，已跳过。", exc_info=True)
+    with _payload_lock:
+        if _payload_cache["version"] == version:
+            return _payload_cache["payload"]
 
-    return characters
+        characters = [{k: data[k] for k in REQUIRED_KEYS} for data in _registry.list()]
+        body = json.dumps(characters, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        payload = {
+            "count": len(characters),
+            "body": body,
+            "gzip_body": gzip.compress(body, mtime=0),
+            "etag": hashlib.sha256(body).hexdigest()[:32],
+        }
+        _payload_cache.update(version=version, payload=payload)
+        logger.info(f"角色列表响应已重新生成: {len(characters)} 个角色, {len(body)} 字节。")
+        return payload
 
 
 def get_character_data(character_id: str) -> dict:
-    """根据角色ID加载完整的角色数据字典"""
-    filepath = os.path.join(CHARACTERS_DIR, f"{character_id}.json")
-    if not os.path.exists(filepath):
+    """根据角色ID返回完整的角色数据字典"""
+    data = _registry.get(character_id)
+    if data is None:
+        logger.warning(f"尝试加载一个不存在的角色: {character_id}")
         raise CharacterNotFound(f"角色 '{character_id}' 的配置文件未找到。")
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"加载角色数据文件 {filepath} 时出错: {e}")
+    if data is _INVALID:
         raise CharacterNotFound(f"角色 '{character_id}' 的配置文件无效或已损坏。")
+    return dict(data)
 
 
 def create_character(name: str, description: str, voice_type: str, image_file):
@@ -134,5 +265,6 @@ def create_character(name: str, description: str, voice_type: str, image_file):
     with open(json_filepath, 'w', encoding='utf-8') as f:
         json.dump(character_data, f, ensure_ascii=False, indent=2)
 
+    _registry.put(character_id, character_data)
     logger.info(f"角色配置文件已创建: {json_filepath}")
 
@@ -10,18 +10,38 @@
 
 import os
 import json
-from openai import OpenAI, APIError
-from . import character_manager, rag_service, database_manager
+import asyncio
+import hashlib
+import weakref
+from openai import OpenAI, AsyncOpenAI, APIError
+from . import character_manager, rag_service, database_manager, context_manager, response_cache
 from backend.utils.logger import logger
-from backend.errors.exceptions import LlmServiceError, ApiResponseParseError
+from backend.utils.json_stream import StreamingResponseParser
+from backend.errors.exceptions import LlmServiceError, ApiResponseParseError, UpstreamBusyError
+from backend.services.upstream_limiter import UpstreamLimiter, SingleFlight
 
 # --- 初始化 API 客户端 ---
 client = OpenAI(
     api_key=os.getenv("API_KEY"),
     base_url=os.getenv("API_BASE"),
 )
+# 异步服务模式（asgi.py）使用的客户端，等待LLM响应期间不占用线程
+async_client = AsyncOpenAI(
+    api_key=os.getenv("API_KEY"),
+    base_url=os.getenv("API_BASE"),
+)
 llm_model = os.getenv("MODEL")
 
+# 发往LLM的并发上限与速率限制（每秒请求数，0表示不限速），所有调用共享
+LLM_LIMITER = UpstreamLimiter(
+    "llm",
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    rate=float(os.getenv("LLM_RATE_LIMIT", "0")),
+    burst=int(os.getenv("LLM_RATE_BURST", "8")),
+)
+# 消息完全相同的非流式请求同时到达时只调用一次LLM
+_LLM_FLIGHTS = SingleFlight("llm")
+
 RAG_PROMPT_TEMPLATE = """
 你现在扮演 {character_name}。
 **核心任务**:
@@ -46,10 +66,11 @@ RAG_PROMPT_TEMPLATE = """
 """
 
 
-def process_chat_interaction(character_id: str, user_message: str, history: list) -> dict:
+def _build_chat_messages(character_id: str, user_message: str, history: list) -> tuple[list, dict]:
     """
-    处理聊天交互，会根据角色和问题类型决定是否启用RAG。
+    构建发送给LLM的消息列表，会根据角色和问题类型决定是否启用RAG。
     如果RAG检索失败，会优雅地回退到通用知识回答。
+    返回 (消息列表, 角色数据)。
     """
     character_data = character_manager.get_character_data(character_id)
     latest_summary = database_manager.get_latest_summary(character_id)
@@ -58,9 +79,6 @@ def process_chat_interaction(character_id: str, user_message: str, history: list
         memory_injection = f"\n\n**情景回顾**: 你和用户的上一次对话摘要如下，你可以自然地利用这些信息继续本次对话：\n---{latest_summary}\n---"
 
     system_prompt = character_data["system_prompt"] + memory_injection
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(history)
-    messages.append({"role": "user", "content": user_message})
 
     # --- 检查是否满足RAG条件 ---
     if character_data.get("rag_enabled") and rag_service.is_knowledge_query(user_message):
@@ -79,28 +97,79 @@ def process_chat_interaction(character_id: str, user_message: str, history: list
                 {"role": "system", "content": rag_system_prompt},
                 {"role": "user", "content": user_message}
             ]
+            return messages, character_data
         else:
             # --- 步骤 4: 如果检索失败，则什么都不做，自然回退 ---
             logger.info("未检索到特定上下文，将使用角色的通用知识库进行回答。")
 
-    # ---  统一的API调用和解析流程 ---
-    try:
-        logger.info(f"向LLM API发送请求, 角色: {character_id}, 模型: {llm_model}")
+    # 在token预算内保留最近的轮次，较早的轮次折叠为摘要
+    messages = context_manager.fit_messages(
+        system_prompt, history, user_message, model=llm_model, summarizer=_summarize_messages
+    )
+    return messages, character_data
+
+
+def _cacheable_prompt(character_data: dict, history: list, messages: list) -> str | None:
+    """
+    只有不携带历史记录的请求（首轮对话或RAG问答）才使用回复缓存。
+    以传入的 history 判断，而不是最终的消息数：历史被折叠且摘要失败时，消息列表看起来也像单轮对话。
+    可缓存时返回作为缓存范围的系统提示，否则返回None。
+    """
+    if history or not response_cache.is_enabled_for(character_data):
+        return None
+    return messages[0]["content"]
+
+
+def _prepare_chat(character_id: str, user_message: str, history: list) -> tuple[list, str | None, dict | None]:
+    """
+    构建消息列表并查询回复缓存。
+    返回 (消息列表, 缓存范围提示, 缓存命中的回复)，不可缓存时后两项为None。
+    """
+    messages, character_data = _build_chat_messages(character_id, user_message, history)
+    cache_prompt = _cacheable_prompt(character_data, history, messages)
+    if cache_prompt is None:
+        return messages, None, None
+    cached = response_cache.RESPONSE_CACHE.lookup(character_id, cache_prompt, user_message)
+    if cached is not None:
+        logger.info(f"回复缓存命中, 角色: {character_id}")
+    return messages, cache_prompt, cached
+
+
+def _completion_key(messages: list, temperature: float) -> str:
+    """请求合并使用的键：模型、温度与消息列表完全相同的请求视为同一请求"""
+    raw = json.dumps([llm_model, temperature, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _request_completion(messages: list, temperature: float) -> str:
+    """在LLM调用额度内发起非流式请求，返回回复文本"""
+    with LLM_LIMITER.acquire():
         completion = client.chat.completions.create(
             model=llm_model,
             messages=messages,
-            temperature=0.3,
+            temperature=temperature,
         )
-        llm_response_str = completion.choices[0].message.content
-        logger.info("成功从LLM API收到响应。")
+    return completion.choices[0].message.content
 
-    except APIError as e:
-        logger.error(f"调用LLM API时发生APIError: {e}")
-        raise LlmServiceError("AI服务接口返回错误。")
-    except Exception as e:
-        logger.error(f"调用LLM API时发生未知错误: {e}")
-        raise LlmServiceError("与AI服务通信时发生未知网络或配置错误。")
 
+async def _arequest_completion(messages: list, temperature: float) -> str:
+    """_request_completion 的异步版本"""
+    with await LLM_LIMITER.acquire_async():
+        completion = await async_client.chat.completions.create(
+            model=llm_model,
+            messages=messages,
+            temperature=temperature,
+        )
+    return completion.choices[0].message.content
+
+
+def get_upstream_stats() -> dict:
+    """返回LLM调用的排队与合并统计"""
+    return {"limiter": LLM_LIMITER.stats(), "coalescing": _LLM_FLIGHTS.stats()}
+
+
+def _parse_llm_response(llm_response_str: str) -> dict:
+    """将LLM返回的JSON字符串解析为 {"text", "emotion"}"""
     try:
         parsed_response = json.loads(llm_response_str)
 
@@ -119,23 +188,319 @@ def process_chat_interaction(character_id: str, user_message: str, history: list
         raise ApiResponseParseError("无法解析AI服务的响应格式。")
 
 
-def summarize_conversation(history: list) -> str:
-    """调用LLM为对话历史生成摘要"""
-    if len(history) < 2:
-        return "一段简短的问候。"
+def process_chat_interaction(character_id: str, user_message: str, history: list) -> dict:
+    """
+    处理聊天交互，等待LLM返回完整回复后解析为 {"text", "emotion"}。
+    """
+    messages, cache_prompt, cached = _prepare_chat(character_id, user_message, history)
+    if cached is not None:
+        return cached
 
-    summary_prompt = "请为以下对话内容生成一个简洁的、第三人称的摘要，不超过50个字，用于角色在未来回忆起这次对话：\n\n" + json.dumps(
-        history, ensure_ascii=False)
+    # ---  统一的API调用和解析流程 ---
+    try:
+        logger.info(f"向LLM API发送请求, 角色: {character_id}, 模型: {llm_model}")
+        llm_response_str = _LLM_FLIGHTS.do(
+            _completion_key(messages, 0.3), lambda: _request_completion(messages, 0.3)
+        )
+        logger.info("成功从LLM API收到响应。")
+
+    except UpstreamBusyError:
+        raise
+    except APIError as e:
+        logger.error(f"调用LLM API时发生APIError: {e}")
+        raise LlmServiceError("AI服务接口返回错误。")
+    except Exception as e:
+        logger.error(f"调用LLM API时发生未知错误: {e}")
+        raise LlmServiceError("与AI服务通信时发生未知网络或配置错误。")
+
+    result = _parse_llm_response(llm_response_str)
+    if cache_prompt is not None:
+        response_cache.RESPONSE_CACHE.store(character_id, cache_prompt, user_message, result)
+    return result
+
+
+def stream_chat_interaction(character_id: str, user_message: str, history: list):
+    """
+    流式处理聊天交互。
+    角色加载、RAG检索和LLM请求在调用时立即执行（错误可由路由的错误处理器捕获），
+    返回一个事件生成器，随LLM输出逐步产出 delta / emotion 事件，最后产出 done 事件。
+    """
+    messages, cache_prompt, cached = _prepare_chat(character_id, user_message, history)
+    if cached is not None:
+        return _iter_cached_events(cached)
+    on_complete = _cache_store_callback(character_id, cache_prompt, user_message)
 
+    # 流式请求在整个读取过程中都占用一份调用额度
+    permit = LLM_LIMITER.acquire()
     try:
-        completion = client.chat.completions.create(
+        logger.info(f"向LLM API发送流式请求, 角色: {character_id}, 模型: {llm_model}")
+        stream = client.chat.completions.create(
             model=llm_model,
-            messages=[{"role": "user", "content": summary_prompt}],
-            temperature=0.1,
+            messages=messages,
+            temperature=0.3,
+            stream=True,
         )
-        summary = completion.choices[0].message.content
+    except APIError as e:
+        permit.release()
+        logger.error(f"调用LLM API时发生APIError: {e}")
+        raise LlmServiceError("AI服务接口返回错误。")
+    except Exception as e:
+        permit.release()
+        logger.error(f"调用LLM API时发生未知错误: {e}")
+        raise LlmServiceError("与AI服务通信时发生未知网络或配置错误。")
+
+    events = _iter_stream_events(stream, character_id, on_complete, permit)
+    # 生成器未被迭代就被丢弃时（如客户端提前断开），同样归还额度
+    weakref.finalize(events, permit.release)
+    return events
+
+
+def _cache_store_callback(character_id: str, cache_prompt: str | None, user_message: str):
+    """返回流式回复完成时写入回复缓存的回调，不可缓存时返回None"""
+    if cache_prompt is None:
+        return None
+
+    def on_complete(result):
+        response_cache.RESPONSE_CACHE.store(character_id, cache_prompt, user_message, result)
+    return on_complete
+
+
+def _iter_cached_events(result: dict):
+    """以流式事件的形式返回缓存中的完整回复"""
+    yield {"type": "delta", "text": result["text"]}
+    yield {"type": "emotion", "emotion": result["emotion"]}
+    yield {"type": "done", "text": result["text"], "emotion": result["emotion"]}
+
+
+def _iter_stream_events(stream, character_id: str, on_complete=None, permit=None):
+    """
+    逐块读取LLM的流式输出，并转换为前端可消费的事件。
+    读取结束或生成器提前关闭（客户端断开）时归还调用额度，并关闭与LLM的连接。
+    """
+    parser = StreamingResponseParser()
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield from parser.feed(delta)
+    except APIError as e:
+        logger.error(f"读取LLM流式响应时发生APIError: {e}")
+        raise LlmServiceError("AI服务接口返回错误。")
+    except Exception as e:
+        logger.error(f"读取LLM流式响应时发生未知错误: {e}")
+        raise LlmServiceError("与AI服务通信时发生未知网络或配置错误。")
+    finally:
+        if permit is not None:
+            permit.release()
+        stream.close()
+
+    yield _finish_stream(parser, character_id, on_complete)
+
+
+def _finish_stream(parser: StreamingResponseParser, character_id: str, on_complete=None) -> dict:
+    """校验完整的流式输出并返回 done 事件"""
+    try:
+        result = parser.finish()
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.error(f"解析LLM流式响应时出错: {e}。已接收的文本: {parser.text}")
+        raise ApiResponseParseError("无法解析AI服务的响应格式。")
+
+    logger.info(f"LLM流式响应完成, 角色: {character_id}")
+    if on_complete is not None:
+        on_complete(result)
+    return {"type": "done", "text": result["text"], "emotion": result["emotion"]}
+
+
+# --- 异步版本：供 asgi.py 使用 ---
+# 消息构建（数据库查询、RAG向量编码、历史折叠）仍是同步代码，放到线程中执行；
+# 与LLM之间的网络等待则完全在事件循环中进行。
+
+async def aprocess_chat_interaction(character_id: str, user_message: str, history: list) -> dict:
+    """process_chat_interaction 的异步版本"""
+    messages, cache_prompt, cached = await asyncio.to_thread(_prepare_chat, character_id, user_message, history)
+    if cached is not None:
+        return cached
+
+    try:
+        logger.info(f"向LLM API发送请求, 角色: {character_id}, 模型: {llm_model}")
+        llm_response_str = await _LLM_FLIGHTS.do_async(
+            _completion_key(messages, 0.3), lambda: _arequest_completion(messages, 0.3)
+        )
+        logger.info("成功从LLM API收到响应。")
+
+    except UpstreamBusyError:
+        raise
+    except APIError as e:
+        logger.error(f"调用LLM API时发生APIError: {e}")
+        raise LlmServiceError("AI服务接口返回错误。")
+    except Exception as e:
+        logger.error(f"调用LLM API时发生未知错误: {e}")
+        raise LlmServiceError("与AI服务通信时发生未知网络或配置错误。")
+
+    result = _parse_llm_response(llm_response_str)
+    if cache_prompt is not None:
+        await asyncio.to_thread(response_cache.RESPONSE_CACHE.store, character_id, cache_prompt, user_message, result)
+    return result
+
+
+async def astream_chat_interaction(character_id: str, user_message: str, history: list):
+    """
+    stream_chat_interaction 的异步版本。
+    建立LLM流式请求后返回异步事件生成器，事件格式与同步版本相同。
+    """
+    messages, cache_prompt, cached = await asyncio.to_thread(_prepare_chat, character_id, user_message, history)
+    if cached is not None:
+        return _aiter_events(_iter_cached_events(cached))
+    on_complete = _cache_store_callback(character_id, cache_prompt, user_message)
+
+    permit = await LLM_LIMITER.acquire_async()
+    try:
+        logger.info(f"向LLM API发送流式请求, 角色: {character_id}, 模型: {llm_model}")
+        stream = await async_client.chat.completions.create(
+            model=llm_model,
+            messages=messages,
+            temperature=0.3,
+            stream=True,
+        )
+    except APIError as e:
+        permit.release()
+        logger.error(f"调用LLM API时发生APIError: {e}")
+        raise LlmServiceError("AI服务接口返回错误。")
+    except Exception as e:
+        permit.release()
+        logger.error(f"调用LLM API时发生未知错误: {e}")
+        raise LlmServiceError("与AI服务通信时发生未知网络或配置错误。")
+    except asyncio.CancelledError:
+        permit.release()
+        raise
+
+    events = _aiter_stream_events(stream, character_id, on_complete, permit)
+    weakref.finalize(events, permit.release)
+    return events
+
+
+async def _aiter_events(events):
+    """将同步事件序列包装为异步生成器"""
+    for event in events:
+        yield event
+
+
+async def _aiter_stream_events(stream, character_id: str, on_complete=None, permit=None):
+    """_iter_stream_events 的异步版本，生成器关闭时同时关闭与LLM的连接"""
+    parser = StreamingResponseParser()
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                for event in parser.feed(delta):
+                    yield event
+    except APIError as e:
+        logger.error(f"读取LLM流式响应时发生APIError: {e}")
+        raise LlmServiceError("AI服务接口返回错误。")
+    except Exception as e:
+        logger.error(f"读取LLM流式响应时发生未知错误: {e}")
+        raise LlmServiceError("与AI服务通信时发生未知网络或配置错误。")
+    finally:
+        if permit is not None:
+            permit.release()
+        await stream.close()
+
+    done = _finish_stream(parser, character_id)
+    if on_complete is not None:
+        await asyncio.to_thread(on_complete, {"text": done["text"], "emotion": done["emotion"]})
+    yield done
+
+
+def _summarize_messages(previous_summary: str | None, messages: list) -> str | None:
+    """
+    将一段对话（连同此前已有的摘要）压缩为新的摘要，用于折叠超出上下文预算的历史。
+    失败时返回None，调用方直接丢弃这些较早的消息。
+    """
+    prompt = "请将以下对话内容压缩为简洁的第三人称摘要，保留关键事实、用户的偏好和尚未结束的话题，不超过200字。\n\n"
+    if previous_summary:
+        prompt += f"此前对话的摘要：\n{previous_summary}\n\n新增的对话内容：\n"
+    prompt += json.dumps(messages, ensure_ascii=False)
+
+    try:
+        return _request_completion([{"role": "user", "content": prompt}], 0.1)
+    except Exception as e:
+        logger.error(f"折叠历史消息时生成摘要出错: {e}")
+        return None
+
+
+def summarize_conversation(history: list, previous_summary: str | None = None) -> str:
+    """
+    调用LLM为对话历史生成摘要。
+    提供 previous_summary 时，history 只需包含上次摘要之后的新消息，将二者合并为新的摘要。
+    调用失败时引发 LlmServiceError，由后台任务重试；不会用兜底文本代替摘要。
+    """
+    if not previous_summary and len(history) < 2:
+        return "一段简短的问候。"
+
+    if previous_summary:
+        summary_prompt = (
+            "以下是一段对话此前的摘要和之后新增的对话内容。请将它们合并为一个简洁的、第三人称的摘要，"
+            "不超过50个字，用于角色在未来回忆起这次对话：\n\n"
+            f"此前的摘要：{previous_summary}\n\n新增的对话内容：\n" + json.dumps(history, ensure_ascii=False)
+        )
+    else:
+        summary_prompt = "请为以下对话内容生成一个简洁的、第三人称的摘要，不超过50个字，用于角色在未来回忆起这次对话：\n\n" + json.dumps(
+            history, ensure_ascii=False)
+
+    try:
+        summary = _request_completion([{"role": "user", "content": summary_prompt}], 0.1)
         logger.info(f"成功生成对话摘要: {summary}")
         return summary
     except Exception as e:
         logger.error(f"生成摘要时出错: {e}")
-        return "一次难忘的交流。"
+        raise LlmServiceError("生成对话摘要失败。")
+
+
+def _history_hash(messages: list) -> str:
+    """对话消息（只看 role 与 content）的哈希，用于确认客户端回传的历史与已总结的部分一致"""
+    raw = json.dumps([[m.get("role"), m.get("content")] for m in messages], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def summarize_and_save(conversation_id: str, history: list) -> str:
+    """
+    增量更新对话摘要并保存：只把上次摘要之后的新消息连同旧摘要交给LLM，
+    成本与新增的轮次成正比，而不是与整段对话成正比。
+    history 的前 summarized_count 条与上次总结的消息不一致（哈希不同）时，改为完整重新总结。
+    生成摘要失败时引发异常，不会写入任何内容，也不会推进 summarized_count。
+    """
+    previous_summary, summarized_count, summarized_hash = database_manager.get_summary_state(conversation_id)
+
+    if (previous_summary and 0 < summarized_count <= len(history)
+            and summarized_hash == _history_hash(history[:summarized_count])):
+        new_messages = history[summarized_count:]
+        if not new_messages:
+            logger.info(f"对话 {conversation_id} 没有新消息，沿用已有摘要。")
+            return previous_summary
+        logger.info(f"增量总结对话 {conversation_id}: 新增 {len(new_messages)} 条消息。")
+        summary = summarize_conversation(new_messages, previous_summary=previous_summary)
+    else:
+        if previous_summary:
+            logger.info(f"对话 {conversation_id} 的历史与已总结的部分不一致，重新总结全部 {len(history)} 条消息。")
+        summary = summarize_conversation(history)
+
+    first_message = history[0].get('content', '') if history else ''
+    database_manager.update_conversation_summary(
+        conversation_id, summary, first_message,
+        summarized_count=len(history), summarized_hash=_history_hash(history)
+    )
+    return summary
+
+
+def run_summarize_job(payload: dict) -> dict:
+    """后台任务：为对话生成并保存摘要。未携带历史记录时使用服务端保存的消息"""
+    conversation_id = payload["conversationId"]
+    history = payload.get("history")
+    if history is None:
+        history = database_manager.get_history(conversation_id)
+    summary = summarize_and_save(conversation_id, history)
+    return {"summary": summary}
@@ -37,3 +37,24 @@ def load_tts_config() -> dict:
     except Exception as e:
         logger.error(f"加载TTS配置文件时发生未知错误: {e}")
         return {}
+
+
+def load_context_config() -> dict:
+    """
+    加载并返回上下文窗口（token预算）配置文件。
+    """
+    filepath = os.path.join(CONFIG_DIR, "context_config.json")
+    logger.info(f"正在从 {filepath} 加载上下文窗口配置...")
+
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.error(f"上下文窗口配置文件未找到: {filepath}")
+        return {}
+    except json.JSONDecodeError:
+        logger.error(f"上下文窗口配置文件格式错误: {filepath}")
+        return {}
+    except Exception as e:
+        logger.error(f"加载上下文窗口配置文件时发生未知错误: {e}")
+        return {}
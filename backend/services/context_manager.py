@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/14 10:37
+# @Author : Ray
+# @File : context_manager.py
+# @Software: PyCharm
+"""
+上下文窗口管理：按token预算裁剪聊天历史，较早的轮次折叠为滚动摘要
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from backend.utils.logger import logger
+from backend.utils.chunker import estimate_tokens
+from backend.services.config_loader import load_context_config
+
+_CONFIG = load_context_config()
+MODEL_TOKEN_BUDGETS = _CONFIG.get("model_token_budgets", {"default": 8000})
+# 为模型回复预留的token数
+RESERVED_REPLY_TOKENS = _CONFIG.get("reserved_reply_tokens", 1024)
+# 需要折叠历史时为摘要预留的token数
+SUMMARY_RESERVED_TOKENS = _CONFIG.get("summary_reserved_tokens", 400)
+# 折叠边界按该步长对齐，使连续多轮对话复用同一份摘要，而不是每轮都重新总结
+FOLD_STEP_MESSAGES = max(1, _CONFIG.get("fold_step_messages", 8))
+# 每条消息在对话格式中的额外开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 优先使用本地的 tiktoken 分词器；未安装时退化为按字符类别估算
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+    logger.info("未找到可用的 tiktoken 分词器，将使用估算方式统计token。")
+
+
+def count_tokens(text: str) -> int:
+    """统计一段文本的token数"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def count_message_tokens(message: dict) -> int:
+    return count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def get_token_budget(model: str | None) -> int:
+    """返回模型可用于输入的token预算"""
+    total = MODEL_TOKEN_BUDGETS.get(model or "", MODEL_TOKEN_BUDGETS.get("default", 8000))
+    env_budget = os.getenv("CONTEXT_TOKEN_BUDGET")
+    if env_budget:
+        total = int(env_budget)
+    return max(0, total - RESERVED_REPLY_TOKENS)
+
+
+class _FoldCache:
+    """
+    已折叠历史的摘要缓存。
+    以消息前缀的链式哈希为键，新一轮折叠时找到最长的已缓存前缀，只需总结新增的部分。
+    """
+
+    def __init__(self, max_items: int = 512):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def prefix_hashes(messages: list) -> list:
+        hashes = []
+        digest = b""
+        for message in messages:
+            raw = json.dumps([message.get("role"), message.get("content")], ensure_ascii=False)
+            digest = hashlib.sha256(digest + raw.encode('utf-8')).digest()
+            hashes.append(digest)
+        return hashes
+
+    def longest_prefix(self, hashes: list) -> tuple[int, str | None]:
+        with self._lock:
+            for length in range(len(hashes), 0, -1):
+                summary = self._items.get(hashes[length - 1])
+                if summary is not None:
+                    self._items.move_to_end(hashes[length - 1])
+                    return length, summary
+        return 0, None
+
+    def put(self, key: bytes, summary: str):
+        with self._lock:
+            self._items[key] = summary
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+_fold_cache = _FoldCache()
+
+
+def _fold(messages: list, summarizer) -> str | None:
+    """将较早的消息折叠为摘要，复用已缓存的前缀摘要"""
+    hashes = _FoldCache.prefix_hashes(messages)
+    done, summary = _fold_cache.longest_prefix(hashes)
+    if done == len(messages):
+        return summary
+
+    logger.info(f"折叠较早的 {len(messages)} 条历史消息（其中 {done} 条已有摘要）。")
+    summary = summarizer(summary, messages[done:])
+    if summary:
+        _fold_cache.put(hashes[-1], summary)
+    return summary
+
+
+def _last_turn_start(history: list) -> int:
+    """最近一轮对话（最后一条用户消息及其之后的回复）在历史记录中的起点"""
+    for index in range(len(history) - 1, -1, -1):
+        if history[index]["role"] == "user":
+            return index
+    return max(0, len(history) - 1)
+
+
+def _summary_message(dropped: list, summarizer) -> dict | None:
+    """将被折叠的消息总结为一条摘要消息，无需折叠或总结失败时返回None"""
+    if summarizer is None or not dropped:
+        return None
+    summary = _fold(dropped, summarizer)
+    if not summary:
+        return None
+    return {"role": "system", "content": f"以下是本次对话中较早内容的摘要：\n{summary}"}
+
+
+def fit_messages(system_prompt: str, history: list, user_message: str,
+                 model: str | None = None, summarizer=None) -> list:
+    """
+    在token预算内构建消息列表：始终保留系统提示、本轮用户消息和最近一轮历史对话，从最新的历史轮次开始尽量保留，
+    放不下的较早轮次交给 summarizer(已有摘要, 新消息) 折叠为一条摘要消息，摘要本身也计入预算。
+    """
+    history = [{"role": m["role"], "content": m["content"]} for m in history]
+    system_message = {"role": "system", "content": system_prompt}
+    user_entry = {"role": "user", "content": user_message}
+
+    available = get_token_budget(model) - count_message_tokens(system_message) - count_message_tokens(user_entry)
+    history_tokens = [count_message_tokens(m) for m in history]
+    if sum(history_tokens) <= available:
+        return [system_message, *history, user_entry]
+
+    def tail_tokens(start: int) -> int:
+        return sum(history_tokens[start:])
+
+    # 从最新的消息往前保留，直到扣除摘要预留后的预算用完；最近一轮对话即使超出预算也保留
+    last_turn = _last_turn_start(history)
+    cut = len(history)
+    used = 0
+    while cut > 0 and used + history_tokens[cut - 1] <= available - SUMMARY_RESERVED_TOKENS:
+        used += history_tokens[cut - 1]
+        cut -= 1
+    cut = min(cut, last_turn)
+
+    # 折叠边界优先向下对齐到步长：少折叠几条放得下的消息，后续几轮对话也能直接复用同一份摘要
+    aligned = cut // FOLD_STEP_MESSAGES * FOLD_STEP_MESSAGES
+    start = aligned if aligned < cut and tail_tokens(aligned) <= available else cut
+    while True:
+        summary_message = _summary_message(history[:start], summarizer)
+        summary_tokens = count_message_tokens(summary_message) if summary_message else 0
+        if start >= last_turn or tail_tokens(start) + summary_tokens <= available:
+            break
+        # 实际的摘要放不下：继续折叠更早的消息，已有摘要的前缀会被复用，只需总结新折叠的部分
+        next_start = start + 1
+        while next_start < last_turn and tail_tokens(next_start) + summary_tokens > available:
+            next_start += 1
+        start = next_start
+
+    kept = history[start:]
+    logger.info(f"历史记录超出token预算，保留最近 {len(kept)} 条，折叠 {start} 条。")
+
+    messages = [system_message]
+    if summary_message is not None:
+        messages.append(summary_message)
+    messages.extend(kept)
+    messages.append(user_entry)
+    return messages
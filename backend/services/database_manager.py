@@ -8,110 +8,444 @@
 数据库管理服务
 """
 import os
+import json
+import queue
 import sqlite3
+import threading
 import uuid
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from backend.utils.logger import logger
 
 _BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-DB_PATH = os.path.join(_BACKEND_DIR, 'fuling_memory.db')
+# 数据库文件路径，测试时指向临时目录
+DB_PATH = os.getenv("DB_PATH", os.path.join(_BACKEND_DIR, 'fuling_memory.db'))
 
+# 连接池中保留的空闲连接数上限
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+# 遇到写锁时的等待时间（毫秒），避免并发写入直接报 database is locked
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# 每个连接缓存的预编译语句数量
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "128"))
 
-def get_db_connection():
-    """建立并返回数据库连接"""
-    logger.debug(f"正在连接数据库: {DB_PATH}")
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# 每个新连接建立时执行一次的PRAGMA
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # 读写互不阻塞
+    "PRAGMA synchronous=NORMAL",  # WAL模式下兼顾安全与写入性能
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
 
+# 最近摘要与对话列表的键集分页查询（首页与带游标的后续页），benchmark_conversations.py 直接使用这些语句评估查询计划
+LATEST_SUMMARY_SQL = (
+    "SELECT summary FROM conversations WHERE character_id = ? AND user_id = ? AND summary IS NOT NULL "
+    "ORDER BY updated_at DESC LIMIT 1"
+)
+_CONVERSATION_PAGE_SELECT = (
+    "SELECT id, summary, first_message, updated_at FROM conversations "
+    "WHERE character_id = ? AND user_id = ? AND summary IS NOT NULL"
+)
+CONVERSATION_PAGE_SQL = _CONVERSATION_PAGE_SELECT + " ORDER BY updated_at DESC, id DESC LIMIT ?"
+CONVERSATION_CURSOR_PAGE_SQL = (
+    _CONVERSATION_PAGE_SELECT + " AND (updated_at, id) < (?, ?) ORDER BY updated_at DESC, id DESC LIMIT ?"
+)
 
-def initialize_database():
-    """初始化数据库，创建必要的表"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    # 创建对话表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS conversations (
+# 数据库迁移：按顺序执行，已执行到的版本号记录在 PRAGMA user_version 中。
+# 只能在末尾追加新的迁移，不能修改已发布的迁移。
+MIGRATIONS = [
+    # 1: 最近摘要与历史对话列表都按 (角色, 用户) 过滤已摘要的对话并按更新时间倒序，
+    #    部分索引只收录有摘要的对话，查询无需全表扫描和额外排序
+    (
+        "CREATE INDEX IF NOT EXISTS idx_conversations_summarized "
+        "ON conversations (character_id, user_id, updated_at DESC, id DESC) "
+        "WHERE summary IS NOT NULL",
+    ),
+    # 2: 服务端保存每轮对话的消息，客户端无需每次回传完整历史
+    (
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            emotion TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id)",
+    ),
+    # 3: 记录摘要已覆盖到第几条消息，再次总结时只处理新增部分
+    (
+        "ALTER TABLE conversations ADD COLUMN summarized_count INTEGER NOT NULL DEFAULT 0",
+    ),
+    # 4: 后台任务队列的任务状态，进程重启后可恢复未完成的任务
+    (
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
             id TEXT PRIMARY KEY,
-            character_id TEXT NOT NULL,
-            user_id TEXT NOT NULL, -- 备用，未来可用于多用户
-            summary TEXT,
+            job_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            result TEXT,
+            error TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            first_message TEXT
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)",
+    ),
+    # 5: 摘要已覆盖的那部分消息的哈希，客户端回传的历史与之不一致时改为完整重新总结
+    (
+        "ALTER TABLE conversations ADD COLUMN summarized_hash TEXT",
+    ),
+    # 6: 执行中任务的租约到期时间，工作线程定期续约；只有租约过期的任务才会被其他进程接管
+    (
+        "ALTER TABLE jobs ADD COLUMN lease_expires_at TIMESTAMP",
+    ),
+]
+
+
+class ConnectionPool:
+    """
+    线程感知的SQLite连接池。
+    每个线程在一次操作中独占一个连接，同一线程内嵌套使用时复用该连接；
+    用完后连接归还池中，避免每次操作都重新打开数据库文件和设置PRAGMA。
+    """
+
+    def __init__(self, db_path: str, max_idle: int):
+        self.db_path = db_path
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        logger.debug(f"正在连接数据库: {self.db_path}")
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,  # 连接会在线程间流转，但同一时刻只被一个线程使用
+            cached_statements=DB_CACHED_STATEMENTS,
         )
-    ''')
+        conn.row_factory = sqlite3.Row
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接；正常退出时提交，发生异常时回滚"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        self._local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None or _pool.db_path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.db_path != DB_PATH:
+                if _pool is not None:
+                    _pool.close_all()
+                _pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+    return _pool
+
+
+def utc_timestamp(offset_seconds: float = 0) -> str:
+    """
+    当前UTC时间（可加上偏移秒数）的文本形式 "YYYY-MM-DD HH:MM:SS.ffffff"。
+    与 CURRENT_TIMESTAMP 及已有记录的格式一致，时间列按字符串比较即为按时间比较；
+    显式传入字符串，不依赖sqlite3已弃用的默认datetime适配器。
+    """
+    now = datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)
+    return now.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def get_db_connection():
+    """从连接池借出数据库连接，用法: with get_db_connection() as conn: ..."""
+    return _get_pool().connection()
+
+
+def apply_migrations(conn: sqlite3.Connection):
+    """执行尚未应用的数据库迁移，每个迁移在单独的事务中完成"""
+    current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, statements in enumerate(MIGRATIONS[current_version:], start=current_version + 1):
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            logger.critical(f"执行数据库迁移 {version} 失败。", exc_info=True)
+            raise
+        logger.info(f"已执行数据库迁移 {version}。")
+
+
+def initialize_database():
+    """初始化数据库，创建必要的表并执行迁移"""
+    with get_db_connection() as conn:
+        # 创建对话表
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                character_id TEXT NOT NULL,
+                user_id TEXT NOT NULL, -- 备用，未来可用于多用户
+                summary TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                first_message TEXT
+            )
+        ''')
+        apply_migrations(conn)
+        conn.execute("PRAGMA optimize")
 
     logger.info("数据库表 'conversations' 已确认存在。")
-    conn.commit()
-    conn.close()
+
+
+def check_database() -> bool:
+    """执行一次最简单的查询，确认数据库可用（用于就绪检查）"""
+    try:
+        with get_db_connection() as conn:
+            conn.execute("SELECT 1").fetchone()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"数据库检查失败: {e}")
+        return False
 
 
 def create_conversation(character_id: str, user_id: str = "default_user") -> str:
     """创建一个新的对话记录，并返回其ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     new_id = str(uuid.uuid4())
-    cursor.execute(
-        "INSERT INTO conversations (id, character_id, user_id) VALUES (?, ?, ?)",
-        (new_id, character_id, user_id)
-    )
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO conversations (id, character_id, user_id) VALUES (?, ?, ?)",
+            (new_id, character_id, user_id)
+        )
     logger.info(f"为角色 {character_id} 创建了新的对话，ID: {new_id}")
     return new_id
 
 
 def get_latest_summary(character_id: str, user_id: str = "default_user") -> str | None:
     """获取指定角色最近一次的对话摘要"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT summary FROM conversations WHERE character_id = ? AND user_id = ? AND summary IS NOT NULL ORDER BY updated_at DESC LIMIT 1",
-        (character_id, user_id)
-    )
-    row = cursor.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        row = conn.execute(LATEST_SUMMARY_SQL, (character_id, user_id)).fetchone()
     if row and row['summary']:
         logger.info(f"为角色 {character_id} 找到了最近的记忆摘要。")
         return row['summary']
     return None
 
 
-def update_conversation_summary(conversation_id: str, summary: str, first_message: str):
-    """更新对话的摘要和首条消息"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    now = datetime.utcnow()
-    cursor.execute(
-        "UPDATE conversations SET summary = ?, first_message = ?, updated_at = ? WHERE id = ?",
-        (summary, first_message, now, conversation_id)
-    )
-    conn.commit()
-    conn.close()
+def update_conversation_summary(conversation_id: str, summary: str, first_message: str,
+                                summarized_count: int = 0, summarized_hash: str | None = None):
+    """更新对话的摘要、首条消息，以及摘要已覆盖的消息数与这些消息的哈希"""
+    now = utc_timestamp()
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE conversations SET summary = ?, first_message = ?, summarized_count = ?, summarized_hash = ?, "
+            "updated_at = ? WHERE id = ?",
+            (summary, first_message, summarized_count, summarized_hash, now, conversation_id)
+        )
     logger.info(f"更新了对话 {conversation_id} 的摘要。")
 
 
+def get_summary_state(conversation_id: str) -> tuple[str | None, int, str | None]:
+    """返回对话当前的 (摘要, 摘要已覆盖的消息数, 这些消息的哈希)"""
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT summary, summarized_count, summarized_hash FROM conversations WHERE id = ?",
+            (conversation_id,)
+        ).fetchone()
+    if row is None:
+        return None, 0, None
+    return row['summary'], row['summarized_count'], row['summarized_hash']
+
+
 def get_conversations_by_character(character_id: str, user_id: str = "default_user") -> list:
     """获取与指定角色的所有历史对话摘要列表"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, summary, first_message, updated_at FROM conversations WHERE character_id = ? AND user_id = ? AND summary IS NOT NULL ORDER BY updated_at DESC",
-        (character_id, user_id)
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, summary, first_message, updated_at FROM conversations WHERE character_id = ? AND user_id = ? AND summary IS NOT NULL ORDER BY updated_at DESC, id DESC",
+            (character_id, user_id)
+        ).fetchall()
     return [dict(row) for row in rows]
 
 
+def get_conversations_page(character_id: str, user_id: str = "default_user", limit: int = 20,
+                           after: tuple | None = None) -> tuple[list, tuple | None]:
+    """
+    按 (updated_at, id) 键集分页获取历史对话。
+    after 为上一页最后一条记录的 (updated_at, id)；返回 (本页记录, 下一页游标或None)。
+    """
+    sql = CONVERSATION_PAGE_SQL if after is None else CONVERSATION_CURSOR_PAGE_SQL
+    params = [character_id, user_id]
+    if after is not None:
+        params.extend(after)
+    # 多取一条用于判断是否还有下一页
+    params.append(limit + 1)
+
+    with get_db_connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = (last["updated_at"], last["id"])
+    return items, next_cursor
+
+
+def count_conversations_by_character(character_id: str, user_id: str = "default_user") -> int:
+    """统计与指定角色的历史对话数量"""
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) FROM conversations WHERE character_id = ? AND user_id = ? AND summary IS NOT NULL",
+            (character_id, user_id)
+        ).fetchone()
+    return row[0]
+
+
 def delete_conversation(conversation_id: str):
-    """删除指定的对话记录"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
-    conn.commit()
-    conn.close()
+    """删除指定的对话记录及其消息"""
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+        conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
     logger.info(f"删除了对话 {conversation_id}。")
 
+
+def append_messages(conversation_id: str, messages: list):
+    """向对话追加消息，messages 中每项包含 role、content，可选 emotion"""
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO messages (conversation_id, role, content, emotion) VALUES (?, ?, ?, ?)",
+            [(conversation_id, m["role"], m["content"], m.get("emotion")) for m in messages]
+        )
+    logger.debug(f"向对话 {conversation_id} 追加了 {len(messages)} 条消息。")
+
+
+def get_messages(conversation_id: str, limit: int | None = None) -> list:
+    """按时间顺序获取对话的消息；指定 limit 时只返回最近的 limit 条"""
+    with get_db_connection() as conn:
+        if limit is None:
+            rows = conn.execute(
+                "SELECT role, content, emotion FROM messages WHERE conversation_id = ? ORDER BY id",
+                (conversation_id,)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT role, content, emotion FROM messages WHERE conversation_id = ? ORDER BY id DESC LIMIT ?",
+                (conversation_id, limit)
+            ).fetchall()[::-1]
+    return [dict(row) for row in rows]
+
+
+def get_history(conversation_id: str) -> list:
+    """以聊天接口的 history 格式（只含 role 与 content）返回对话中保存的全部消息"""
+    return [{"role": m["role"], "content": m["content"]} for m in get_messages(conversation_id)]
+
+
+def create_job(job_type: str, payload: dict, max_attempts: int) -> str:
+    """创建一个排队中的后台任务，并返回其ID"""
+    job_id = str(uuid.uuid4())
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, job_type, payload, status, max_attempts) VALUES (?, ?, ?, 'queued', ?)",
+            (job_id, job_type, json.dumps(payload, ensure_ascii=False), max_attempts)
+        )
+    return job_id
+
+
+def update_job(job_id: str, status: str, attempts: int | None = None, result=None, error: str | None = None):
+    """更新后台任务的状态、尝试次数、结果或错误信息"""
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = COALESCE(?, attempts), result = COALESCE(?, result), "
+            "error = ?, updated_at = ? WHERE id = ?",
+            (status, attempts, json.dumps(result, ensure_ascii=False) if result is not None else None,
+             error, utc_timestamp(), job_id)
+        )
+
+
+def get_job(job_id: str) -> dict | None:
+    """获取后台任务的详细信息"""
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+def claim_job(job_id: str, lease_seconds: float) -> dict | None:
+    """
+    领取任务：将排队中、或执行中但租约已过期的任务标记为执行中，尝试次数加一并设置新的租约。
+    任务已被其他工作线程（或进程）领取、已结束或不存在时返回None。
+    """
+    now = utc_timestamp()
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_expires_at = ?, updated_at = ? "
+            "WHERE id = ? AND (status = 'queued' OR (status = 'running' AND "
+            "(lease_expires_at IS NULL OR lease_expires_at < ?)))",
+            (utc_timestamp(lease_seconds), now, job_id, now)
+        )
+        if cursor.rowcount == 0:
+            return None
+        return get_job(job_id)
+
+
+def renew_job_lease(job_id: str, lease_seconds: float):
+    """为执行中的任务续约"""
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+            (utc_timestamp(lease_seconds), utc_timestamp(), job_id)
+        )
+
+
+def get_recoverable_jobs() -> list:
+    """获取可以重新执行的任务：排队中的，以及执行中但租约已过期（执行者已退出）的，按创建时间排序"""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND "
+            "(lease_expires_at IS NULL OR lease_expires_at < ?)) ORDER BY created_at",
+            (utc_timestamp(),)
+        ).fetchall()
+    return [get_job(row['id']) for row in rows]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/11 9:40
+# @Author : Ray
+# @File : http_client.py
+# @Software: PyCharm
+"""
+共享HTTP会话：连接池、长连接复用，以及针对429/5xx的带抖动退避重试
+同时提供供异步服务模式使用的 httpx.AsyncClient，重试策略与同步会话一致
+"""
+import os
+import random
+import asyncio
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from backend.utils.logger import logger
+
+# 连接池中按主机划分的池数量，以及每个主机保持的最大长连接数
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+# 连接失败或上游返回429/5xx时的重试次数与退避参数
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.3"))
+HTTP_BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", "0.2"))
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+_async_client = None
+
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=0,  # 读超时不重试，避免把一次20秒的TTS超时放大成数倍
+        status=HTTP_MAX_RETRIES,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset({"GET", "POST"}),
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        respect_retry_after_header=True,
+        raise_on_status=False,  # 重试耗尽后返回最后一次响应，由调用方 raise_for_status
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    logger.info(
+        f"HTTP会话已创建: 每主机最多 {HTTP_POOL_MAXSIZE} 个长连接, 最多重试 {HTTP_MAX_RETRIES} 次。"
+    )
+    return session
+
+
+def get_session() -> requests.Session:
+    """返回进程内共享的HTTP会话，首次调用时创建"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """返回异步服务模式下共享的 httpx.AsyncClient，首次调用时创建（只在事件循环线程中调用）"""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_CONNECTIONS * HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+            # 传输层只负责重试建立连接失败的请求，状态码重试见 async_post
+            transport=httpx.AsyncHTTPTransport(retries=HTTP_MAX_RETRIES),
+        )
+        logger.info(f"异步HTTP客户端已创建: 每主机最多 {HTTP_POOL_MAXSIZE} 个长连接。")
+    return _async_client
+
+
+async def async_post(url: str, **kwargs) -> httpx.Response:
+    """
+    使用共享的异步客户端发送POST请求。
+    上游返回429/5xx时按与同步会话相同的退避参数重试，优先遵循 Retry-After 响应头。
+    """
+    client = get_async_client()
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        response = await client.post(url, **kwargs)
+        if response.status_code not in RETRY_STATUS_CODES or attempt == HTTP_MAX_RETRIES:
+            return response
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = HTTP_BACKOFF_FACTOR * (2 ** attempt) + random.uniform(0, HTTP_BACKOFF_JITTER)
+        logger.warning(f"上游返回 {response.status_code}，{delay:.2f} 秒后进行第 {attempt + 1} 次重试。")
+        await response.aclose()
+        await asyncio.sleep(delay)
+
+
+async def close_async_client():
+    """关闭异步客户端，在ASGI应用退出时调用"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/17 14:40
+# @Author : Ray
+# @File : hybrid_search.py
+# @Software: PyCharm
+"""
+混合检索：向量检索与BM25关键词检索的结果按倒数排名融合（RRF），再用MMR挑选内容不重复的 top-k，
+最后在token预算内拼接为RAG背景资料
+"""
+import os
+import threading
+
+import numpy as np
+from backend.utils.bm25 import BM25Index
+from backend.utils.logger import logger
+from backend.services.context_manager import count_tokens
+from backend.services.retrievers import Retriever, SearchHit
+
+# 拼接多段背景资料时使用的分隔符
+CONTEXT_SEPARATOR = "\n---\n"
+
+
+def reciprocal_rank_fusion(rankings: list[list], k: int = 60) -> dict:
+    """RRF：每个排名列表中第 r 名（从1开始）贡献 1 / (k + r)，返回 {文档ID: 融合得分}"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> float:
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(a @ b) / denom if denom else 0.0
+
+
+def mmr_select(relevance: dict, vectors: dict, top_k: int, lambda_: float = 0.7) -> list:
+    """
+    最大边际相关性：每次选出 λ·相关性 − (1−λ)·与已选结果的最大余弦相似度 最高的文档。
+    relevance 为 {文档ID: 得分}（内部归一化到0~1），缺少向量的文档与其他文档的相似度按0计。
+    """
+    if not relevance:
+        return []
+    best = max(relevance.values())
+    candidates = {doc_id: score / best for doc_id, score in relevance.items()}
+    selected = []
+    while candidates and len(selected) < top_k:
+        def marginal(doc_id):
+            vector = vectors.get(doc_id)
+            redundancy = max(
+                (_cosine(vector, vectors[chosen]) for chosen in selected
+                 if vector is not None and chosen in vectors),
+                default=0.0,
+            )
+            return lambda_ * candidates[doc_id] - (1 - lambda_) * redundancy
+
+        doc_id = max(candidates, key=marginal)
+        selected.append(doc_id)
+        del candidates[doc_id]
+    return selected
+
+
+def pack_context(documents: list[str], token_budget: int) -> str:
+    """按顺序在token预算内拼接文档，放不下的文档跳过；第一段总是保留"""
+    packed = []
+    used = 0
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+    for document in documents:
+        tokens = count_tokens(document) + (separator_tokens if packed else 0)
+        if packed and used + tokens > token_budget:
+            continue
+        packed.append(document)
+        used += tokens
+    return CONTEXT_SEPARATOR.join(packed)
+
+
+class _BM25Store:
+    """按角色加载 <character_id>.bm25.json，文件更新后自动重新加载"""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, character_id: str) -> BM25Index | None:
+        path = os.path.join(self.index_dir, f"{character_id}.bm25.json")
+        try:
+            version = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        cached = self._indexes.get(character_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self._lock:
+            cached = self._indexes.get(character_id)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            try:
+                index = BM25Index.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"加载角色 '{character_id}' 的BM25索引失败: {e}")
+                return None
+            self._indexes[character_id] = (version, index)
+            logger.info(f"已加载角色 '{character_id}' 的BM25索引: {len(index.ids)} 条, {len(index.postings)} 个词项。")
+            return index
+
+    def __len__(self):
+        return len(self._indexes)
+
+
+class HybridRetriever:
+    """
+    混合检索。
+    - 向量候选：距离不超过截断距离的前 candidates 个结果。
+      截断距离未指定（max_distance 为None）时由余弦相似度阈值推导：同一模型输出的向量模长相近，
+      设为 r 时平方欧氏距离 d = 2r²(1 − cos)，因此余弦相似度不低于 min_similarity 等价于 d ≤ 2(1 − min_similarity)·|q|²，
+      与嵌入模型输出向量的尺度无关。
+    - 关键词候选：至少命中 min_keyword_terms 个不同查询词项的前 candidates 个结果（缺少BM25索引时只用向量候选），
+      避免只与查询共享一个常见二字词的文档也被当作相关知识。
+    两路候选都为空时视为没有相关知识。返回结果按MMR挑选的顺序排列，distance 为与查询向量的平方欧氏距离。
+    """
+
+    def __init__(self, retriever: Retriever, index_dir: str, candidates: int = 20, max_distance: float | None = None,
+                 min_similarity: float = 0.5, min_keyword_terms: int = 2, rrf_k: int = 60, mmr_lambda: float = 0.7):
+        self.retriever = retriever
+        self.bm25 = _BM25Store(index_dir)
+        self.candidates = candidates
+        self.max_distance = max_distance
+        self.min_similarity = min_similarity
+        self.min_keyword_terms = min_keyword_terms
+        self.rrf_k = rrf_k
+        self.mmr_lambda = mmr_lambda
+
+    def distance_cutoff(self, query_vector: np.ndarray) -> float:
+        """向量候选的最大平方欧氏距离"""
+        if self.max_distance is not None:
+            return self.max_distance
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        return 2 * (1 - self.min_similarity) * float(query_vector @ query_vector)
+
+    def search(self, character_id: str, query: str, query_vector: np.ndarray, top_k: int = 3) -> list[SearchHit]:
+        cutoff = self.distance_cutoff(query_vector)
+        vector_hits = [
+            hit for hit in self.retriever.search(character_id, query_vector, k=self.candidates)
+            if hit.distance <= cutoff
+        ]
+        bm25_index = self.bm25.get(character_id)
+        keyword_hits = bm25_index.search(query, k=self.candidates, min_terms=self.min_keyword_terms) if bm25_index is not None else []
+
+        fused = reciprocal_rank_fusion(
+            [[hit.id for hit in vector_hits], [doc_id for doc_id, _ in keyword_hits]], k=self.rrf_k
+        )
+        if not fused:
+            return []
+
+        records = self.retriever.get_records(character_id, list(fused))
+        vectors = {doc_id: vector for doc_id, (_, vector) in records.items()}
+        selected = mmr_select({doc_id: fused[doc_id] for doc_id in records}, vectors, top_k, self.mmr_lambda)
+
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        return [
+            SearchHit(doc_id, records[doc_id][0], float(np.sum((vectors[doc_id] - query_vector) ** 2)))
+            for doc_id in selected
+        ]
+
+    def stats(self) -> dict:
+        return {**self.retriever.stats(), "bm25Characters": len(self.bm25)}
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/15 10:18
+# @Author : Ray
+# @File : job_queue.py
+# @Software: PyCharm
+"""
+进程内后台任务队列：工作线程 + 有界队列 + 失败重试，任务状态持久化在SQLite中。
+执行中的任务持有租约并由心跳定期续约，只有租约过期（执行者已退出）的任务才会在重启时被恢复。
+"""
+import os
+import queue
+import threading
+from backend.utils.logger import logger
+from backend.errors.exceptions import FulingException
+from backend.services import database_manager
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# 第n次重试前等待 JOB_RETRY_DELAY * 2^(n-1) 秒
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "2"))
+# 执行中任务的租约时长（秒），心跳每隔三分之一租约续约一次
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+_handlers = {}
+_queue = queue.Queue(maxsize=JOB_QUEUE_SIZE)
+_workers = []
+_start_lock = threading.Lock()
+
+
+def register_handler(job_type: str, handler):
+    """
+    注册任务处理函数。handler(payload: dict) 的返回值（需可JSON序列化）会保存为任务结果，
+    抛出异常则按重试策略重新执行。
+    """
+    _handlers[job_type] = handler
+
+
+def enqueue(job_type: str, payload: dict, max_attempts: int | None = None) -> str:
+    """提交一个后台任务并立即返回任务ID；队列已满时引发 FulingException(503)"""
+    if job_type not in _handlers:
+        raise FulingException(f"未知的任务类型: {job_type}", 400)
+
+    job_id = database_manager.create_job(job_type, payload, max_attempts or JOB_MAX_ATTEMPTS)
+    try:
+        _queue.put_nowait(job_id)
+    except queue.Full:
+        database_manager.update_job(job_id, "failed", error="任务队列已满")
+        logger.error(f"任务队列已满，拒绝任务 {job_id}（{job_type}）")
+        raise FulingException("服务繁忙，请稍后重试。", 503)
+
+    logger.info(f"已提交后台任务 {job_id}（{job_type}）")
+    return job_id
+
+
+def get_job_status(job_id: str) -> dict | None:
+    """返回任务的对外状态信息"""
+    job = database_manager.get_job(job_id)
+    if job is None:
+        return None
+    return {
+        "jobId": job["id"],
+        "type": job["job_type"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+        "createdAt": job["created_at"],
+        "updatedAt": job["updated_at"],
+    }
+
+
+def start():
+    """启动工作线程，并重新排队排队中或租约已过期的任务"""
+    with _start_lock:
+        if _workers:
+            return
+        for i in range(JOB_WORKERS):
+            worker = threading.Thread(target=_worker_loop, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+    recovered = _recover_jobs()
+    logger.info(f"后台任务队列已启动: {JOB_WORKERS} 个工作线程，恢复 {len(recovered)} 个未完成任务。")
+
+
+def _recover_jobs() -> list:
+    """
+    将可恢复的任务重新放入队列并返回其ID。其他进程仍在执行（租约未过期）的任务不会被恢复；
+    同一任务即使被多个进程排队，也只有领取成功的一方会执行。
+    """
+    job_ids = [job["id"] for job in database_manager.get_recoverable_jobs()]
+    for job_id in job_ids:
+        threading.Thread(target=_queue.put, args=(job_id,), daemon=True).start()
+    return job_ids
+
+
+def _schedule_retry(job_id: str, delay: float):
+    timer = threading.Timer(delay, _queue.put, args=(job_id,))
+    timer.daemon = True
+    timer.start()
+
+
+def _worker_loop():
+    while True:
+        job_id = _queue.get()
+        try:
+            _run_job(job_id)
+        except Exception as e:
+            logger.critical(f"执行后台任务 {job_id} 时发生未处理的异常: {e}", exc_info=True)
+        finally:
+            _queue.task_done()
+
+
+def _heartbeat(job_id: str, stopped: threading.Event):
+    """任务执行期间定期续约，进程退出后心跳停止，租约随之过期"""
+    while not stopped.wait(JOB_LEASE_SECONDS / 3):
+        try:
+            database_manager.renew_job_lease(job_id, JOB_LEASE_SECONDS)
+        except Exception as e:
+            logger.warning(f"后台任务 {job_id} 续约失败: {e}")
+
+
+def _run_job(job_id: str):
+    job = database_manager.claim_job(job_id, JOB_LEASE_SECONDS)
+    if job is None:
+        return
+
+    handler = _handlers.get(job["job_type"])
+    attempts = job["attempts"]
+    if handler is None:
+        database_manager.update_job(job_id, "failed", error=f"未注册的任务类型: {job['job_type']}")
+        return
+
+    stopped = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stopped), daemon=True).start()
+    try:
+        result = handler(job["payload"])
+    except Exception as e:
+        message = e.message if isinstance(e, FulingException) else str(e)
+        if attempts < job["max_attempts"]:
+            delay = JOB_RETRY_DELAY * 2 ** (attempts - 1)
+            logger.warning(f"后台任务 {job_id} 第 {attempts} 次执行失败，{delay:.0f} 秒后重试: {message}")
+            database_manager.update_job(job_id, "queued", error=message)
+            _schedule_retry(job_id, delay)
+        else:
+            logger.error(f"后台任务 {job_id} 已失败 {attempts} 次，不再重试: {message}")
+            database_manager.update_job(job_id, "failed", error=message)
+        return
+    finally:
+        stopped.set()
+
+    database_manager.update_job(job_id, "succeeded", result=result)
+    logger.info(f"后台任务 {job_id}（{job['job_type']}）执行成功。")
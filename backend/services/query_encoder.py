@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/17 9:30
+# @Author : Ray
+# @File : query_encoder.py
+# @Software: PyCharm
+"""
+查询向量编码：归一化查询 -> 向量的LRU缓存，以及把并发查询合并为一次批量编码的微批处理
+"""
+import re
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+from backend.utils.logger import logger
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """归一化查询文本：去掉首尾空白并合并连续空白"""
+    return _WHITESPACE_PATTERN.sub(" ", text.strip())
+
+
+class QueryEncoder:
+    """
+    带缓存的批量查询编码器。
+    - 缓存：相同的（归一化后）查询直接返回已计算的向量。
+    - 微批：未命中的查询交给后台线程，线程收到第一条后最多再等待 max_wait_ms 毫秒，
+      把期间到达的查询（至多 max_batch_size 条）合并为一次 encode_batch 调用。
+    encode_batch(texts) 需返回形状为 (len(texts), dim) 的数组。返回的向量是只读的。
+    timeout 为等待编码结果的最长秒数，超时引发 TimeoutError；None 表示一直等待。
+    """
+
+    def __init__(self, encode_batch, max_batch_size: int = 32, max_wait_ms: float = 5.0, cache_size: int = 2048,
+                 timeout: float | None = None):
+        self._encode_batch = encode_batch
+        self.timeout = timeout
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_queries = 0
+
+    def encode(self, text: str) -> np.ndarray:
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+        self._ensure_worker()
+
+        future = Future()
+        self._queue.put((key, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"查询编码超过 {self.timeout} 秒仍未完成")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cacheItems": len(self._cache),
+                "cacheHits": self.hits,
+                "cacheMisses": self.misses,
+                "batches": self.batches,
+                "avgBatchSize": round(self.batched_queries / self.batches, 2) if self.batches else 0.0,
+            }
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="query-encoder", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch: list):
+        """编码一个批次并设置各查询的结果；任何一步出错时，尚未完成的查询都以该异常结束，不会一直等待"""
+        # 同一批次中的重复查询只编码一次
+        texts = list(dict.fromkeys(key for key, _ in batch))
+        try:
+            vectors = np.asarray(self._encode_batch(texts), dtype=np.float32)
+            if vectors.ndim != 2 or len(vectors) != len(texts):
+                raise ValueError(f"编码结果的形状 {vectors.shape} 与查询数 {len(texts)} 不一致")
+
+            vectors.setflags(write=False)
+            by_text = dict(zip(texts, vectors))
+            with self._lock:
+                for text, vector in by_text.items():
+                    self._cache[text] = vector
+                    self._cache.move_to_end(text)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                self.batches += 1
+                self.batched_queries += len(batch)
+
+            for key, future in batch:
+                future.set_result(by_text[key])
+        except Exception as e:
+            logger.error(f"批量编码 {len(texts)} 条查询失败: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
@@ -6,55 +6,196 @@
 # @Software: PyCharm
 """
 RAG服务
+嵌入模型与检索后端在后台线程中加载，不阻塞应用启动；加载完成前知识型问题回退到通用知识回答
 """
 import os
-import chromadb
-from sentence_transformers import SentenceTransformer
-from modelscope import snapshot_download
+import time
+import threading
 from backend.utils.logger import logger
 from backend.errors.exceptions import FulingException
-
-# --- 在模块加载时，一次性初始化所有组件 ---
-logger.info("正在初始化RAG服务...")
+from backend.services.query_encoder import QueryEncoder
+from backend.services.retrievers import ChromaRetriever, NumpyRetriever
+from backend.services.hybrid_search import HybridRetriever, pack_context
 
 # 配置路径
 CHROMA_DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'chroma_db'))
 MODEL_ID = "AI-ModelScope/m3e-small"  # 国内模型ID
 COLLECTION_NAME = "fuling_rag"
 MODEL_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'model_cache'))  # 模型缓存目录
+VECTOR_INDEX_DIR = os.getenv(
+    "RAG_INDEX_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'vector_index'))
+)  # NumPy检索后端的索引目录
+
+# 检索后端: chroma（ChromaDB）或 numpy（进程内向量矩阵，由 index_knowledge_base.py 导出）
+RAG_BACKEND = os.getenv("RAG_BACKEND", "chroma").lower()
+# NumPy后端是否以内存映射方式打开向量矩阵
+RAG_INDEX_MMAP = os.getenv("RAG_INDEX_MMAP", "1") == "1"
+
+# 设为0时完全不加载RAG组件，知识型问题直接使用角色的通用知识回答
+RAG_ENABLED = os.getenv("RAG_ENABLED", "1") == "1"
+
+# 查询向量缓存的条目数，以及合并并发查询时单批的最大条数与最长等待时间（毫秒）
+RAG_QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "2048"))
+RAG_BATCH_MAX_SIZE = int(os.getenv("RAG_BATCH_MAX_SIZE", "32"))
+RAG_BATCH_WAIT_MS = float(os.getenv("RAG_BATCH_WAIT_MS", "5"))
+# 等待查询向量的最长秒数，超时则本次回答不使用背景资料
+RAG_ENCODE_TIMEOUT = float(os.getenv("RAG_ENCODE_TIMEOUT", "2"))
+
+# 混合检索：返回的知识段数、每一路检索的候选数
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "3"))
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", "20"))
+# 向量候选与查询的最低余弦相似度，按查询向量的模长换算为平方欧氏距离的截断值
+RAG_MIN_SIMILARITY = float(os.getenv("RAG_MIN_SIMILARITY", "0.5"))
+# 直接指定向量候选的最大平方欧氏距离（设置后不再按相似度换算）
+RAG_MAX_DISTANCE = float(os.environ["RAG_MAX_DISTANCE"]) if os.getenv("RAG_MAX_DISTANCE") else None
+# 关键词候选至少需要命中的不同查询词项数（查询词项更少时要求全部命中）
+RAG_MIN_KEYWORD_TERMS = int(os.getenv("RAG_MIN_KEYWORD_TERMS", "2"))
+# MMR中相关性的权重（1为只看相关性，越小越偏向内容不重复）
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+# 拼接到提示词中的背景资料的token上限
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "800"))
+
+# 嵌入模型、查询编码器与检索后端在后台线程中加载，加载完成前为None
+EMBEDDING_MODEL = None
+QUERY_ENCODER = None
+RETRIEVER = None
+
+# 初始化状态: disabled / pending / loading / ready / failed
+_status = "pending" if RAG_ENABLED else "disabled"
+_status_error = None
+_load_seconds = None
+_init_lock = threading.Lock()
+
+
+def _load_embedding_model():
+    """从ModelScope下载（或复用本地缓存的）嵌入模型并加载"""
+    from sentence_transformers import SentenceTransformer
+    from modelscope import snapshot_download
+
+    try:
+        # 确保缓存目录存在
+        os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
 
-# 加载嵌入模型
-try:
-    # 确保缓存目录存在
-    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
-
-    # 从ModelScope下载模型到本地
-    logger.info(f"正在从ModelScope下载模型: {MODEL_ID}...")
-    local_model_dir = snapshot_download(
-        model_id=MODEL_ID,
-        cache_dir=MODEL_CACHE_DIR,
-        revision='master'
+        # 从ModelScope下载模型到本地
+        logger.info(f"正在从ModelScope下载模型: {MODEL_ID}...")
+        local_model_dir = snapshot_download(
+            model_id=MODEL_ID,
+            cache_dir=MODEL_CACHE_DIR,
+            revision='master'
+        )
+
+        # 加载本地模型
+        model = SentenceTransformer(
+            model_name_or_path=local_model_dir,
+            trust_remote_code=True,
+            cache_folder=MODEL_CACHE_DIR
+        )
+        logger.info("RAG服务的嵌入模型加载成功。")
+        return model
+    except Exception as e:
+        logger.critical(f"无法加载嵌入模型 '{MODEL_ID}': {e}")
+        raise
+
+
+def _open_retriever():
+    """按 RAG_BACKEND 打开检索后端"""
+    if RAG_BACKEND == "numpy":
+        logger.info(f"RAG服务使用NumPy检索后端，索引目录: {VECTOR_INDEX_DIR}")
+        return NumpyRetriever(VECTOR_INDEX_DIR, mmap=RAG_INDEX_MMAP)
+    return ChromaRetriever(_open_collection())
+
+
+def _open_hybrid_retriever():
+    """在向量检索后端之上叠加BM25关键词检索（BM25索引与NumPy索引位于同一目录）"""
+    return HybridRetriever(
+        _open_retriever(),
+        VECTOR_INDEX_DIR,
+        candidates=RAG_CANDIDATES,
+        max_distance=RAG_MAX_DISTANCE,
+        min_similarity=RAG_MIN_SIMILARITY,
+        min_keyword_terms=RAG_MIN_KEYWORD_TERMS,
+        mmr_lambda=RAG_MMR_LAMBDA,
     )
 
-    # 加载本地模型
-    EMBEDDING_MODEL = SentenceTransformer(
-        model_name_or_path=local_model_dir,
-        trust_remote_code=True,
-        cache_folder=MODEL_CACHE_DIR
+
+def _open_collection():
+    """连接到ChromaDB并获取知识库集合"""
+    import chromadb
+
+    try:
+        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        collection = client.get_collection(name=COLLECTION_NAME)
+        logger.info("RAG服务成功连接到ChromaDB。")
+        return collection
+    except Exception as e:
+        logger.critical(f"无法连接到ChromaDB集合 '{COLLECTION_NAME}': {e}")
+        raise
+
+
+def _initialize():
+    global EMBEDDING_MODEL, QUERY_ENCODER, RETRIEVER, _status, _status_error, _load_seconds
+    logger.info("正在后台初始化RAG服务...")
+    _status_error = None
+    start = time.monotonic()
+    try:
+        model = _load_embedding_model()
+        retriever = _open_hybrid_retriever()
+    except Exception as e:
+        _status_error = str(e)
+        _status = "failed"
+        logger.error("RAG服务初始化失败，知识型问题将使用角色的通用知识回答。")
+        return
+    finally:
+        _load_seconds = round(time.monotonic() - start, 2)
+
+    EMBEDDING_MODEL, RETRIEVER = model, retriever
+    QUERY_ENCODER = QueryEncoder(
+        lambda texts: model.encode(texts, batch_size=RAG_BATCH_MAX_SIZE, convert_to_numpy=True),
+        max_batch_size=RAG_BATCH_MAX_SIZE,
+        max_wait_ms=RAG_BATCH_WAIT_MS,
+        cache_size=RAG_QUERY_CACHE_SIZE,
+        timeout=RAG_ENCODE_TIMEOUT,
     )
-    logger.info("RAG服务的嵌入模型加载成功。")
-except Exception as e:
-    logger.critical(f"无法加载嵌入模型 '{MODEL_ID}': {e}")
-    EMBEDDING_MODEL = None
+    _status = "ready"
+    logger.info(f"RAG服务初始化完成，耗时 {_load_seconds} 秒。")
+
+
+def start_background_init():
+    """在后台线程中加载嵌入模型并连接ChromaDB，应用启动时调用；重复调用不会重复加载"""
+    global _status
+    with _init_lock:
+        if _status != "pending":
+            return
+        _status = "loading"
+    threading.Thread(target=_initialize, name="rag-init", daemon=True).start()
+
+
+def is_ready() -> bool:
+    return _status == "ready"
+
 
-# 连接到ChromaDB
-try:
-    CHROMA_CLIENT = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-    CHROMA_COLLECTION = CHROMA_CLIENT.get_collection(name=COLLECTION_NAME)
-    logger.info("RAG服务成功连接到ChromaDB。")
-except Exception as e:
-    logger.critical(f"无法连接到ChromaDB集合 '{COLLECTION_NAME}': {e}")
-    CHROMA_COLLECTION = None
+def get_status() -> dict:
+    """返回RAG子系统的初始化状态，供健康检查使用"""
+    status = {"status": _status}
+    if _load_seconds is not None:
+        status["loadSeconds"] = _load_seconds
+    if _status_error:
+        status["error"] = _status_error
+    if QUERY_ENCODER is not None:
+        status["queryEncoder"] = QUERY_ENCODER.stats()
+    if RETRIEVER is not None:
+        status["retriever"] = RETRIEVER.stats()
+    return status
+
+
+def encode_query(text: str):
+    """
+    将查询编码为向量（带缓存，并与并发查询合并编码）；RAG服务未就绪时返回None。
+    超过 RAG_ENCODE_TIMEOUT 秒仍未得到结果时引发 TimeoutError。
+    """
+    if QUERY_ENCODER is None:
+        return None
+    return QUERY_ENCODER.encode(text)
 
 
 def is_knowledge_query(text: str) -> bool:
@@ -87,50 +228,37 @@ def is_knowledge_query(text: str) -> bool:
 
 def retrieve_context(character_id: str, query: str) -> str | None:
     """
-    从ChromaDB中通过向量相似度检索上下文，仅返回第一个相关性高于阈值的结果。
+    混合检索（向量 + BM25，RRF融合后以MMR去重）当前角色的知识，
+    将最多 RAG_TOP_K 段结果在 RAG_CONTEXT_TOKENS 的预算内拼接为背景资料；没有相关知识时返回None。
     """
-    # 相关性阈值
-    RELEVANCE_THRESHOLD = 150
-
-    if not EMBEDDING_MODEL or not CHROMA_COLLECTION:
-        logger.error("RAG服务未正确初始化，无法执行检索。")
+    if not is_ready():
+        # 尚未加载完成时不阻塞请求，本次回答回退到通用知识
+        start_background_init()
+        logger.warning(f"RAG服务尚未就绪（{_status}），跳过知识检索。")
         return None
 
     try:
-        # 1. 将用户问题转换为查询向量
-        query_embedding = EMBEDDING_MODEL.encode(query).tolist()
-
-        # 2. 在ChromaDB中查询
-        results = CHROMA_COLLECTION.query(
-            query_embeddings=[query_embedding],
-            n_results=1,  # 只检索最相关的1个结果
-            where={"character_id": character_id},  # 过滤当前角色的知识
-            include=["documents", "distances"]  # 明确要求返回距离分数
-        )
+        # 1. 将用户问题转换为查询向量；编码积压导致超时时不阻塞回答，回退到通用知识
+        try:
+            query_embedding = encode_query(query)
+        except TimeoutError:
+            logger.warning(f"查询编码超过 {RAG_ENCODE_TIMEOUT} 秒，跳过知识检索。")
+            return None
 
-        # 3. 提取结果和相关性分数
-        retrieved_docs = results.get('documents', [[]])[0]
-        distances = results.get('distances', [[]])[0]
+        # 2. 向量与关键词两路检索并融合
+        hits = RETRIEVER.search(character_id, query, query_embedding, top_k=RAG_TOP_K)
 
-        if not retrieved_docs or not distances:
+        if not hits:
             logger.warning(f"未找到与问题 '{query}' 相关的知识（角色: {character_id}）。")
             return None
 
-        # 4. 检查第一个结果是否满足相关性阈值
-        first_doc = retrieved_docs[0]
-        first_distance = distances[0]
-
-        if first_distance <= RELEVANCE_THRESHOLD:
-            logger.info(
-                f"找到符合阈值的相关知识（距离: {first_distance:.4f}），角色: {character_id}"
-            )
-            return first_doc
-        else:
-            logger.warning(
-                f"最相关结果距离 {first_distance:.4f} 超过阈值 {RELEVANCE_THRESHOLD}，"
-                f"角色: {character_id}，问题: {query}"
-            )
-            return None
+        # 3. 在token预算内拼接
+        context = pack_context([hit.document for hit in hits], RAG_CONTEXT_TOKENS)
+        logger.info(
+            f"找到 {len(hits)} 段相关知识（距离: {', '.join(f'{hit.distance:.4f}' for hit in hits)}），"
+            f"角色: {character_id}"
+        )
+        return context
 
     except Exception as e:
         logger.error(f"在向量数据库中检索时发生错误: {e}")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/15 16:42
+# @Author : Ray
+# @File : response_cache.py
+# @Software: PyCharm
+"""
+聊天回复缓存：对不依赖历史记录的请求（首轮对话、RAG问答）复用已生成的回复
+- 精确层：按 (角色, 系统提示哈希, 归一化后的用户消息) 命中
+- 语义层（可选）：复用RAG的嵌入模型，相似度超过阈值时命中
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from backend.services import rag_service
+from backend.utils.logger import logger
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_ITEMS = int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", "1000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "0") == "1"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+
+_TRAILING_PUNCTUATION = "?？!！。.~～…"
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    """归一化用户消息：统一大小写和空白，去掉句末标点"""
+    text = _WHITESPACE_PATTERN.sub(" ", message.strip().lower())
+    return text.rstrip(_TRAILING_PUNCTUATION).strip()
+
+
+def _scope(character_id: str, system_prompt: str) -> str:
+    """同一角色、同一系统提示下的回复才可以互相复用"""
+    prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+    return f"{character_id}:{prompt_hash}"
+
+
+def is_enabled_for(character_data: dict) -> bool:
+    """角色配置中 "response_cache": false 可关闭该角色的回复缓存"""
+    return RESPONSE_CACHE_ENABLED and character_data.get("response_cache", True)
+
+
+class ResponseCache:
+    """带TTL的LRU回复缓存，可选地按语义相似度匹配"""
+
+    def __init__(self, max_items: int, ttl: int, embed=None, similarity: float = 0.92):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.embed = embed  # embed(text) -> 归一化向量；为None时只使用精确层
+        self.similarity = similarity
+        self._entries = OrderedDict()  # key -> (scope, 过期时间, 回复, 向量)
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def lookup(self, character_id: str, system_prompt: str, message: str) -> dict | None:
+        scope = _scope(character_id, system_prompt)
+        normalized = normalize_message(message)
+        key = f"{scope}:{normalized}"
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return dict(entry[2])
+                del self._entries[key]
+
+        if self.embed is not None:
+            vector = self._safe_embed(normalized)
+            if vector is not None:
+                hit = self._semantic_lookup(scope, vector, now)
+                if hit is not None:
+                    return hit
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, character_id: str, system_prompt: str, message: str, response: dict):
+        scope = _scope(character_id, system_prompt)
+        normalized = normalize_message(message)
+        key = f"{scope}:{normalized}"
+        vector = self._safe_embed(normalized) if self.embed is not None else None
+
+        with self._lock:
+            self._entries[key] = (scope, time.monotonic() + self.ttl, dict(response), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._entries),
+                "exactHits": self.exact_hits,
+                "semanticHits": self.semantic_hits,
+                "misses": self.misses,
+            }
+
+    def _semantic_lookup(self, scope: str, vector, now: float) -> dict | None:
+        best_key, best_score = None, self.similarity
+        with self._lock:
+            for key, (entry_scope, expires_at, _, entry_vector) in self._entries.items():
+                if entry_scope != scope or entry_vector is None or expires_at <= now:
+                    continue
+                score = float(np.dot(vector, entry_vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.semantic_hits += 1
+            logger.info(f"回复缓存语义命中（相似度 {best_score:.3f}）")
+            return dict(self._entries[best_key][2])
+
+    def _safe_embed(self, text: str):
+        try:
+            vector = self.embed(text)
+        except Exception as e:
+            logger.warning(f"回复缓存计算语义向量失败: {e}")
+            return None
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+
+def _rag_embed(text: str):
+    """复用RAG服务的查询编码器（与检索共享向量缓存）；模型不可用时返回None"""
+    return rag_service.encode_query(text)
+
+
+RESPONSE_CACHE = ResponseCache(
+    max_items=RESPONSE_CACHE_MAX_ITEMS,
+    ttl=RESPONSE_CACHE_TTL,
+    embed=_rag_embed if RESPONSE_CACHE_SEMANTIC else None,
+    similarity=RESPONSE_CACHE_SIMILARITY,
+)
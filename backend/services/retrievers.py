@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/17 11:20
+# @Author : Ray
+# @File : retrievers.py
+# @Software: PyCharm
+"""
+向量检索后端
+- ChromaRetriever：通过 ChromaDB 集合检索（原有实现）
+- NumpyRetriever：每个角色一个连续的 float32 矩阵（可内存映射），一次矩阵-向量乘法 + argpartition 取 top-k
+两者的距离都是平方欧氏距离（与 ChromaDB 默认的 l2 空间一致），相关性阈值可以通用
+"""
+import os
+import json
+import threading
+from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+import numpy as np
+from backend.utils.logger import logger
+
+
+class SearchHit(NamedTuple):
+    id: str
+    document: str
+    distance: float
+
+
+class Retriever(ABC):
+    """检索后端接口"""
+
+    name = "base"
+
+    @abstractmethod
+    def search(self, character_id: str, query_vector: np.ndarray, k: int = 1) -> list[SearchHit]:
+        """返回该角色知识库中与查询最接近的 k 个结果，按距离升序排列"""
+
+    @abstractmethod
+    def get_records(self, character_id: str, ids: list) -> dict:
+        """按文档ID取回正文与向量，返回 {id: (文档, 向量)}，找不到的ID不出现在结果中"""
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class ChromaRetriever(Retriever):
+    """基于 ChromaDB 集合的检索，按 character_id 元数据过滤"""
+
+    name = "chroma"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def search(self, character_id: str, query_vector: np.ndarray, k: int = 1) -> list[SearchHit]:
+        results = self.collection.query(
+            query_embeddings=[np.asarray(query_vector, dtype=np.float32).tolist()],
+            n_results=k,
+            where={"character_id": character_id},  # 过滤当前角色的知识
+            include=["documents", "distances"]  # 明确要求返回距离分数
+        )
+        ids = results.get('ids', [[]])[0]
+        documents = results.get('documents', [[]])[0]
+        distances = results.get('distances', [[]])[0]
+        return [SearchHit(*hit) for hit in zip(ids, documents, distances)]
+
+    def get_records(self, character_id: str, ids: list) -> dict:
+        if not ids:
+            return {}
+        results = self.collection.get(ids=list(ids), include=["documents", "embeddings"])
+        return {
+            doc_id: (document, np.asarray(vector, dtype=np.float32))
+            for doc_id, document, vector in zip(results['ids'], results['documents'], results['embeddings'])
+        }
+
+
+class _CharacterIndex:
+    """单个角色的向量矩阵、预先计算的行范数平方、文档与ID"""
+    __slots__ = ("version", "matrix", "squared_norms", "documents", "ids", "rows")
+
+    def __init__(self, version: int, matrix: np.ndarray, documents: list, ids: list):
+        self.version = version
+        self.matrix = matrix
+        self.squared_norms = np.einsum("ij,ij->i", matrix, matrix)
+        self.documents = documents
+        self.ids = ids
+        self.rows = {doc_id: row for row, doc_id in enumerate(ids)}
+
+
+class NumpyRetriever(Retriever):
+    """
+    进程内向量检索。索引目录中每个角色对应两个文件（由 index_knowledge_base.py 导出）：
+    - <character_id>.npy  形状为 (文档数, 维度) 的 float32 矩阵
+    - <character_id>.json {"ids": [...], "documents": [...]}，顺序与矩阵的行一致
+    首次查询某个角色时加载；json 文件更新后，下一次查询会自动重新加载。
+    """
+
+    name = "numpy"
+
+    def __init__(self, index_dir: str, mmap: bool = True):
+        self.index_dir = index_dir
+        self.mmap = mmap
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def search(self, character_id: str, query_vector: np.ndarray, k: int = 1) -> list[SearchHit]:
+        index = self._get_index(character_id)
+        if index is None or not index.documents:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        # ||x - q||^2 = ||x||^2 - 2 x·q + ||q||^2
+        distances = index.squared_norms - 2 * (index.matrix @ query) + float(query @ query)
+        np.maximum(distances, 0, out=distances)
+
+        k = min(k, len(distances))
+        if k < len(distances):
+            top = np.argpartition(distances, k - 1)[:k]
+            top = top[np.argsort(distances[top])]
+        else:
+            top = np.argsort(distances)
+        return [SearchHit(index.ids[i], index.documents[i], float(distances[i])) for i in top]
+
+    def get_records(self, character_id: str, ids: list) -> dict:
+        index = self._get_index(character_id)
+        if index is None:
+            return {}
+        return {
+            doc_id: (index.documents[row], index.matrix[row])
+            for doc_id, row in ((doc_id, index.rows.get(doc_id)) for doc_id in ids) if row is not None
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "characters": len(self._indexes),
+                "vectors": sum(len(index.documents) for index in self._indexes.values()),
+            }
+
+    def _get_index(self, character_id: str) -> _CharacterIndex | None:
+        meta_path = os.path.join(self.index_dir, f"{character_id}.json")
+        try:
+            version = os.stat(meta_path).st_mtime_ns
+        except OSError:
+            return None
+
+        index = self._indexes.get(character_id)
+        if index is not None and index.version == version:
+            return index
+
+        with self._lock:
+            index = self._indexes.get(character_id)
+            if index is not None and index.version == version:
+                return index
+            loaded = self._load(character_id, meta_path, version)
+            if loaded is not None:
+                self._indexes[character_id] = index = loaded
+            return index
+
+    def _load(self, character_id: str, meta_path: str, version: int) -> _CharacterIndex | None:
+        matrix_path = os.path.join(self.index_dir, f"{character_id}.npy")
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            documents, ids = meta["documents"], [str(doc_id) for doc_id in meta["ids"]]
+            matrix = np.load(matrix_path, mmap_mode='r' if self.mmap else None)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"加载角色 '{character_id}' 的向量索引失败: {e}")
+            return None
+
+        if matrix.dtype != np.float32 or matrix.ndim != 2 or not len(matrix) == len(documents) == len(ids):
+            logger.error(f"角色 '{character_id}' 的向量索引与文档数量或格式不一致，已忽略。")
+            return None
+        logger.info(f"已加载角色 '{character_id}' 的向量索引: {matrix.shape[0]} 条, 维度 {matrix.shape[1]}。")
+        return _CharacterIndex(version, matrix, documents, ids)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/10 10:14
+# @Author : Ray
+# @File : tts_cache.py
+# @Software: PyCharm
+"""
+TTS音频缓存：内存LRU + 磁盘两级缓存，按内容哈希寻址
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from backend.utils.logger import logger
+
+
+def make_cache_key(text: str, voice_type: str, speed_ratio: float) -> str:
+    """根据文本、音色和语速计算缓存键"""
+    raw = f"{voice_type}\x1f{speed_ratio:.3f}\x1f{text}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class AudioCache:
+    """
+    两级音频缓存。
+    - 内存层：按条目数限制的LRU，命中时无任何I/O。
+    - 磁盘层：按总字节数限制的目录，进程重启后依然有效，超限时淘汰最久未访问的文件。
+    所有操作都是线程安全的。
+    """
+
+    def __init__(self, max_items: int, cache_dir: str | None, max_disk_bytes: int):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()  # key -> 文件大小，按访问顺序排列
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            self._load_disk_index()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+            on_disk = key in self._disk
+
+        if on_disk:
+            data = self._read_file(key)
+            if data is not None:
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._remember(key, data)
+                    self.disk_hits += 1
+                return data
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._remember(key, data)
+        if self.cache_dir and len(data) <= self.max_disk_bytes:
+            self._write_file(key, data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memoryItems": len(self._memory),
+                "diskItems": len(self._disk),
+                "diskBytes": self._disk_bytes,
+                "memoryHits": self.memory_hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "hitRate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+    def _remember(self, key: str, data: bytes):
+        """写入内存层（调用方需持有锁）"""
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _load_disk_index(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entries = []
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith(".mp3"):
+                    stat = os.stat(os.path.join(self.cache_dir, filename))
+                    entries.append((stat.st_mtime, filename[:-4], stat.st_size))
+            for _, key, size in sorted(entries):
+                self._disk[key] = size
+                self._disk_bytes += size
+            logger.info(f"TTS磁盘缓存已加载: {len(self._disk)} 个文件, 共 {self._disk_bytes} 字节。")
+        except OSError as e:
+            logger.error(f"加载TTS磁盘缓存目录 {self.cache_dir} 时出错: {e}，磁盘缓存已禁用。")
+            self.cache_dir = None
+
+    def _read_file(self, key: str) -> bytes | None:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except OSError as e:
+            logger.warning(f"读取TTS缓存文件 {key} 失败: {e}")
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self._disk_bytes -= size
+            return None
+
+    def _write_file(self, key: str, data: bytes):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入TTS缓存文件 {key} 失败: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            self._disk_bytes += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            while self._disk_bytes > self.max_disk_bytes and self._disk:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
@@ -8,11 +8,23 @@
 tts服务
 """
 import os
+import re
+import base64
+import asyncio
+import binascii
+from collections import deque
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import httpx
 import requests
 from dotenv import load_dotenv
 from backend.utils.logger import logger
-from backend.errors.exceptions import TTSServiceError
+from backend.utils.text_splitter import SentenceBuffer
+from backend.errors.exceptions import TTSServiceError, UpstreamBusyError
 from backend.services.config_loader import load_tts_config
+from backend.services.http_client import get_session, async_post
+from backend.services.tts_cache import AudioCache, make_cache_key
+from backend.services.upstream_limiter import UpstreamLimiter, SingleFlight
 load_dotenv()
 
 # 从配置中获取七牛云的凭证
@@ -28,33 +40,269 @@ EMOTION_TO_SPEED_MAP = load_tts_config()
 if not EMOTION_TO_SPEED_MAP:
     logger.warning("未能加载TTS情感配置，将使用默认语速。")
 
+# 分句合成使用的有界线程池，限制同时发往TTS服务的请求数
+TTS_MAX_WORKERS = int(os.getenv("TTS_MAX_WORKERS", "4"))
+_SPEECH_EXECUTOR = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix="tts")
+# 异步服务模式下的等价限制，在事件循环中首次使用时创建
+_async_speech_semaphore = None
 
-def generate_speech(text: str, voice_type: str, emotion: str = "default") -> str:
-    """
-    调用七牛云TTS API生成语音, 现在会根据外部配置文件调整语速。
-    """
-    tts_url = f"{BASE_URL}/voice/tts"
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {API_KEY}"}
-    # 从加载的配置中获取语速
+# 发往TTS服务的全局并发上限与速率限制（每秒请求数，0表示不限速）
+TTS_LIMITER = UpstreamLimiter(
+    "tts",
+    max_concurrency=int(os.getenv("TTS_MAX_CONCURRENCY", "8")),
+    rate=float(os.getenv("TTS_RATE_LIMIT", "0")),
+    burst=int(os.getenv("TTS_RATE_BURST", "8")),
+)
+# 相同缓存键的合成请求同时到达时只调用一次TTS服务
+_TTS_FLIGHTS = SingleFlight("tts")
+
+# 音频缓存：相同 (文本, 音色, 语速) 的请求直接复用已合成的音频
+_DEFAULT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tts_cache'))
+AUDIO_CACHE = AudioCache(
+    max_items=int(os.getenv("TTS_CACHE_MAX_ITEMS", "256")),
+    cache_dir=os.getenv("TTS_CACHE_DIR", _DEFAULT_CACHE_DIR) or None,
+    max_disk_bytes=int(os.getenv("TTS_CACHE_MAX_DISK_MB", "200")) * 1024 * 1024,
+)
+_CACHE_KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def _resolve_speed_ratio(emotion: str) -> float:
+    """根据情绪从配置中获取语速"""
     default_speed = EMOTION_TO_SPEED_MAP.get("default", 1.0)
-    speed_ratio = EMOTION_TO_SPEED_MAP.get(emotion, default_speed)
-    logger.info(f"情绪: '{emotion}', 映射语速为: {speed_ratio}")
+    return EMOTION_TO_SPEED_MAP.get(emotion, default_speed)
+
 
-    payload = {
-        "audio": {"voice_type": voice_type, "encoding": "mp3", "speed_ratio": speed_ratio},
-        "request": {"text": text}
+def get_audio_cache_key(text: str, voice_type: str, emotion: str = "default") -> str:
+    """计算一段语音的缓存键（也用作音频的ETag）"""
+    return make_cache_key(text, voice_type, _resolve_speed_ratio(emotion))
+
+
+def _speech_request_args(text: str, voice_type: str, speed_ratio: float) -> dict:
+    """构造TTS请求的URL、请求头与请求体"""
+    return {
+        "url": f"{BASE_URL}/voice/tts",
+        "headers": {"Content-Type": "application/json", "Authorization": f"Bearer {API_KEY}"},
+        "json": {
+            "audio": {"voice_type": voice_type, "encoding": "mp3", "speed_ratio": speed_ratio},
+            "request": {"text": text}
+        },
     }
 
+
+def _decode_speech_response(response_data: dict) -> bytes:
+    """校验TTS响应并解码其中的base64音频"""
+    if "data" not in response_data or not response_data["data"]:
+        raise TTSServiceError("TTS服务返回的数据为空或格式不正确。")
+
     try:
-        response = requests.post(tts_url, headers=headers, json=payload, timeout=20)
+        return base64.b64decode(response_data["data"], validate=True)
+    except (binascii.Error, ValueError):
+        raise TTSServiceError("TTS服务返回的音频数据无法解码。")
+
+
+def _request_speech(text: str, voice_type: str, speed_ratio: float) -> bytes:
+    """调用七牛云TTS API合成语音，返回解码后的MP3字节"""
+    try:
+        with TTS_LIMITER.acquire():
+            response = get_session().post(**_speech_request_args(text, voice_type, speed_ratio), timeout=20)
         response.raise_for_status()
         response_data = response.json()
+    except requests.exceptions.RequestException as e:
+        raise TTSServiceError(f"无法连接到TTS服务: {e}")
 
-        if "data" in response_data and response_data["data"]:
-            return response_data["data"]
-        else:
-            raise TTSServiceError("TTS服务返回的数据为空或格式不正确。")
+    return _decode_speech_response(response_data)
 
-    except requests.exceptions.RequestException as e:
+
+async def _arequest_speech(text: str, voice_type: str, speed_ratio: float) -> bytes:
+    """_request_speech 的异步版本，等待上游响应期间不占用线程"""
+    try:
+        with await TTS_LIMITER.acquire_async():
+            response = await async_post(**_speech_request_args(text, voice_type, speed_ratio), timeout=20)
+        response.raise_for_status()
+        response_data = response.json()
+    except (httpx.HTTPError, ValueError) as e:
         raise TTSServiceError(f"无法连接到TTS服务: {e}")
 
+    return _decode_speech_response(response_data)
+
+
+def synthesize_audio(text: str, voice_type: str, emotion: str = "default") -> tuple[str, bytes]:
+    """
+    合成语音并返回 (缓存键, MP3字节)，优先命中音频缓存。
+    """
+    speed_ratio = _resolve_speed_ratio(emotion)
+    logger.info(f"情绪: '{emotion}', 映射语速为: {speed_ratio}")
+    cache_key = make_cache_key(text, voice_type, speed_ratio)
+
+    audio = AUDIO_CACHE.get(cache_key)
+    if audio is not None:
+        logger.info(f"TTS缓存命中: {cache_key[:12]}")
+        return cache_key, audio
+
+    def fetch():
+        fetched = _request_speech(text, voice_type, speed_ratio)
+        AUDIO_CACHE.put(cache_key, fetched)
+        return fetched
+
+    return cache_key, _TTS_FLIGHTS.do(cache_key, fetch)
+
+
+def generate_speech(text: str, voice_type: str, emotion: str = "default") -> str:
+    """
+    调用七牛云TTS API生成语音, 现在会根据外部配置文件调整语速。
+    返回base64编码的MP3数据。
+    """
+    _, audio = synthesize_audio(text, voice_type, emotion)
+    return base64.b64encode(audio).decode('ascii')
+
+
+async def asynthesize_audio(text: str, voice_type: str, emotion: str = "default") -> tuple[str, bytes]:
+    """synthesize_audio 的异步版本；缓存的磁盘读写放到线程中执行，避免阻塞事件循环"""
+    speed_ratio = _resolve_speed_ratio(emotion)
+    cache_key = make_cache_key(text, voice_type, speed_ratio)
+
+    audio = await asyncio.to_thread(AUDIO_CACHE.get, cache_key)
+    if audio is not None:
+        logger.info(f"TTS缓存命中: {cache_key[:12]}")
+        return cache_key, audio
+
+    async def fetch():
+        fetched = await _arequest_speech(text, voice_type, speed_ratio)
+        await asyncio.to_thread(AUDIO_CACHE.put, cache_key, fetched)
+        return fetched
+
+    return cache_key, await _TTS_FLIGHTS.do_async(cache_key, fetch)
+
+
+async def agenerate_speech(text: str, voice_type: str, emotion: str = "default") -> str:
+    """generate_speech 的异步版本，返回base64编码的MP3数据"""
+    _, audio = await asynthesize_audio(text, voice_type, emotion)
+    return base64.b64encode(audio).decode('ascii')
+
+
+def get_cached_audio(cache_key: str) -> bytes | None:
+    """按缓存键读取已合成的音频，键格式不合法或未缓存时返回None"""
+    if not _CACHE_KEY_PATTERN.fullmatch(cache_key):
+        return None
+    return AUDIO_CACHE.get(cache_key)
+
+
+def get_cache_stats() -> dict:
+    """返回音频缓存的命中统计"""
+    return AUDIO_CACHE.stats()
+
+
+def get_upstream_stats() -> dict:
+    """返回TTS调用的排队与合并统计"""
+    return {"limiter": TTS_LIMITER.stats(), "coalescing": _TTS_FLIGHTS.stats()}
+
+
+class SpeechPipeline:
+    """
+    分句流水线：文本边到达边分句，每个完整句子立即提交到线程池合成语音，
+    并按句子顺序产出音频片段。
+    情绪在流式回复中可能晚于前几句文本到达，在此之前提交的句子使用默认语速。
+    """
+
+    def __init__(self, voice_type: str, emotion: str = "default"):
+        self.voice_type = voice_type
+        self.emotion = emotion
+        self._splitter = SentenceBuffer()
+        self._pending = deque()  # (序号, 句子, Future)，按提交顺序排列
+        self._next_index = 0
+
+    def set_emotion(self, emotion: str):
+        self.emotion = emotion
+
+    def feed(self, text: str):
+        """追加一段文本，凑成完整句子的部分会立即提交合成"""
+        for sentence in self._splitter.feed(text):
+            self._submit(sentence)
+
+    def ready_segments(self) -> list:
+        """非阻塞地取出已按顺序完成的音频片段"""
+        segments = []
+        while self._pending and self._pending[0][2].done():
+            segments.append(self._collect(*self._pending.popleft()))
+        return segments
+
+    def finish(self):
+        """提交剩余文本，并按顺序阻塞产出全部音频片段"""
+        for sentence in self._splitter.flush():
+            self._submit(sentence)
+        while self._pending:
+            yield self._collect(*self._pending.popleft())
+
+    def cancel(self):
+        """取消尚未开始的合成任务（例如客户端已断开连接）"""
+        while self._pending:
+            self._pending.popleft()[2].cancel()
+
+    def _submit(self, sentence: str):
+        future = _SPEECH_EXECUTOR.submit(generate_speech, sentence, self.voice_type, self.emotion)
+        self._pending.append((self._next_index, sentence, future))
+        self._next_index += 1
+
+    @staticmethod
+    def _collect(index: int, sentence: str, future) -> dict:
+        segment = {"type": "audio", "index": index, "text": sentence}
+        # 单句合成失败（包括被取消或未预料的异常）不应中断整段回复，前端可跳过该片段
+        try:
+            segment["audioData"] = future.result()
+        except (TTSServiceError, UpstreamBusyError) as e:
+            logger.error(f"第 {index} 句语音合成失败: {e.message}")
+            segment.update(e.to_dict())
+        except (Exception, CancelledError, asyncio.CancelledError) as e:
+            logger.error(f"第 {index} 句语音合成时发生未预料的错误: {e!r}", exc_info=True)
+            segment.update(TTSServiceError().to_dict())
+        return segment
+
+
+class AsyncSpeechPipeline(SpeechPipeline):
+    """
+    SpeechPipeline 的异步版本：每个句子作为一个asyncio任务合成，
+    同时进行的合成数与线程池版本一样受 TTS_MAX_WORKERS 限制。
+    必须在事件循环中创建和使用。
+    """
+
+    async def finish(self):
+        """提交剩余文本，并按顺序等待产出全部音频片段"""
+        for sentence in self._splitter.flush():
+            self._submit(sentence)
+        while self._pending:
+            index, sentence, task = self._pending.popleft()
+            await asyncio.wait([task])
+            yield self._collect(index, sentence, task)
+
+    async def _synthesize(self, sentence: str, emotion: str) -> str:
+        global _async_speech_semaphore
+        if _async_speech_semaphore is None:
+            _async_speech_semaphore = asyncio.Semaphore(TTS_MAX_WORKERS)
+        async with _async_speech_semaphore:
+            return await agenerate_speech(sentence, self.voice_type, emotion)
+
+    def _submit(self, sentence: str):
+        task = asyncio.create_task(self._synthesize(sentence, self.emotion))
+        self._pending.append((self._next_index, sentence, task))
+        self._next_index += 1
+
+
+def generate_speech_segments(text: str, voice_type: str, emotion: str = "default"):
+    """将完整文本分句并发合成，按顺序逐段产出音频片段"""
+    pipeline = SpeechPipeline(voice_type, emotion)
+    pipeline.feed(text)
+    try:
+        yield from pipeline.finish()
+    finally:
+        pipeline.cancel()
+
+
+async def agenerate_speech_segments(text: str, voice_type: str, emotion: str = "default"):
+    """generate_speech_segments 的异步版本"""
+    pipeline = AsyncSpeechPipeline(voice_type, emotion)
+    pipeline.feed(text)
+    try:
+        async for segment in pipeline.finish():
+            yield segment
+    finally:
+        pipeline.cancel()
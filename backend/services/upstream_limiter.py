@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/16 15:05
+# @Author : Ray
+# @File : upstream_limiter.py
+# @Software: PyCharm
+"""
+上游调用控制：并发上限 + 令牌桶限速，以及相同请求的合并（single-flight）
+线程（Flask/后台任务）与协程（asgi.py）共用同一份并发额度
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+
+from backend.errors.exceptions import UpstreamBusyError
+from backend.utils.logger import logger
+
+# 等待上游额度的最长时间（秒），超时返回503而不是无限排队
+UPSTREAM_ACQUIRE_TIMEOUT = float(os.getenv("UPSTREAM_ACQUIRE_TIMEOUT", "30"))
+# 用于计算等待时间分位数的最近样本数
+_WAIT_SAMPLES = 1024
+
+
+class _Waiter:
+    """排队等待额度的调用方；额度在释放时直接移交给队首的等待者，保证先到先得"""
+    __slots__ = ("notify", "granted")
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+
+
+class _Permit:
+    """一份已获得的额度，release 可重复调用；也可作为上下文管理器使用"""
+
+    def __init__(self, limiter: "UpstreamLimiter"):
+        self._limiter = limiter
+        self._released = False
+
+    def release(self):
+        self._limiter._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class UpstreamLimiter:
+    """
+    针对单个上游服务的调用控制。
+    - 并发：同时进行的调用不超过 max_concurrency，超出的调用按到达顺序排队。
+    - 限速：rate > 0 时按令牌桶限制每秒发起的调用数，允许 burst 个调用的突发。
+    - 排队（含限速等待）超过 timeout 秒时引发 UpstreamBusyError。
+    """
+
+    def __init__(self, name: str, max_concurrency: int, rate: float = 0.0, burst: int = 1,
+                 timeout: float = UPSTREAM_ACQUIRE_TIMEOUT):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters = deque()
+        self._tokens = float(self.burst)
+        self._tokens_updated = time.monotonic()
+        self._acquired = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent_waits = deque(maxlen=_WAIT_SAMPLES)
+
+    def acquire(self) -> _Permit:
+        """阻塞获取一份额度，用法: with limiter.acquire(): ..."""
+        start = time.monotonic()
+        event = threading.Event()
+        waiter = self._enqueue(_Waiter(event.set))
+        if waiter is not None and not event.wait(self.timeout) and not self._withdraw(waiter):
+            self._on_timeout(start)
+        permit = _Permit(self)
+        delay = self._reserve_token(start, permit)
+        if delay > 0:
+            time.sleep(delay)
+        self._record_wait(time.monotonic() - start)
+        return permit
+
+    async def acquire_async(self) -> _Permit:
+        """acquire 的协程版本，排队期间不占用线程，用法: with await limiter.acquire_async(): ..."""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self._enqueue(_Waiter(lambda: loop.call_soon_threadsafe(_resolve, future)))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                if not self._withdraw(waiter):
+                    self._on_timeout(start)
+            except asyncio.CancelledError:
+                if self._withdraw(waiter):
+                    _Permit(self).release()
+                raise
+        permit = _Permit(self)
+        delay = self._reserve_token(start, permit)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                permit.release()
+                raise
+        self._record_wait(time.monotonic() - start)
+        return permit
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._recent_waits)
+            return {
+                "maxConcurrency": self.max_concurrency,
+                "inFlight": self._in_use,
+                "waiting": len(self._waiters),
+                "acquired": self._acquired,
+                "timeouts": self._timeouts,
+                "avgWaitMs": round(self._wait_total / self._acquired * 1000, 2) if self._acquired else 0.0,
+                "p95WaitMs": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 2) if waits else 0.0,
+                "maxWaitMs": round(self._wait_max * 1000, 2),
+            }
+
+    def _enqueue(self, waiter: _Waiter) -> _Waiter | None:
+        """有空闲额度且无人排队时直接占用并返回None，否则加入等待队列"""
+        with self._lock:
+            if self._in_use < self.max_concurrency and not self._waiters:
+                self._in_use += 1
+                return None
+            self._waiters.append(waiter)
+            return waiter
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """退出等待队列；如果在此之前恰好已获得额度，返回True"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _on_timeout(self, start: float):
+        with self._lock:
+            self._timeouts += 1
+        logger.warning(f"等待上游 '{self.name}' 的调用额度超时（{time.monotonic() - start:.1f} 秒）。")
+        raise UpstreamBusyError()
+
+    def _reserve_token(self, start: float, permit: _Permit) -> float:
+        """从令牌桶预定一个令牌，返回需要等待的秒数；等待会超过时限时归还额度并引发 UpstreamBusyError"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._tokens_updated) * self.rate)
+            self._tokens_updated = now
+            delay = max(0.0, -(self._tokens - 1) / self.rate)
+            if now + delay - start > self.timeout:
+                self._timeouts += 1
+                busy = True
+            else:
+                self._tokens -= 1
+                busy = False
+        if busy:
+            permit.release()
+            logger.warning(f"上游 '{self.name}' 的请求速率已达上限。")
+            raise UpstreamBusyError()
+        return delay
+
+    def _record_wait(self, waited: float):
+        with self._lock:
+            self._acquired += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._recent_waits.append(waited)
+
+    def _release(self, permit: _Permit):
+        with self._lock:
+            if permit._released:
+                return
+            permit._released = True
+            self._release_locked()
+
+    def _release_locked(self):
+        """释放一份额度（调用方需持有锁），有人排队时直接移交给队首"""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            waiter.notify()
+        else:
+            self._in_use -= 1
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    请求合并：相同键的调用正在进行时，后来者不再发起新调用，而是等待并共享同一个结果（或异常）。
+    线程调用与协程调用分别合并。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self._leaders = 0
+        self._shared = 0
+
+    def do(self, key: str, fn):
+        """执行 fn()，相同键的并发调用只执行一次"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._leaders += 1
+            else:
+                self._shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def do_async(self, key: str, fn):
+        """do 的协程版本，fn 返回一个协程。调用方被取消时不会取消共享的上游调用"""
+        task = self._async_calls.get(key)
+        if task is not None:
+            with self._lock:
+                self._shared += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(fn())
+        self._async_calls[key] = task
+        with self._lock:
+            self._leaders += 1
+
+        def on_done(finished):
+            if self._async_calls.get(key) is finished:
+                del self._async_calls[key]
+            # 所有调用方都已取消时，避免“异常未被获取”的警告
+            if not finished.cancelled():
+                finished.exception()
+
+        task.add_done_callback(on_done)
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"upstreamCalls": self._leaders, "coalesced": self._shared}
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/11 14:26
+# @Author : Ray
+# @File : voice_service.py
+# @Software: PyCharm
+"""
+音色列表服务：带TTL的内存缓存，过期后先返回旧数据并在后台刷新
+"""
+import os
+import time
+import threading
+
+import requests
+from backend.utils.logger import logger
+from backend.errors.exceptions import FulingException
+from backend.services.http_client import get_session
+
+# 缓存在 TTL 内视为新鲜；过期后仍可在 MAX_STALE 内直接返回，同时后台刷新
+VOICE_LIST_TTL = int(os.getenv("VOICE_LIST_TTL", "3600"))
+VOICE_LIST_MAX_STALE = int(os.getenv("VOICE_LIST_MAX_STALE", "86400"))
+
+_cache = {"data": None, "fetched_at": 0.0}
+_cache_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+def _fetch_voice_list():
+    """从TTS服务拉取音色列表"""
+    api_key = os.getenv("API_KEY")
+    base_url = os.getenv("API_BASE")
+    if not api_key or not base_url:
+        raise FulingException("TTS服务未在后端配置。", 500)
+
+    url = f"{base_url}/voice/list"
+    headers = {"Authorization": f"Bearer {api_key}"}
+
+    try:
+        # 添加超时设置，避免长时间等待
+        response = get_session().get(url, headers=headers, timeout=10)
+        response.raise_for_status()  # 确保请求成功
+        logger.info("成功从TTS服务获取音色列表")
+        return response.json()
+    except requests.exceptions.Timeout:
+        logger.error("获取音色列表请求超时")
+        raise FulingException("获取音色列表请求超时，请稍后重试。", 504)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"获取音色列表时发生网络错误: {e}")
+        raise FulingException("无法连接到TTS服务。", 503)
+
+
+def _refresh():
+    """同步刷新缓存；同一时间只有一个线程真正请求上游"""
+    with _refresh_lock:
+        data = _fetch_voice_list()
+        with _cache_lock:
+            _cache["data"] = data
+            _cache["fetched_at"] = time.monotonic()
+        return data
+
+
+def _refresh_in_background():
+    if _refresh_lock.locked():
+        return
+
+    def worker():
+        try:
+            _refresh()
+        except FulingException as e:
+            logger.warning(f"后台刷新音色列表失败，继续使用缓存数据: {e.message}")
+
+    threading.Thread(target=worker, name="voice-list-refresh", daemon=True).start()
+
+
+def get_voice_list(force_refresh: bool = False):
+    """
+    获取音色列表。
+    - 缓存新鲜：直接返回。
+    - 缓存过期但未超过最大陈旧时间：立即返回旧数据，并在后台刷新。
+    - 无缓存、过于陈旧或强制刷新：同步请求上游；失败时如有旧数据则降级返回旧数据。
+    """
+    with _cache_lock:
+        data = _cache["data"]
+        age = time.monotonic() - _cache["fetched_at"]
+
+    if data is not None and not force_refresh:
+        if age <= VOICE_LIST_TTL:
+            return data
+        if age <= VOICE_LIST_TTL + VOICE_LIST_MAX_STALE:
+            _refresh_in_background()
+            return data
+
+    try:
+        return _refresh()
+    except FulingException as e:
+        if data is None:
+            raise
+        logger.warning(f"刷新音色列表失败，返回缓存数据（已缓存 {age:.0f} 秒）: {e.message}")
+        return data
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/19 9:40
+# @Author : Ray
+# @File : __init__.py
+# @Software: PyCharm
+"""
+测试包：在任何测试模块导入业务代码之前准备测试环境。
+- 数据库指向临时目录，导入 app/asgi 时的 initialize_database 不会创建或修改真实的数据库文件
+- 补齐导入TTS服务与LLM客户端所需的上游配置（测试中不会真正调用上游），并关闭RAG的后台加载
+"""
+import os
+import atexit
+import shutil
+import tempfile
+
+_TEST_DIR = tempfile.mkdtemp(prefix="fuling-test-")
+atexit.register(shutil.rmtree, _TEST_DIR, ignore_errors=True)
+
+os.environ["DB_PATH"] = os.path.join(_TEST_DIR, "fuling_memory.db")
+for _key, _value in (("API_KEY", "test"), ("API_BASE", "http://127.0.0.1:9"), ("MODEL", "test"),
+                     ("RAG_ENABLED", "0")):
+    os.environ.setdefault(_key, _value)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/19 10:05
+# @Author : Ray
+# @File : database_case.py
+# @Software: PyCharm
+"""
+使用独立临时数据库的测试基类
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from backend.services import database_manager
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """每个测试用例在新的临时目录中初始化数据库，结束后关闭连接池中的连接并删除目录"""
+
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        patcher = mock.patch.object(database_manager, "DB_PATH", os.path.join(tmp_dir.name, "test.db"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 清理按注册的逆序执行：先关闭临时数据库的连接，再恢复 DB_PATH，最后删除目录
+        self.addCleanup(lambda: database_manager._get_pool().close_all())
+        database_manager.initialize_database()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/18 16:30
+# @Author : Ray
+# @File : test_asgi.py
+# @Software: PyCharm
+"""
+测试ASGI原生异步路由：二进制音频的 ETag/Range 处理与JSON错误格式
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+import httpx
+
+from backend.services import tts_service
+
+asgi = None
+
+AUDIO = b"0123456789"
+CACHE_KEY = "a" * 64
+
+
+def setUpModule():
+    # 导入 app 会初始化数据库（测试包已将其指向临时目录）并启动后台任务
+    global asgi
+    import asgi as asgi_module
+    asgi = asgi_module
+
+
+class TestAsyncSpeech(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(tts_service, "asynthesize_audio", mock.AsyncMock(return_value=(CACHE_KEY, AUDIO)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, json, headers=None) -> httpx.Response:
+        async def send():
+            transport = httpx.ASGITransport(app=asgi.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.post("/api/speech", json=json, headers=headers)
+        return asyncio.run(send())
+
+    def test_binary_audio(self):
+        response = self.post({"text": "你好", "voiceType": "v", "format": "binary"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, AUDIO)
+        self.assertEqual(response.headers["content-type"], "audio/mpeg")
+        self.assertEqual(response.headers["etag"], f'"{CACHE_KEY}"')
+        self.assertEqual(response.headers["accept-ranges"], "bytes")
+
+    def test_if_none_match(self):
+        response = self.post({"text": "你好", "voiceType": "v", "format": "binary"},
+                             headers={"If-None-Match": f'"{CACHE_KEY}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_range(self):
+        body = {"text": "你好", "voiceType": "v", "format": "binary"}
+        response = self.post(body, headers={"Range": "bytes=2-5"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, AUDIO[2:6])
+        self.assertEqual(response.headers["content-range"], f"bytes 2-5/{len(AUDIO)}")
+
+        response = self.post(body, headers={"Range": "bytes=100-"})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers["content-range"], f"bytes */{len(AUDIO)}")
+
+    def test_missing_parameter(self):
+        response = self.post({"text": "你好"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json())
+
+
+if __name__ == '__main__':
+    unittest.main()
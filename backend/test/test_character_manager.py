@@ -7,9 +7,12 @@
 """
 测试角色列表
 """
+import os
+import json
+import tempfile
 import unittest
 
-from backend.services.character_manager import get_all_characters
+from backend.services.character_manager import get_all_characters, CharacterRegistry
 
 
 class TestChatService(unittest.TestCase):
@@ -19,6 +22,51 @@ class TestChatService(unittest.TestCase):
         print(characters)
 
 
+class TestCharacterRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.registry = CharacterRegistry(self.tmp_dir.name, reload_interval=0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_character(self, character_id, **fields):
+        data = {"id": character_id, "name": character_id, "description": "d",
+                "imageUrl": "/x.png", "voiceType": "v", **fields}
+        with open(os.path.join(self.tmp_dir.name, f"{character_id}.json"), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        return data
+
+    def test_reload_only_on_change(self):
+        self.write_character("a")
+        self.assertEqual(self.registry.get("a")["name"], "a")
+        version = self.registry.version
+
+        self.registry.reload()
+        self.assertEqual(self.registry.version, version)
+
+        self.write_character("a", name="changed-name")
+        self.assertEqual(self.registry.get("a")["name"], "changed-name")
+        self.assertGreater(self.registry.version, version)
+
+        os.remove(os.path.join(self.tmp_dir.name, "a.json"))
+        self.assertIsNone(self.registry.get("a"))
+
+    def test_list_skips_incomplete_characters(self):
+        self.write_character("b")
+        with open(os.path.join(self.tmp_dir.name, "broken.json"), 'w', encoding='utf-8') as f:
+            f.write("{not json")
+        self.assertEqual([c["id"] for c in self.registry.list()], ["b"])
+
+    def test_put_updates_without_polling(self):
+        registry = CharacterRegistry(self.tmp_dir.name, reload_interval=3600)
+        registry.list()
+        data = self.write_character("c")
+        registry.put("c", data)
+        self.assertEqual(registry.get("c"), data)
+
+
 
 
 
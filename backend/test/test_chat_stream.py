@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/19 11:20
+# @Author : Ray
+# @File : test_chat_stream.py
+# @Software: PyCharm
+"""
+测试流式回复在客户端提前断开时释放调用额度并关闭上游连接
+"""
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from backend.services import chat_service
+
+
+class FakeStream:
+    """模拟OpenAI的同步流式响应"""
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.closed = False
+
+    def __iter__(self):
+        for delta in self.deltas:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+    def close(self):
+        self.closed = True
+
+
+class TestIterStreamEvents(unittest.TestCase):
+
+    def test_early_close_releases_upstream(self):
+        stream = FakeStream(['{"text": "你好', '，华生', '。", "emotion": "平静"}'])
+        permit = mock.Mock()
+        events = chat_service._iter_stream_events(stream, "sherlock", permit=permit)
+
+        self.assertNotEqual(next(events)["type"], "done")
+        events.close()
+
+        self.assertTrue(stream.closed)
+        permit.release.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
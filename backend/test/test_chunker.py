@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/17 17:50
+# @Author : Ray
+# @File : test_chunker.py
+# @Software: PyCharm
+"""
+测试知识库分段
+"""
+import unittest
+
+from backend.utils.chunker import chunk_text, chunk_section, estimate_tokens
+
+
+class TestChunker(unittest.TestCase):
+
+    def test_separator_is_hard_boundary(self):
+        text = "福尔摩斯住在贝克街。\n---\n华生是一名医生。\n---\n\n"
+        self.assertEqual(chunk_text(text, max_tokens=100), ["福尔摩斯住在贝克街。", "华生是一名医生。"])
+
+    def test_short_section_unchanged(self):
+        section = "第一行。\n第二行，保留换行。"
+        self.assertEqual(chunk_section(section, max_tokens=100), [section])
+
+    def test_long_section_split_on_sentences_with_overlap(self):
+        sentences = [f"第{i}句话的内容比较长一些。" for i in range(20)]
+        chunks = chunk_section("".join(sentences), max_tokens=40, overlap_tokens=15)
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(estimate_tokens(chunk), 40)
+            self.assertTrue(chunk.endswith("。"))
+        # 每个段落以上一段的最后一句开头
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertTrue(current.startswith(previous[previous.rindex("第"):]))
+        self.assertIn(sentences[-1], chunks[-1])
+
+    def test_oversized_sentence_is_cut(self):
+        chunks = chunk_section("长" * 250, max_tokens=100, overlap_tokens=0)
+        self.assertEqual("".join(chunks), "长" * 250)
+        self.assertTrue(all(estimate_tokens(chunk) <= 100 for chunk in chunks))
+
+    def test_oversized_english_sentence_respects_token_cap(self):
+        sentence = "a" * 20 + " " + "word " * 200 + "x" * 500
+        chunks = chunk_section(sentence, max_tokens=30, overlap_tokens=0)
+        self.assertTrue(all(estimate_tokens(chunk) <= 30 for chunk in chunks))
+        self.assertEqual("".join(chunks).replace(" ", ""), sentence.replace(" ", ""))
+        # 在空白处断开，不把单词切成两半
+        for chunk in chunks:
+            if "word" in chunk:
+                self.assertTrue(set(chunk.split()) <= {"a" * 20, "word"})
+
+    def test_english_keeps_spacing(self):
+        text = "Holmes lives on Baker Street. Watson is a doctor. They solve cases together."
+        chunks = chunk_section(text, max_tokens=12, overlap_tokens=0)
+        self.assertEqual(chunks[0], "Holmes lives on Baker Street.")
+        self.assertEqual(" ".join(chunks), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
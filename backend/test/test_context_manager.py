@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/14 15:12
+# @Author : Ray
+# @File : test_context_manager.py
+# @Software: PyCharm
+"""
+测试上下文窗口管理
+"""
+import unittest
+from unittest import mock
+
+from backend.services import context_manager
+
+
+def make_history(turns):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"第{i}轮的问题，" + "内容" * 20})
+        history.append({"role": "assistant", "content": f"第{i}轮的回答，" + "回复" * 20})
+    return history
+
+
+class TestContextManager(unittest.TestCase):
+
+    def setUp(self):
+        # 折叠摘要的缓存是模块级的，每个用例使用新的缓存
+        patcher = mock.patch.object(context_manager, "_fold_cache", context_manager._FoldCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_count_tokens(self):
+        self.assertEqual(context_manager.count_tokens(""), 0)
+        self.assertGreater(context_manager.count_tokens("我亲爱的华生"), 0)
+        self.assertGreater(context_manager.count_tokens("hello world " * 10), context_manager.count_tokens("hello"))
+
+    def test_short_history_is_kept(self):
+        history = make_history(2)
+        messages = context_manager.fit_messages("系统提示", history, "新问题", summarizer=None)
+        self.assertEqual(len(messages), len(history) + 2)
+        self.assertEqual(messages[-1], {"role": "user", "content": "新问题"})
+
+    def test_long_history_is_folded_within_budget(self):
+        calls = []
+
+        def summarizer(previous, messages):
+            calls.append((previous, len(messages)))
+            return f"摘要{len(calls)}"
+
+        budget = 600
+        with mock.patch.object(context_manager, "get_token_budget", return_value=budget):
+            history = make_history(20)
+            messages = context_manager.fit_messages("系统提示", history, "新问题", summarizer=summarizer)
+            total = sum(context_manager.count_message_tokens(m) for m in messages)
+            self.assertLessEqual(total, budget)
+            self.assertEqual(messages[1]["content"].splitlines()[-1], "摘要1")
+            self.assertEqual(messages[-1]["content"], "新问题")
+
+            # 新增的轮次越过下一个折叠边界后，只需要总结新折叠的部分，并复用之前的摘要
+            history += make_history(context_manager.FOLD_STEP_MESSAGES // 2)
+            context_manager.fit_messages("系统提示", history, "再问", summarizer=summarizer)
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(calls[1][0], "摘要1")
+            self.assertLess(calls[1][1], calls[0][1])
+
+    def test_fold_boundary_is_not_rounded_up(self):
+        budget = 600
+        with mock.patch.object(context_manager, "get_token_budget", return_value=budget):
+            history = make_history(20)
+            messages = context_manager.fit_messages("系统提示", history, "新问题", summarizer=lambda p, m: "摘要")
+        kept = messages[2:-1]
+        # 对齐后保留的消息不少于扣除摘要预留后恰好放得下的数量
+        available = (budget - context_manager.SUMMARY_RESERVED_TOKENS
+                     - sum(context_manager.count_message_tokens(m) for m in (messages[0], messages[-1])))
+        fitting = 0
+        while sum(context_manager.count_message_tokens(m) for m in history[len(history) - fitting - 1:]) <= available:
+            fitting += 1
+        self.assertGreaterEqual(len(kept), fitting)
+        self.assertLess(len(kept), fitting + context_manager.FOLD_STEP_MESSAGES)
+        self.assertEqual((len(history) - len(kept)) % context_manager.FOLD_STEP_MESSAGES, 0)
+
+    def test_latest_turn_is_always_kept(self):
+        with mock.patch.object(context_manager, "get_token_budget", return_value=50):
+            history = make_history(2)
+            messages = context_manager.fit_messages("系统提示", history, "新问题", summarizer=lambda p, m: "摘要")
+        self.assertEqual(messages[-3:-1], history[-2:])
+        self.assertEqual(messages[1]["content"].splitlines()[-1], "摘要")
+
+    def test_long_summary_counts_against_budget(self):
+        budget = 600
+        with mock.patch.object(context_manager, "get_token_budget", return_value=budget):
+            messages = context_manager.fit_messages("系统提示", make_history(20), "新问题",
+                                                    summarizer=lambda p, m: "很长的摘要" * 90)
+        # 摘要超出了预留的token数，需要多折叠几条消息
+        self.assertGreater(context_manager.count_tokens(messages[1]["content"]), context_manager.SUMMARY_RESERVED_TOKENS)
+        self.assertLessEqual(sum(context_manager.count_message_tokens(m) for m in messages), budget)
+        self.assertEqual(messages[-1]["content"], "新问题")
+
+
+if __name__ == '__main__':
+    unittest.main()
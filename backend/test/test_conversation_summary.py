@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/18 11:05
+# @Author : Ray
+# @File : test_conversation_summary.py
+# @Software: PyCharm
+"""
+测试对话摘要的增量更新：失败时不写入，历史不一致时完整重新总结
+"""
+import unittest
+from unittest import mock
+
+from backend.errors.exceptions import LlmServiceError
+from backend.services import chat_service, database_manager
+from backend.test.database_case import DatabaseTestCase
+
+
+def make_history(turns: int, prefix: str = "") -> list:
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"{prefix}问题{i}"})
+        history.append({"role": "assistant", "content": f"{prefix}回答{i}"})
+    return history
+
+
+class TestSummarizeAndSave(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation_id = database_manager.create_conversation("sherlock")
+
+    def test_incremental_summary(self):
+        prompts = []
+
+        def fake_completion(messages, temperature):
+            prompts.append(messages[0]["content"])
+            return f"摘要{len(prompts)}"
+
+        history = make_history(2)
+        with mock.patch.object(chat_service, "_request_completion", side_effect=fake_completion):
+            self.assertEqual(chat_service.summarize_and_save(self.conversation_id, history), "摘要1")
+            history += make_history(1, prefix="新")
+            self.assertEqual(chat_service.summarize_and_save(self.conversation_id, history), "摘要2")
+
+        # 第二次只发送新增的消息和旧摘要
+        self.assertIn("摘要1", prompts[1])
+        self.assertIn("新问题0", prompts[1])
+        self.assertNotIn("问题1", prompts[1].replace("新问题", ""))
+        summary, summarized_count, _ = database_manager.get_summary_state(self.conversation_id)
+        self.assertEqual((summary, summarized_count), ("摘要2", len(history)))
+
+    def test_failure_is_not_persisted(self):
+        with mock.patch.object(chat_service, "_request_completion", return_value="摘要1"):
+            chat_service.summarize_and_save(self.conversation_id, make_history(2))
+
+        with mock.patch.object(chat_service, "_request_completion", side_effect=RuntimeError("超时")):
+            with self.assertRaises(LlmServiceError):
+                chat_service.summarize_and_save(self.conversation_id, make_history(3))
+
+        summary, summarized_count, _ = database_manager.get_summary_state(self.conversation_id)
+        self.assertEqual((summary, summarized_count), ("摘要1", 4))
+
+    def test_rewritten_history_is_fully_resummarized(self):
+        prompts = []
+
+        def fake_completion(messages, temperature):
+            prompts.append(messages[0]["content"])
+            return f"摘要{len(prompts)}"
+
+        with mock.patch.object(chat_service, "_request_completion", side_effect=fake_completion):
+            chat_service.summarize_and_save(self.conversation_id, make_history(2))
+            # 长度足够，但前缀已被客户端改写
+            chat_service.summarize_and_save(self.conversation_id, make_history(3, prefix="改"))
+
+        self.assertNotIn("此前的摘要", prompts[1])
+        self.assertIn("改问题0", prompts[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
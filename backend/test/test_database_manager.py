@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/18 10:20
+# @Author : Ray
+# @File : test_database_manager.py
+# @Software: PyCharm
+"""
+测试对话消息的保存、读取与历史记录恢复
+"""
+import unittest
+
+from backend.services import database_manager
+from backend.test.database_case import DatabaseTestCase
+
+
+class TestMessages(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation_id = database_manager.create_conversation("sherlock")
+
+    def test_append_and_get_messages(self):
+        database_manager.append_messages(self.conversation_id, [
+            {"role": "user", "content": "你好"},
+            {"role": "assistant", "content": "你好，华生。", "emotion": "平静"},
+        ])
+        database_manager.append_messages(self.conversation_id, [{"role": "user", "content": "红发会是什么？"}])
+
+        messages = database_manager.get_messages(self.conversation_id)
+        self.assertEqual([m["content"] for m in messages], ["你好", "你好，华生。", "红发会是什么？"])
+        self.assertEqual(messages[1]["emotion"], "平静")
+        self.assertIsNone(messages[0]["emotion"])
+
+        # limit 只取最近的若干条，仍按时间顺序排列
+        recent = database_manager.get_messages(self.conversation_id, limit=2)
+        self.assertEqual([m["content"] for m in recent], ["你好，华生。", "红发会是什么？"])
+        self.assertEqual(database_manager.get_messages("missing"), [])
+
+    def test_history_rehydration(self):
+        database_manager.append_messages(self.conversation_id, [
+            {"role": "user", "content": "你是谁？"},
+            {"role": "assistant", "content": "歇洛克·福尔摩斯。", "emotion": "自信"},
+        ])
+        self.assertEqual(database_manager.get_history(self.conversation_id), [
+            {"role": "user", "content": "你是谁？"},
+            {"role": "assistant", "content": "歇洛克·福尔摩斯。"},
+        ])
+
+    def test_delete_conversation_removes_messages(self):
+        database_manager.append_messages(self.conversation_id, [{"role": "user", "content": "再见"}])
+        database_manager.delete_conversation(self.conversation_id)
+        self.assertEqual(database_manager.get_messages(self.conversation_id), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/17 15:30
+# @Author : Ray
+# @File : test_hybrid_search.py
+# @Software: PyCharm
+"""
+测试BM25分词与检索、RRF融合、MMR去重和背景资料拼接
+"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from backend.utils.bm25 import BM25Index, tokenize
+from backend.services.hybrid_search import (
+    CONTEXT_SEPARATOR, HybridRetriever, reciprocal_rank_fusion, mmr_select, pack_context
+)
+from backend.services.context_manager import count_tokens
+from backend.services.retrievers import NumpyRetriever
+from backend.test.test_retrievers import write_index
+
+
+class TestBM25(unittest.TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("红发会 Holmes"), ["红发", "发会", "holmes"])
+        self.assertEqual(tokenize("谁"), ["谁"])
+        self.assertNotIn("什么", tokenize("红发会是什么"))
+
+    def test_search_and_round_trip(self):
+        index = BM25Index.build(["a", "b", "c"], ["红发会的骗局", "波希米亚丑闻", "银行金库与地道"])
+        self.assertEqual(index.search("红发会是什么？")[0][0], "a")
+        self.assertEqual(index.search("完全无关"), [])
+
+        path = os.path.join(tempfile.mkdtemp(), "x.bm25.json")
+        index.save(path)
+        self.assertEqual(BM25Index.load(path).search("地道", k=1), index.search("地道", k=1))
+
+    def test_min_terms(self):
+        index = BM25Index.build(["a", "b"], ["红发会的骗局", "银行金库与地道"])
+        # “红色的银行家”与文档b只共享“银行”一个词项
+        self.assertEqual([doc_id for doc_id, _ in index.search("红色的银行家", min_terms=1)], ["b"])
+        self.assertEqual(index.search("红色的银行家", min_terms=2), [])
+        # 查询只有一个词项时，命中该词项即可
+        self.assertEqual(index.search("银行", min_terms=2)[0][0], "b")
+
+
+class TestFusion(unittest.TestCase):
+
+    def test_rrf_rewards_agreement(self):
+        scores = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]])
+        self.assertEqual(max(scores, key=scores.get), "b")
+        self.assertEqual(set(scores), {"a", "b", "c", "d"})
+
+    def test_mmr_skips_duplicates(self):
+        vectors = {"a": np.array([1.0, 0.0]), "a2": np.array([1.0, 0.01]), "b": np.array([0.0, 1.0])}
+        relevance = {"a": 1.0, "a2": 0.95, "b": 0.8}
+        self.assertEqual(mmr_select(relevance, vectors, top_k=2, lambda_=0.5), ["a", "b"])
+        self.assertEqual(mmr_select(relevance, vectors, top_k=2, lambda_=1.0), ["a", "a2"])
+
+    def test_pack_context_respects_budget(self):
+        documents = ["甲" * 50, "乙" * 50, "丙" * 10]
+        budget = count_tokens(documents[0]) + count_tokens(CONTEXT_SEPARATOR) + count_tokens(documents[2])
+        packed = pack_context(documents, token_budget=budget)
+        self.assertIn("甲", packed)
+        self.assertNotIn("乙", packed)
+        self.assertIn("丙", packed)
+        # 第一段即使超出预算也会保留
+        self.assertEqual(pack_context(["丁" * 100], token_budget=10), "丁" * 100)
+
+
+class TestHybridRetriever(unittest.TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.documents = ["红发会的骗局", "波希米亚丑闻", "银行金库与地道", "血字的研究"]
+        self.matrix = np.eye(4, dtype=np.float32) * 10
+        write_index(self.index_dir, "sherlock", self.documents, self.matrix)
+        ids = [f"sherlock_{i}" for i in range(4)]
+        BM25Index.build(ids, self.documents).save(os.path.join(self.index_dir, "sherlock.bm25.json"))
+
+    def test_keyword_match_rescues_distant_vector(self):
+        retriever = HybridRetriever(NumpyRetriever(self.index_dir), self.index_dir, max_distance=50)
+        # 查询向量离所有文档都很远，向量检索无结果，但关键词命中了“红发会”
+        hits = retriever.search("sherlock", "红发会是什么", np.full(4, 100, dtype=np.float32), top_k=2)
+        self.assertEqual([hit.document for hit in hits], ["红发会的骗局"])
+
+    def test_no_relevant_knowledge(self):
+        retriever = HybridRetriever(NumpyRetriever(self.index_dir), self.index_dir, max_distance=50)
+        self.assertEqual(retriever.search("sherlock", "今天天气", np.full(4, 100, dtype=np.float32)), [])
+
+    def test_single_shared_term_is_not_knowledge(self):
+        retriever = HybridRetriever(NumpyRetriever(self.index_dir), self.index_dir, max_distance=50)
+        self.assertEqual(retriever.search("sherlock", "研究一下天气", np.full(4, 100, dtype=np.float32)), [])
+
+    def test_distance_cutoff_from_similarity(self):
+        retriever = HybridRetriever(NumpyRetriever(self.index_dir), self.index_dir, min_similarity=0.5)
+        query_vector = np.array([10, 0, 0, 0], dtype=np.float32)
+        self.assertAlmostEqual(retriever.distance_cutoff(query_vector), 100.0)
+        # 换算与向量尺度无关：同一方向、放大10倍的查询，截断距离同比放大
+        self.assertAlmostEqual(retriever.distance_cutoff(query_vector * 10), 10000.0)
+        fixed = HybridRetriever(NumpyRetriever(self.index_dir), self.index_dir, max_distance=7)
+        self.assertEqual(fixed.distance_cutoff(query_vector), 7)
+
+    def test_vector_and_keyword_fused(self):
+        retriever = HybridRetriever(NumpyRetriever(self.index_dir), self.index_dir)
+        hits = retriever.search("sherlock", "地道", self.matrix[1], top_k=2)
+        self.assertEqual({hit.document for hit in hits}, {"波希米亚丑闻", "银行金库与地道"})
+
+
+if __name__ == '__main__':
+    unittest.main()
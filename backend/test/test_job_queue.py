@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/18 14:10
+# @Author : Ray
+# @File : test_job_queue.py
+# @Software: PyCharm
+"""
+测试后台任务队列的持久化、失败重试与重启后的任务恢复
+"""
+import queue
+import unittest
+from unittest import mock
+
+from backend.services import database_manager, job_queue
+from backend.test.database_case import DatabaseTestCase
+
+
+class TestJobQueue(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # 不启动工作线程，测试中直接从队列取出任务执行
+        for patcher in (
+                mock.patch.object(job_queue, "_queue", queue.Queue()),
+                mock.patch.dict(job_queue._handlers, clear=True),
+                mock.patch.object(job_queue, "_schedule_retry"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_next(self):
+        job_queue._run_job(job_queue._queue.get_nowait())
+
+    def test_job_is_persisted(self):
+        job_queue.register_handler("echo", lambda payload: {"echo": payload["text"]})
+        job_id = job_queue.enqueue("echo", {"text": "你好"})
+        self.assertEqual(job_queue.get_job_status(job_id)["status"], "queued")
+
+        self.run_next()
+        status = job_queue.get_job_status(job_id)
+        self.assertEqual((status["status"], status["attempts"], status["result"]), ("succeeded", 1, {"echo": "你好"}))
+        self.assertIsNone(job_queue.get_job_status("missing"))
+
+    def test_failed_job_is_retried(self):
+        handler = mock.Mock(side_effect=[RuntimeError("上游超时"), {"ok": True}])
+        job_queue.register_handler("flaky", handler)
+        job_id = job_queue.enqueue("flaky", {})
+
+        self.run_next()
+        status = job_queue.get_job_status(job_id)
+        self.assertEqual((status["status"], status["attempts"], status["error"]), ("queued", 1, "上游超时"))
+        job_queue._schedule_retry.assert_called_once_with(job_id, job_queue.JOB_RETRY_DELAY)
+
+        # 重试时由计时器重新放入队列
+        job_queue._run_job(job_id)
+        status = job_queue.get_job_status(job_id)
+        self.assertEqual((status["status"], status["attempts"], status["result"]), ("succeeded", 2, {"ok": True}))
+
+    def test_job_fails_after_max_attempts(self):
+        job_queue.register_handler("broken", mock.Mock(side_effect=RuntimeError("错误")))
+        job_id = job_queue.enqueue("broken", {}, max_attempts=2)
+        self.run_next()
+        job_queue._run_job(job_id)
+
+        status = job_queue.get_job_status(job_id)
+        self.assertEqual((status["status"], status["attempts"]), ("failed", 2))
+        # 已结束的任务不会再次执行
+        job_queue._run_job(job_id)
+        self.assertEqual(job_queue.get_job_status(job_id)["attempts"], 2)
+
+    def test_restart_recovers_only_expired_leases(self):
+        job_queue.register_handler("echo", lambda payload: payload)
+        queued = database_manager.create_job("echo", {"n": 1}, 3)
+        expired = database_manager.create_job("echo", {"n": 2}, 3)
+        alive = database_manager.create_job("echo", {"n": 3}, 3)
+        finished = database_manager.create_job("echo", {"n": 4}, 3)
+        with database_manager.get_db_connection() as conn:
+            for job_id, lease in ((expired, -1), (alive, 60)):
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = 1, lease_expires_at = ? WHERE id = ?",
+                    (database_manager.utc_timestamp(lease), job_id)
+                )
+        database_manager.update_job(finished, "succeeded", result={"n": 4})
+
+        self.assertEqual(set(job_queue._recover_jobs()), {queued, expired})
+        # 仍持有租约的任务不能被其他执行者领取
+        self.assertIsNone(database_manager.claim_job(alive, 60))
+
+        job_queue._run_job(expired)
+        status = job_queue.get_job_status(expired)
+        self.assertEqual((status["status"], status["attempts"]), ("succeeded", 2))
+        self.assertEqual(job_queue.get_job_status(alive)["status"], "running")
+
+
+if __name__ == '__main__':
+    unittest.main()
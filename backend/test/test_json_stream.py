@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/9 11:05
+# @Author : Ray
+# @File : test_json_stream.py
+# @Software: PyCharm
+"""
+测试流式JSON解析
+"""
+import json
+import unittest
+
+from backend.utils.json_stream import StreamingResponseParser
+
+
+def feed_in_pieces(parser, text, size):
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i:i + size]))
+    return events
+
+
+class TestStreamingResponseParser(unittest.TestCase):
+
+    def test_json_response_streamed_char_by_char(self):
+        payload = {"response": "我亲爱的华生，\"红发会\"只是个骗局。\n😀", "emotion": "分析"}
+        raw = json.dumps(payload)  # 默认转义非ASCII字符，覆盖 \uXXXX 与代理对
+        parser = StreamingResponseParser()
+        events = feed_in_pieces(parser, raw, 1)
+
+        text = ''.join(e["text"] for e in events if e["type"] == "delta")
+        emotions = [e["emotion"] for e in events if e["type"] == "emotion"]
+        self.assertEqual(text, payload["response"])
+        self.assertEqual(emotions, ["分析"])
+        self.assertEqual(parser.finish(), {"text": payload["response"], "emotion": "分析"})
+
+    def test_emotion_before_response(self):
+        raw = json.dumps({"emotion": "开心", "response": "你好"}, ensure_ascii=False)
+        parser = StreamingResponseParser()
+        events = feed_in_pieces(parser, raw, 3)
+        self.assertEqual(events[0], {"type": "emotion", "emotion": "开心"})
+        self.assertEqual(parser.text, "你好")
+
+    def test_plain_text_fallback(self):
+        parser = StreamingResponseParser()
+        events = feed_in_pieces(parser, "  Hello there", 4)
+        self.assertEqual(''.join(e["text"] for e in events), "Hello there")
+        self.assertEqual(parser.finish(), {"text": "Hello there", "emotion": "专注"})
+
+    def test_missing_response_key(self):
+        parser = StreamingResponseParser()
+        parser.feed('{"emotion": "分析"}')
+        with self.assertRaises(ValueError):
+            parser.finish()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/17 10:15
+# @Author : Ray
+# @File : test_query_encoder.py
+# @Software: PyCharm
+"""
+测试查询向量的缓存与批量编码
+"""
+import threading
+import unittest
+from concurrent.futures import Future
+
+import numpy as np
+
+from backend.services.query_encoder import QueryEncoder
+
+
+class TestQueryEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def encode_batch(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts])
+
+    def test_queued_queries_are_batched(self):
+        encoder = QueryEncoder(self.encode_batch, max_batch_size=4, max_wait_ms=1000)
+        queries = ["红发会是什么", "贝克街在哪里", "红发会是什么", "谁是华生"]
+        # 先放入队列再启动工作线程，确保所有查询进入同一批次
+        futures = []
+        for query in queries:
+            future = Future()
+            encoder._queue.put((query, future))
+            futures.append(future)
+        encoder._ensure_worker()
+        results = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(self.batches[0], ["红发会是什么", "贝克街在哪里", "谁是华生"])
+        self.assertEqual(results[3].tolist(), [4.0, 1.0])
+        self.assertIs(results[0], results[2])
+
+    def test_normalized_queries_hit_cache(self):
+        encoder = QueryEncoder(self.encode_batch, max_wait_ms=0)
+        first = encoder.encode("who is  Watson")
+        second = encoder.encode("  who is Watson ")
+        self.assertIs(first, second)
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(encoder.stats()["cacheHits"], 1)
+
+    def test_encode_errors_propagate(self):
+        def fail(texts):
+            raise RuntimeError("模型不可用")
+
+        encoder = QueryEncoder(fail, max_wait_ms=0)
+        with self.assertRaises(RuntimeError):
+            encoder.encode("你好")
+
+    def test_mismatched_batch_fails_every_query(self):
+        encoder = QueryEncoder(lambda texts: np.zeros((1, 2)), max_batch_size=2, max_wait_ms=1000)
+        futures = [Future(), Future()]
+        for query, future in zip(["你好", "再见"], futures):
+            encoder._queue.put((query, future))
+        encoder._ensure_worker()
+        for future in futures:
+            self.assertIsInstance(future.exception(timeout=5), ValueError)
+        self.assertEqual(encoder.stats()["cacheItems"], 0)
+
+    def test_encode_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow(texts):
+            release.wait()
+            return np.zeros((len(texts), 2))
+
+        encoder = QueryEncoder(slow, max_wait_ms=0, timeout=0.05)
+        with self.assertRaises(TimeoutError):
+            encoder.encode("你好")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/16 18:05
+# @Author : Ray
+# @File : test_rag_service.py
+# @Software: PyCharm
+"""
+测试RAG服务的就绪状态与回退行为
+"""
+import unittest
+from unittest import mock
+
+from backend.services import rag_service
+
+
+class TestRagService(unittest.TestCase):
+
+    def test_is_knowledge_query(self):
+        self.assertTrue(rag_service.is_knowledge_query("红发会是什么？"))
+        self.assertTrue(rag_service.is_knowledge_query("Who is Watson?"))
+        self.assertFalse(rag_service.is_knowledge_query("你好呀"))
+
+    def test_retrieve_falls_back_until_ready(self):
+        with mock.patch.object(rag_service, "_status", "loading"), \
+                mock.patch.object(rag_service, "start_background_init") as start:
+            self.assertIsNone(rag_service.retrieve_context("sherlock", "红发会是什么？"))
+            self.assertEqual(rag_service.get_status()["status"], "loading")
+            start.assert_called_once()
+
+    def test_retrieve_falls_back_on_encode_timeout(self):
+        retriever = mock.Mock()
+        with mock.patch.object(rag_service, "_status", "ready"), \
+                mock.patch.object(rag_service, "RETRIEVER", retriever), \
+                mock.patch.object(rag_service, "encode_query", side_effect=TimeoutError):
+            self.assertIsNone(rag_service.retrieve_context("sherlock", "红发会是什么？"))
+        retriever.search.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
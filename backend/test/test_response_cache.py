@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/15 17:30
+# @Author : Ray
+# @File : test_response_cache.py
+# @Software: PyCharm
+"""
+测试聊天回复缓存
+"""
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from backend.services import chat_service
+from backend.services.response_cache import ResponseCache, normalize_message, is_enabled_for
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_normalize_message(self):
+        self.assertEqual(normalize_message("  你是谁？ "), "你是谁")
+        self.assertEqual(normalize_message("What   is Philosophy?"), "what is philosophy")
+
+    def test_exact_hit_is_scoped_by_prompt(self):
+        cache = ResponseCache(max_items=10, ttl=60)
+        cache.store("li_bai", "提示A", "你是谁？", {"text": "吾乃李白", "emotion": "豪放"})
+        self.assertEqual(cache.lookup("li_bai", "提示A", "你是谁")["text"], "吾乃李白")
+        self.assertIsNone(cache.lookup("li_bai", "提示B", "你是谁"))
+        self.assertIsNone(cache.lookup("chen_xi", "提示A", "你是谁"))
+
+    def test_ttl_and_lru(self):
+        cache = ResponseCache(max_items=1, ttl=0)
+        cache.store("a", "p", "m", {"text": "t", "emotion": "e"})
+        self.assertIsNone(cache.lookup("a", "p", "m"))
+
+        cache = ResponseCache(max_items=1, ttl=60)
+        cache.store("a", "p", "m1", {"text": "1", "emotion": "e"})
+        cache.store("a", "p", "m2", {"text": "2", "emotion": "e"})
+        self.assertIsNone(cache.lookup("a", "p", "m1"))
+        self.assertEqual(cache.stats()["items"], 1)
+
+    def test_semantic_hit(self):
+        vectors = {"你是谁": [1.0, 0.0], "请问你是谁呀": [0.99, 0.05], "今天天气如何": [0.0, 1.0]}
+        cache = ResponseCache(max_items=10, ttl=60, embed=lambda t: np.array(vectors[t]), similarity=0.9)
+        cache.store("li_bai", "p", "你是谁", {"text": "吾乃李白", "emotion": "豪放"})
+        self.assertEqual(cache.lookup("li_bai", "p", "请问你是谁呀")["text"], "吾乃李白")
+        self.assertIsNone(cache.lookup("li_bai", "p", "今天天气如何"))
+        self.assertEqual(cache.stats()["semanticHits"], 1)
+
+    def test_character_opt_out(self):
+        self.assertFalse(is_enabled_for({"response_cache": False}))
+
+
+class TestChatCacheability(unittest.TestCase):
+
+    def test_history_is_never_cached(self):
+        # 历史记录被全部折叠且摘要失败时，消息列表只剩系统提示和本轮用户消息
+        messages = [{"role": "system", "content": "提示"}, {"role": "user", "content": "你是谁？"}]
+        history = [{"role": "user", "content": "我叫华生。"}, {"role": "assistant", "content": "幸会。"}]
+        with mock.patch.object(chat_service, "_build_chat_messages", return_value=(messages, {})), \
+                mock.patch.object(chat_service.response_cache, "RESPONSE_CACHE") as cache:
+            self.assertEqual(chat_service._prepare_chat("sherlock", "你是谁？", history), (messages, None, None))
+            cache.lookup.assert_not_called()
+
+            cache.lookup.return_value = None
+            self.assertEqual(chat_service._prepare_chat("sherlock", "你是谁？", []), (messages, "提示", None))
+
+
+if __name__ == '__main__':
+    unittest.main()
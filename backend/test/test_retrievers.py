@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/17 12:10
+# @Author : Ray
+# @File : test_retrievers.py
+# @Software: PyCharm
+"""
+测试NumPy向量检索后端
+"""
+import os
+import json
+import time
+import tempfile
+import unittest
+
+import numpy as np
+
+from backend.services.retrievers import NumpyRetriever
+
+
+def write_index(index_dir, character_id, documents, matrix):
+    np.save(os.path.join(index_dir, f"{character_id}.npy"), np.asarray(matrix, dtype=np.float32))
+    with open(os.path.join(index_dir, f"{character_id}.json"), 'w', encoding='utf-8') as f:
+        json.dump({"ids": [f"{character_id}_{i}" for i in range(len(documents))], "documents": documents}, f, ensure_ascii=False)
+
+
+class TestNumpyRetriever(unittest.TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.matrix = rng.normal(size=(50, 8)).astype(np.float32)
+        self.documents = [f"段落{i}" for i in range(50)]
+        write_index(self.index_dir, "sherlock", self.documents, self.matrix)
+
+    def test_top_k_matches_brute_force(self):
+        retriever = NumpyRetriever(self.index_dir)
+        query = self.matrix[7] + 0.01
+        results = retriever.search("sherlock", query, k=3)
+
+        expected = np.sum((self.matrix - query) ** 2, axis=1)
+        order = np.argsort(expected)[:3]
+        self.assertEqual([hit.document for hit in results], [self.documents[i] for i in order])
+        self.assertAlmostEqual(results[0].distance, float(expected[order[0]]), places=3)
+
+    def test_unknown_character_and_reload(self):
+        retriever = NumpyRetriever(self.index_dir, mmap=False)
+        self.assertEqual(retriever.search("nobody", self.matrix[0]), [])
+        self.assertEqual(retriever.search("sherlock", self.matrix[0])[0].document, "段落0")
+
+        time.sleep(0.01)
+        write_index(self.index_dir, "sherlock", ["新段落"], self.matrix[:1])
+        results = retriever.search("sherlock", self.matrix[0], k=5)
+        self.assertEqual([hit.document for hit in results], ["新段落"])
+        self.assertAlmostEqual(results[0].distance, 0.0, places=4)
+
+    def test_get_records(self):
+        retriever = NumpyRetriever(self.index_dir)
+        records = retriever.get_records("sherlock", ["sherlock_3", "missing"])
+        self.assertEqual(list(records), ["sherlock_3"])
+        document, vector = records["sherlock_3"]
+        self.assertEqual(document, "段落3")
+        np.testing.assert_array_equal(vector, self.matrix[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/19 11:50
+# @Author : Ray
+# @File : test_speech_pipeline.py
+# @Software: PyCharm
+"""
+测试分句语音合成：单句失败时只影响该句，其余句子照常产出
+"""
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import requests
+
+from backend.services import tts_service
+
+
+def fake_speech(sentence, voice_type, emotion):
+    if "第二" in sentence:
+        raise requests.ConnectionError("连接被重置")
+    return f"audio:{sentence}"
+
+
+class TestSpeechPipeline(unittest.TestCase):
+
+    def test_unexpected_error_only_affects_its_sentence(self):
+        with mock.patch.object(tts_service, "generate_speech", side_effect=fake_speech):
+            segments = list(tts_service.generate_speech_segments("第一句话说的是贝克街的事情。第二句话说的是红发会的骗局。第三句话说的是华生医生的来历。", "v"))
+
+        self.assertEqual([segment["index"] for segment in segments], [0, 1, 2])
+        self.assertEqual(segments[0]["audioData"], "audio:第一句话说的是贝克街的事情。")
+        self.assertNotIn("audioData", segments[1])
+        self.assertEqual(segments[1]["error"]["type"], "TTSServiceError")
+        self.assertEqual(segments[2]["audioData"], "audio:第三句话说的是华生医生的来历。")
+
+    def test_cancelled_sentence_yields_error_segment(self):
+        future = Future()
+        future.cancel()
+        segment = tts_service.SpeechPipeline._collect(0, "你好。", future)
+        self.assertEqual(segment["error"]["type"], "TTSServiceError")
+
+
+if __name__ == '__main__':
+    unittest.main()
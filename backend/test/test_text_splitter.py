@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/9 16:10
+# @Author : Ray
+# @File : test_text_splitter.py
+# @Software: PyCharm
+"""
+测试中英文分句
+"""
+import unittest
+
+from backend.utils.text_splitter import last_sentence_end, split_sentences, SentenceBuffer
+
+
+class TestTextSplitter(unittest.TestCase):
+
+    def test_last_sentence_end(self):
+        text = "你看到了吗？“红发会”只是个骗局！”其余的部分"
+        self.assertEqual(text[:last_sentence_end(text)], "你看到了吗？“红发会”只是个骗局！”")
+        self.assertEqual(last_sentence_end("Pi is 3.14 and"), 0)
+
+    def test_split_sentences(self):
+        text = "我亲爱的华生，你看到了吗？“红发会”只是个骗局！Pi is 3.14. Elementary"
+        self.assertEqual(
+            split_sentences(text),
+            ["我亲爱的华生，你看到了吗？", "“红发会”只是个骗局！", "Pi is 3.14.", "Elementary"]
+        )
+
+    def test_sentence_buffer_streaming(self):
+        text = "嗯。今夜月色很好，举杯邀明月吧！Hi. I am glad."
+        buffer = SentenceBuffer()
+        sentences = []
+        for char in text:
+            sentences.extend(buffer.feed(char))
+        sentences.extend(buffer.flush())
+        self.assertEqual(sentences, ["嗯。今夜月色很好，举杯邀明月吧！", "Hi. I am glad."])
+        self.assertEqual(buffer.flush(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/10 11:02
+# @Author : Ray
+# @File : test_tts_cache.py
+# @Software: PyCharm
+"""
+测试TTS音频缓存
+"""
+import os
+import tempfile
+import unittest
+
+from backend.services.tts_cache import AudioCache, make_cache_key
+
+
+class TestAudioCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache_key_depends_on_speed(self):
+        self.assertNotEqual(make_cache_key("你好", "v1", 1.0), make_cache_key("你好", "v1", 1.05))
+        self.assertEqual(make_cache_key("你好", "v1", 1.0), make_cache_key("你好", "v1", 1.0))
+
+    def test_memory_lru_and_disk_tier(self):
+        cache = AudioCache(max_items=1, cache_dir=self.cache_dir, max_disk_bytes=1024)
+        cache.put("a", b"aaa")
+        cache.put("b", b"bbb")
+        # "a" 已被挤出内存层，但仍可从磁盘层读取
+        self.assertEqual(cache.get("b"), b"bbb")
+        self.assertEqual(cache.get("a"), b"aaa")
+        self.assertIsNone(cache.get("c"))
+        stats = cache.stats()
+        self.assertEqual((stats["memoryHits"], stats["diskHits"], stats["misses"]), (1, 1, 1))
+
+    def test_disk_tier_survives_restart_and_evicts(self):
+        cache = AudioCache(max_items=4, cache_dir=self.cache_dir, max_disk_bytes=10)
+        cache.put("a", b"12345")
+        cache.put("b", b"12345")
+        cache.put("c", b"12345")
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["b.mp3", "c.mp3"])
+
+        reloaded = AudioCache(max_items=4, cache_dir=self.cache_dir, max_disk_bytes=10)
+        self.assertEqual(reloaded.get("c"), b"12345")
+        self.assertIsNone(reloaded.get("a"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/16 16:20
+# @Author : Ray
+# @File : test_upstream_limiter.py
+# @Software: PyCharm
+"""
+测试上游调用的并发限制、限速与请求合并
+"""
+import time
+import asyncio
+import threading
+import unittest
+
+from backend.errors.exceptions import UpstreamBusyError
+from backend.services.upstream_limiter import UpstreamLimiter, SingleFlight
+
+
+class TestUpstreamLimiter(unittest.TestCase):
+
+    def test_concurrency_is_capped(self):
+        limiter = UpstreamLimiter("test", max_concurrency=2)
+        peak = []
+        lock = threading.Lock()
+        running = [0]
+
+        def work():
+            with limiter.acquire():
+                with lock:
+                    running[0] += 1
+                    peak.append(running[0])
+                time.sleep(0.02)
+                with lock:
+                    running[0] -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 2)
+        stats = limiter.stats()
+        self.assertEqual((stats["acquired"], stats["inFlight"], stats["waiting"]), (6, 0, 0))
+
+    def test_timeout_raises_busy(self):
+        limiter = UpstreamLimiter("test", max_concurrency=1, timeout=0.05)
+        permit = limiter.acquire()
+        with self.assertRaises(UpstreamBusyError):
+            limiter.acquire()
+        permit.release()
+        permit.release()  # 重复释放不应多归还额度
+        self.assertEqual(limiter.stats()["timeouts"], 1)
+        self.assertEqual(limiter.stats()["inFlight"], 0)
+
+    def test_token_bucket_delays_bursts(self):
+        limiter = UpstreamLimiter("test", max_concurrency=10, rate=20, burst=1)
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.acquire().release()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_async_waiters_share_slots_with_threads(self):
+        limiter = UpstreamLimiter("test", max_concurrency=1)
+        held = limiter.acquire()
+
+        async def main():
+            waiter = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0.02)
+            self.assertFalse(waiter.done())
+            threading.Timer(0.01, held.release).start()
+            permit = await asyncio.wait_for(waiter, 1)
+            permit.release()
+
+        asyncio.run(main())
+        self.assertEqual(limiter.stats()["inFlight"], 0)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        flights = SingleFlight("test")
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            return "audio"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.do("key", fetch))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["audio"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.stats(), {"upstreamCalls": 1, "coalesced": 4})
+
+    def test_async_calls_are_coalesced(self):
+        flights = SingleFlight("test")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return "text"
+
+        async def main():
+            return await asyncio.gather(*(flights.do_async("key", fetch) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(main()), ["text"] * 3)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/17 14:05
+# @Author : Ray
+# @File : bm25.py
+# @Software: PyCharm
+"""
+BM25关键词检索：中文按相邻二字切分（单字成段时保留单字），英文与数字按单词切分
+索引由 index_knowledge_base.py 在建库时生成，服务端只负责加载和查询
+"""
+import os
+import re
+import json
+import math
+from collections import Counter
+
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+")
+# 疑问句式产生的二字词项，几乎不携带检索信息，建库与查询时一并去掉
+_STOP_TERMS = {
+    "什么", "是什", "么是", "为什", "么样", "怎么", "怎样", "请问", "告诉", "诉我",
+    "哪里", "哪个", "是谁", "谁是", "一下", "介绍", "绍一", "关于", "有什", "了什",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    """将文本切分为检索用的词项"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if not run[0].isascii() and len(run) > 1:
+            tokens.extend(
+                bigram for bigram in (run[i:i + 2] for i in range(len(run) - 1)) if bigram not in _STOP_TERMS
+            )
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    """
+    倒排索引形式的BM25。
+    postings 为 {词项: [[文档序号, 词频], ...]}，doc_lengths 为各文档的词项数，ids 与文档序号一一对应。
+    """
+
+    def __init__(self, ids: list, doc_lengths: list, postings: dict, k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        total = len(doc_lengths)
+        self.avg_length = sum(doc_lengths) / total if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+
+    @classmethod
+    def build(cls, ids: list, documents: list, **params) -> "BM25Index":
+        postings = {}
+        doc_lengths = []
+        for doc_index, document in enumerate(documents):
+            counts = Counter(tokenize(document))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append([doc_index, tf])
+        return cls(list(ids), doc_lengths, postings, **params)
+
+    def search(self, query: str, k: int = 10, min_terms: int = 1) -> list[tuple[str, float]]:
+        """
+        返回得分最高的 k 个 (文档ID, 得分)。
+        只包含至少命中 min_terms 个不同查询词项的文档；查询本身的词项不足 min_terms 个时要求全部命中。
+        """
+        terms = set(tokenize(query))
+        required = max(1, min(min_terms, len(terms)))
+        scores = {}
+        matched = Counter()
+        for term in terms:
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf[term]
+            for doc_index, tf in docs:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / self.avg_length)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[doc_index] += 1
+        top = sorted(
+            ((doc_index, score) for doc_index, score in scores.items() if matched[doc_index] >= required),
+            key=lambda item: item[1], reverse=True
+        )[:k]
+        return [(self.ids[doc_index], score) for doc_index, score in top]
+
+    def to_dict(self) -> dict:
+        return {
+            "ids": self.ids,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+            "k1": self.k1,
+            "b": self.b,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        return cls(
+            [str(doc_id) for doc_id in data["ids"]], data["doc_lengths"], data["postings"],
+            k1=data.get("k1", 1.5), b=data.get("b", 0.75)
+        )
+
+    def save(self, path: str):
+        """原子写入：先写临时文件再替换"""
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/17 17:20
+# @Author : Ray
+# @File : chunker.py
+# @Software: PyCharm
+"""
+知识库分段：--- 为硬边界；超过 max_tokens 的段落按句子切分后重新组合，相邻段落之间保留 overlap_tokens 的重叠
+索引脚本与运行时导入共用，只依赖标准库
+"""
+import os
+import re
+
+from .text_splitter import split_sentences
+
+# 单个段落的token上限，以及切分长段落时相邻段落重叠的token数
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+# 人工放置的段落分隔符
+SECTION_SEPARATOR = "---"
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+# 切分超长句子时每次查找的字符数上限（每个token对应的字符数一般不超过该值），避免对整句反复统计token
+_MAX_CHARS_PER_TOKEN = 8
+
+
+def estimate_tokens(text: str) -> int:
+    """估算token数：每个中日韩字符约1个token，英文单词约每4个字符1个token，标点各1个"""
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    rest = _CJK_PATTERN.sub(" ", text)
+    return cjk_count + sum((len(w) + 3) // 4 for w in _WORD_PATTERN.findall(rest))
+
+
+def split_sections(text: str) -> list[str]:
+    """按 --- 切分为人工划分的段落"""
+    return [section.strip() for section in text.split(SECTION_SEPARATOR) if section.strip()]
+
+
+def _sentence_spans(text: str) -> list[tuple[int, int]]:
+    """句子在原文中的 (起点, 终点)，组合时直接截取原文以保留原有的空白与换行"""
+    spans = []
+    position = 0
+    for sentence in split_sentences(text):
+        start = text.find(sentence, position)
+        if start < 0:
+            continue
+        position = start + len(sentence)
+        spans.append((start, position))
+    return spans
+
+
+def _longest_prefix(text: str, start: int, end: int, max_tokens: int, count_tokens) -> int:
+    """二分查找 text[start:终点] 不超过 max_tokens 的最远终点，至少前进一个字符"""
+    low, high = start + 1, min(end, start + max_tokens * _MAX_CHARS_PER_TOKEN)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[start:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _split_long(text: str, start: int, end: int, max_tokens: int, count_tokens) -> list[tuple[int, int]]:
+    """单句超过上限时按token数切分：每段取不超过上限的最长前缀，英文等有空格的文本尽量在空白处断开"""
+    spans = []
+    while start < end:
+        cut = _longest_prefix(text, start, end, max_tokens, count_tokens)
+        if cut < end and not text[cut].isspace() and not text[cut - 1].isspace():
+            space = max(text.rfind(" ", start + 1, cut), text.rfind("\n", start + 1, cut))
+            if space > start:
+                cut = space
+        spans.append((start, cut))
+        start = cut
+    return spans
+
+
+def chunk_section(section: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                  count_tokens=estimate_tokens) -> list[str]:
+    """
+    切分单个段落。不超过上限的段落原样返回；否则按句子贪心组合，
+    每个新段落以前一段末尾不超过 overlap_tokens 的若干句开头。
+    """
+    if count_tokens(section) <= max_tokens:
+        return [section]
+
+    spans = []
+    for start, end in _sentence_spans(section):
+        spans.extend(_split_long(section, start, end, max_tokens, count_tokens))
+    lengths = [count_tokens(section[start:end]) for start, end in spans]
+
+    chunks = []
+    first = 0
+    while first < len(spans):
+        # 从 first 开始尽量多地放入句子，至少放入一句
+        last = first
+        used = lengths[first]
+        while last + 1 < len(spans) and used + lengths[last + 1] <= max_tokens:
+            last += 1
+            used += lengths[last]
+        chunks.append(section[spans[first][0]:spans[last][1]].strip())
+        if last + 1 >= len(spans):
+            break
+
+        # 下一段从末尾的重叠句子开始，但必须向前推进
+        next_first = last + 1
+        overlap = 0
+        while next_first - 1 > first and overlap + lengths[next_first - 1] <= overlap_tokens:
+            next_first -= 1
+            overlap += lengths[next_first]
+        if overlap and overlap + lengths[last + 1] > max_tokens:
+            next_first = last + 1
+        first = next_first
+    return chunks
+
+
+def chunk_sections(sections, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                   count_tokens=estimate_tokens):
+    """逐个切分段落并依次产出，sections 可以是生成器（如逐块读取的文件）"""
+    for section in sections:
+        yield from chunk_section(section, max_tokens, overlap_tokens, count_tokens)
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+               count_tokens=estimate_tokens) -> list[str]:
+    """切分整段文本：先按 --- 切分，再把超长段落切分为不超过 max_tokens 的段落"""
+    return list(chunk_sections(split_sections(text), max_tokens, overlap_tokens, count_tokens))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/9 10:21
+# @Author : Ray
+# @File : json_stream.py
+# @Software: PyCharm
+"""
+流式JSON解析：从LLM逐块返回的 {"response": ..., "emotion": ...} 中增量提取字段
+"""
+import json
+import re
+
+_RESPONSE_KEY_PATTERN = re.compile(r'"response"\s*:\s*"')
+_EMOTION_PATTERN = re.compile(r'"emotion"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+_SIMPLE_ESCAPES = {
+    '"': '"', '\\': '\\', '/': '/',
+    'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+}
+
+
+def _decode_partial_string(buffer: str, pos: int) -> tuple[str, int, bool]:
+    """
+    从 pos 开始解码一个尚未结束的JSON字符串值。
+    返回 (已解码文本, 下次继续解码的位置, 字符串是否已闭合)。
+    不完整的转义序列会留到下一次解码。
+    """
+    parts = []
+    length = len(buffer)
+    while pos < length:
+        char = buffer[pos]
+        if char == '"':
+            return ''.join(parts), pos + 1, True
+        if char != '\\':
+            parts.append(char)
+            pos += 1
+            continue
+
+        if pos + 1 >= length:
+            break
+        escape = buffer[pos + 1]
+        if escape == 'u':
+            hex_digits = buffer[pos + 2:pos + 6]
+            if len(hex_digits) < 4:
+                break
+            code = int(hex_digits, 16)
+            # 代理对需要等到低位也到达后再一起解码
+            if 0xD800 <= code <= 0xDBFF:
+                low = buffer[pos + 6:pos + 12]
+                if len(low) < 6:
+                    break
+                parts.append(json.loads(f'"{buffer[pos:pos + 12]}"'))
+                pos += 12
+            else:
+                parts.append(chr(code))
+                pos += 6
+        else:
+            parts.append(_SIMPLE_ESCAPES.get(escape, escape))
+            pos += 2
+    return ''.join(parts), pos, False
+
+
+class StreamingResponseParser:
+    """
+    增量解析LLM的流式输出。
+    每次 feed 一段新文本，返回可以立即下发的事件列表：
+    - {"type": "delta", "text": ...}      新解码出的回复文本
+    - {"type": "emotion", "emotion": ...} 情绪字段（只下发一次）
+    如果输出不是以 '{' 开头，则按纯文本处理，与非流式接口的回退行为保持一致。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._mode = None  # "json" 或 "text"
+        self._response_pos = None
+        self._response_closed = False
+        self._text_parts = []
+        self._emotion = None
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._text_parts)
+
+    @property
+    def emotion(self) -> str | None:
+        return self._emotion
+
+    def feed(self, chunk: str) -> list:
+        if not chunk:
+            return []
+        self._buffer += chunk
+
+        if self._mode is None:
+            stripped = self._buffer.lstrip()
+            if not stripped:
+                return []
+            self._mode = "json" if stripped.startswith('{') else "text"
+            if self._mode == "text":
+                chunk = stripped
+
+        if self._mode == "text":
+            self._text_parts.append(chunk)
+            return [{"type": "delta", "text": chunk}]
+
+        events = []
+        if self._response_pos is None:
+            match = _RESPONSE_KEY_PATTERN.search(self._buffer)
+            if match:
+                self._response_pos = match.end()
+
+        if self._response_pos is not None and not self._response_closed:
+            decoded, self._response_pos, self._response_closed = _decode_partial_string(
+                self._buffer, self._response_pos
+            )
+            if decoded:
+                self._text_parts.append(decoded)
+                events.append({"type": "delta", "text": decoded})
+
+        if self._emotion is None:
+            match = _EMOTION_PATTERN.search(self._buffer)
+            if match:
+                self._emotion = json.loads(f'"{match.group(1)}"')
+                events.append({"type": "emotion", "emotion": self._emotion})
+
+        return events
+
+    def finish(self, default_emotion: str = "专注") -> dict:
+        """
+        流结束后校验完整输出并返回最终结果。
+        JSON格式不正确或缺少 'response' 字段时引发 ValueError。
+        """
+        if self._mode != "json":
+            return {"text": self._buffer.strip(), "emotion": default_emotion}
+
+        parsed = json.loads(self._buffer)
+        if not isinstance(parsed, dict) or "response" not in parsed:
+            raise ValueError("LLM返回的JSON缺少'response'字段")
+        return {
+            "text": parsed["response"],
+            "emotion": parsed.get("emotion", default_emotion)
+        }
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time : 2025/10/9 15:32
+# @Author : Ray
+# @File : text_splitter.py
+# @Software: PyCharm
+"""
+中英文分句
+"""
+import re
+
+# 句末标点：中文句号/叹号/问号/分号/省略号，英文 ! ? ; 以及换行
+_HARD_TERMINATORS = "。！？；…!?;\n"
+# 紧跟在句末标点后、应归入上一句的收尾符号
+_CLOSING_CHARS = "”’」』）)]】》\"'"
+# 英文句点只有后面跟空白时才视为句末，避免切开 3.14、Mr.Holmes 之类的文本
+_SENTENCE_END_PATTERN = re.compile(
+    rf"(?:[{re.escape(_HARD_TERMINATORS)}]+|\.+(?=\s))[{re.escape(_CLOSING_CHARS)}]*"
+)
+
+
+def _split_complete(text: str) -> tuple[list[str], str]:
+    """返回 (所有已完整结束的句子, 尚未结束的剩余文本)"""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END_PATTERN.finditer(text):
+        end = match.end()
+        # 标点位于文本末尾时，后面可能还会跟来收尾符号或更多标点，暂不切分
+        if end == len(text) and text[-1] not in "\n":
+            break
+        sentence = text[start:end].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = end
+    return sentences, text[start:]
+
+
+def last_sentence_end(text: str) -> int:
+    """text 中最后一个句末标点（含收尾符号）之后的位置，没有句末标点时返回0"""
+    end = 0
+    for match in _SENTENCE_END_PATTERN.finditer(text):
+        end = match.end()
+    return end
+
+
+def split_sentences(text: str) -> list[str]:
+    """将一段完整文本切分为句子列表"""
+    sentences, rest = _split_complete(text)
+    rest = rest.strip()
+    if rest:
+        sentences.append(rest)
+    return sentences
+
+
+class SentenceBuffer:
+    """
+    增量分句器：不断追加流式文本，每凑满一个完整句子就吐出。
+    过短的句子（如“嗯。”）会与后一句合并，避免产生大量零碎的TTS请求。
+    """
+
+    def __init__(self, min_length: int = 6):
+        self.min_length = min_length
+        self._buffer = ""
+        self._pending = ""
+
+    def feed(self, text: str) -> list[str]:
+        self._buffer += text
+        sentences, self._buffer = _split_complete(self._buffer)
+        return self._merge_short(sentences)
+
+    def flush(self) -> list[str]:
+        """流结束时调用，吐出剩余的所有文本"""
+        rest = self._buffer.strip()
+        if self._pending:
+            rest = f"{self._pending} {rest}" if rest and rest[0].isascii() else self._pending + rest
+        self._pending = ""
+        self._buffer = ""
+        return [rest] if rest else []
+
+    def _merge_short(self, sentences: list[str]) -> list[str]:
+        ready = []
+        for sentence in sentences:
+            if self._pending:
+                # 英文句子之间保留空格
+                separator = " " if self._pending[-1].isascii() and sentence[0].isascii() else ""
+                sentence = self._pending + separator + sentence
+            if len(sentence) < self.min_length:
+                self._pending = sentence
+                continue
+            self._pending = ""
+            ready.append(sentence)
+        return ready